@@ -0,0 +1,188 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pytest
+import requests
+from tweet_fetcher import LOOKUP_PATH, RateLimiter, fetch_batch, fetch_tweets, read_checkpoint
+
+# Tests of tweet_fetcher.py against a local stub of the statuses lookup endpoint, which returns the tweets
+# whose id is not a multiple of 7, and enforces a budget of requests per window with the rate limit headers
+# of the Twitter API, answering 429 once the budget of the window is used up.
+
+
+class StubAPI:
+
+    def __init__(self, budget=1000, window=2.0, rate_limited=0):
+        self.budget = budget
+        self.window = window
+        self.rate_limited = rate_limited
+        self.lock = threading.Lock()
+        self.requests = []
+        self.responses = []
+        self.remaining = budget
+        self.reset = time.time() + window
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                api.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}{}'.format(self.server.server_address[1], LOOKUP_PATH)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def handle(self, request):
+        query = parse_qs(urlparse(request.path).query)
+        ids = [int(tweet_id) for tweet_id in query['id'][0].split(',')]
+        with self.lock:
+            now = time.time()
+            if now >= self.reset:
+                self.remaining, self.reset = self.budget, now + self.window
+            if self.rate_limited > 0 or self.remaining <= 0:
+                self.rate_limited = max(self.rate_limited - 1, 0)
+                status, body = 429, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]}
+            else:
+                self.remaining -= 1
+                status, body = 200, [{'id': tweet_id, 'full_text': 'tweet {}'.format(tweet_id)}
+                                     for tweet_id in ids if tweet_id % 7]
+            self.requests.append(ids)
+            self.responses.append((now, status))
+            headers = {'x-rate-limit-limit': self.budget, 'x-rate-limit-remaining': max(self.remaining, 0),
+                       'x-rate-limit-reset': self.reset}
+
+        data = json.dumps(body).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            request.send_header(name, str(value))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def statuses(self):
+        return [status for _, status in self.responses]
+
+
+@pytest.fixture
+def stub_api():
+    apis = []
+
+    def start(**kwargs):
+        api = StubAPI(**kwargs)
+        api.thread.start()
+        apis.append(api)
+        return api
+
+    yield start
+    for api in apis:
+        api.server.shutdown()
+        api.server.server_close()
+
+
+def read_tweets(path):
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_batches_of_100_ids_and_failed_ids(stub_api, tmp_path):
+    api = stub_api()
+    tweet_ids = list(range(1, 251))
+    outfile, checkpoint = str(tmp_path / 'tweet_json.txt'), str(tmp_path / 'tweet_json.checkpoint')
+
+    failed = fetch_tweets(requests.Session(), tweet_ids, outfile, checkpoint, url=api.url, workers=2)
+
+    assert sorted(len(ids) for ids in api.requests) == [50, 100, 100]
+    assert sorted(tweet_id for ids in api.requests for tweet_id in ids) == tweet_ids
+    missing = {tweet_id for tweet_id in tweet_ids if tweet_id % 7 == 0}
+    assert failed == missing
+    assert sorted(tweet['id'] for tweet in read_tweets(outfile)) == [i for i in tweet_ids if i % 7]
+
+    # the checkpoint records every id requested, and the ones not found
+    done, checkpoint_failed = read_checkpoint(checkpoint)
+    assert done == set(tweet_ids)
+    assert checkpoint_failed == missing
+
+
+def test_resume_from_checkpoint(stub_api, tmp_path):
+    api = stub_api()
+    tweet_ids = list(range(1, 301))
+    outfile, checkpoint = str(tmp_path / 'tweet_json.txt'), str(tmp_path / 'tweet_json.checkpoint')
+
+    # an earlier run checkpointed the first batch, wrote the tweets of a second batch without its checkpoint,
+    # and stopped while writing the checkpoint of a third
+    with open(checkpoint, 'w', encoding='utf-8') as file:
+        file.write(json.dumps({'done': tweet_ids[:100], 'failed': [7, 14]}) + '\n')
+        file.write('{"done": [201, 202')
+    with open(outfile, 'w', encoding='utf-8') as file:
+        for tweet_id in tweet_ids[100:200]:
+            file.write(json.dumps({'id': tweet_id}) + '\n')
+
+    failed = fetch_tweets(requests.Session(), tweet_ids, outfile, checkpoint, url=api.url, workers=2)
+
+    assert [sorted(ids) for ids in api.requests] == [tweet_ids[200:]]
+    assert failed == {7, 14} | {tweet_id for tweet_id in tweet_ids[200:] if tweet_id % 7 == 0}
+    assert read_checkpoint(checkpoint)[0] == set(tweet_ids[:100]) | set(tweet_ids[200:])
+
+    # a second resume has nothing left to fetch
+    fetch_tweets(requests.Session(), tweet_ids, outfile, checkpoint, url=api.url, workers=2)
+    assert len(api.requests) == 1
+
+
+def test_rate_limiter_waits_for_the_window_to_reset(stub_api, tmp_path):
+    api = stub_api(budget=2, window=1.5)
+    tweet_ids = list(range(1, 501))
+    outfile, checkpoint = str(tmp_path / 'tweet_json.txt'), str(tmp_path / 'tweet_json.checkpoint')
+
+    fetch_tweets(requests.Session(), tweet_ids, outfile, checkpoint, url=api.url, workers=1)
+
+    # the limiter learned the budget from the headers and waited for the next windows instead of sending
+    # requests answered with 429, except the first requests of the run, sent before any header was read
+    statuses = api.statuses()
+    assert statuses.count(200) == 5
+    assert statuses[:2] == [200, 200]
+    assert 429 not in statuses[2:]
+    times = [now for now, status in api.responses if status == 200]
+    assert times[2] - times[0] >= 1.0
+    assert times[4] - times[2] >= 1.0
+
+
+def test_429_marks_the_budget_used_up_and_retries(stub_api):
+    api = stub_api(window=1.0, rate_limited=1)
+    limiter = RateLimiter()
+
+    start = time.time()
+    tweets, missing = fetch_batch(requests.Session(), api.url, list(range(1, 101)), limiter)
+
+    assert api.statuses() == [429, 200]
+    assert api.responses[1][0] >= api.responses[0][0] + 1.0
+    assert time.time() - start >= 1.0
+    assert len(tweets) + len(missing) == 100
+    assert missing == [tweet_id for tweet_id in range(1, 101) if tweet_id % 7 == 0]
+
+
+def test_429_retries_are_bounded(stub_api):
+    api = stub_api(window=0.1, rate_limited=10)
+
+    with pytest.raises(RuntimeError):
+        fetch_batch(requests.Session(), api.url, [1, 2, 3], RateLimiter(), max_retries=1)
+    assert api.statuses() == [429, 429]
+
+
+def test_rate_limiter_counts_down_the_budget():
+    limiter = RateLimiter()
+    limiter.update({'x-rate-limit-remaining': '2', 'x-rate-limit-reset': str(time.time() + 60)})
+
+    limiter.acquire()
+    limiter.acquire()
+    assert limiter.remaining == 0
+
+    # a late response reporting a higher budget for the same window does not raise it again
+    limiter.update({'x-rate-limit-remaining': '1', 'x-rate-limit-reset': str(limiter.reset)})
+    assert limiter.remaining == 0
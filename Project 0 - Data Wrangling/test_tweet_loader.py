@@ -0,0 +1,40 @@
+import json
+import pytest
+from tweet_loader import load_tweet_json, format_created_at
+
+# Tests that the created_at strings of tweet_json.txt come back unchanged from load_tweet_json and format_created_at,
+# as written to the timestamp_y column of twitter_archive_master.csv.
+
+TWEETS = [{'id': 892420643555336193, 'favorite_count': 39467, 'retweet_count': 8853,
+           'created_at': 'Tue Aug 01 16:23:56 +0000 2017'},
+          {'id': 666020888022790149, 'favorite_count': 2535, 'retweet_count': 532,
+           'created_at': 'Sun Nov 15 22:32:08 +0000 2015'}]
+
+
+def write_tweets(filepath, lines):
+    with open(filepath, 'w', encoding='utf-8') as file:
+        file.write(''.join(lines))
+
+
+@pytest.mark.parametrize('cache', [False, True])
+def test_created_at_round_trip(tmp_path, cache):
+    filepath = str(tmp_path / 'tweet_json.txt')
+    write_tweets(filepath, [json.dumps(tweet) + '\n' for tweet in TWEETS])
+
+    for _ in range(2):
+        df = load_tweet_json(filepath, cache=cache)
+        assert list(df['tweet_id']) == [tweet['id'] for tweet in TWEETS]
+        assert list(df['favourites_count']) == [tweet['favorite_count'] for tweet in TWEETS]
+        assert list(format_created_at(df['timestamp'])) == [tweet['created_at'] for tweet in TWEETS]
+
+
+def test_truncated_last_line(tmp_path):
+    # a fetch stopped while writing the third tweet
+    filepath = str(tmp_path / 'tweet_json.txt')
+    cut = json.dumps({'id': 666029285002620928, 'favorite_count': 1, 'retweet_count': 1,
+                      'created_at': 'Sun Nov 15 23:05:30 +0000 2015'})[:40]
+    write_tweets(filepath, [json.dumps(tweet) + '\n' for tweet in TWEETS] + [cut])
+
+    df = load_tweet_json(filepath, cache=False)
+    assert list(df['tweet_id']) == [tweet['id'] for tweet in TWEETS]
+    assert list(format_created_at(df['timestamp'])) == [tweet['created_at'] for tweet in TWEETS]
@@ -0,0 +1,80 @@
+import os
+import json
+import pandas as pd
+import pytest
+import wrangle_pipeline
+from wrangle_pipeline import clean_names, run_pipeline, stage_keys, STAGES
+
+# Tests of wrangle_pipeline.py on a sample of the twitter archive and of the image predictions, with a tweet_json.txt
+# written for the sampled tweets, and of its stage caches.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def sources(tmp_path):
+    archive = pd.read_csv(os.path.join(HERE, 'twitter-archive-enhanced.csv'), dtype=str, keep_default_na=False)
+    predictions = pd.read_csv(os.path.join(HERE, 'image-predictions.tsv'), sep='\t', dtype=str, keep_default_na=False)
+    archive = archive[archive['tweet_id'].isin(predictions['tweet_id'])]
+    # the first tweets, with the ones rated out of 11 and some of the 'None' names
+    sample = archive[(archive.index < 60) | (archive['rating_denominator'] == '11')]
+    assert (sample['name'] == 'None').sum() > 5
+
+    paths = [str(tmp_path / 'archive.csv'), str(tmp_path / 'predictions.tsv'), str(tmp_path / 'tweet_json.txt')]
+    sample.to_csv(paths[0], index=False)
+    predictions[predictions['tweet_id'].isin(sample['tweet_id'])].to_csv(paths[1], sep='\t', index=False)
+    with open(paths[2], 'w') as file:
+        for i, (tweet_id, timestamp) in enumerate(zip(sample['tweet_id'], sample['timestamp'])):
+            created_at = pd.Timestamp(timestamp).strftime('%a %b %d %H:%M:%S %z %Y')
+            file.write(json.dumps({'id': int(tweet_id), 'favorite_count': i * 10, 'retweet_count': i,
+                                   'created_at': created_at}) + '\n')
+    return sample, paths
+
+
+def test_invalid_names_are_dropped(sources):
+    sample, paths = sources
+    df = run_pipeline(*paths, cache=False)
+    kept = set(df['tweet_id'].astype(str))
+    assert kept
+    assert not kept & set(sample.loc[sample['name'].isin(['None', 'a', 'an', 'the']), 'tweet_id'])
+    assert not set(df['name'].astype(str)) & set(wrangle_pipeline.INVALID_NAMES)
+
+    # a literal 'None' read as a string is dropped like a missing name
+    names = pd.DataFrame({'name': pd.Categorical(['None', 'Tilly', None, 'a', 'Phineas'])})
+    clean_names(names)
+    assert list(names['name']) == ['Tilly', 'Phineas']
+    assert list(names['name'].cat.categories) == ['Phineas', 'Tilly']
+
+
+def test_cached_rerun_equals_no_cache(sources, tmp_path, capsys):
+    _, paths = sources
+    cache_dir = str(tmp_path / 'cache')
+    expected = run_pipeline(*paths, cache=False)
+
+    first = run_pipeline(*paths, cache_dir=cache_dir, verbose=True)
+    second = run_pipeline(*paths, cache_dir=cache_dir, verbose=True)
+    output = capsys.readouterr().out
+    assert output.count('ran in') == len(STAGES) + 1
+    assert '{:<24} read from the cache'.format('fix_denominators') in output
+    pd.testing.assert_frame_equal(first, expected)
+    pd.testing.assert_frame_equal(second, expected)
+
+
+def test_changed_constant_invalidates_the_cache(sources, tmp_path, monkeypatch, capsys):
+    _, paths = sources
+    cache_dir = str(tmp_path / 'cache')
+    before = run_pipeline(*paths, cache_dir=cache_dir)
+    assert 'Tilly' in set(before['name'])
+    keys = stage_keys(paths, STAGES)
+
+    # clean_names reads INVALID_NAMES: adding a name recomputes it instead of reading the stages cached before
+    monkeypatch.setattr(wrangle_pipeline, 'INVALID_NAMES', wrangle_pipeline.INVALID_NAMES + ['Tilly'])
+    assert stage_keys(paths, STAGES)[1] != keys[1]
+    capsys.readouterr()
+    after = run_pipeline(*paths, cache_dir=cache_dir, verbose=True)
+    output = capsys.readouterr().out
+    assert 'read from the cache' not in output
+    assert '{:<24} ran in'.format('clean_names') in output
+    assert 'Tilly' not in set(after['name'])
+    assert len(after) == len(before) - 1
+    pd.testing.assert_frame_equal(after, run_pipeline(*paths, cache=False))
@@ -0,0 +1,248 @@
+import os
+import csv
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from tweepy import OAuthHandler
+
+# Query the Twitter API for the tweets of the Twitter archive with the batch lookup endpoint,
+# up to 100 ids per request, and append their JSON to tweet_json.txt.
+# Ids that were requested (found or not) are appended to a checkpoint file after each batch,
+# so an interrupted run picks up where it stopped.
+API_URL = 'https://api.twitter.com'
+LOOKUP_PATH = '/1.1/statuses/lookup.json'
+BATCH_SIZE = 100
+
+
+class RateLimiter:
+
+    """
+    Keeps the requests of all the threads within the rate limit window reported by the API
+    in the x-rate-limit-remaining and x-rate-limit-reset headers.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.remaining = None
+        self.reset = 0
+
+    def acquire(self):
+
+        """
+        Reserves one request, sleeping until the window resets when the budget is used up.
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                if self.remaining is None or self.remaining > 0 or now >= self.reset:
+                    if self.remaining is not None:
+                        self.remaining = self.remaining - 1 if now < self.reset else None
+                    return
+                wait = self.reset - now
+            time.sleep(wait + 1)
+
+    def update(self, headers):
+
+        """
+        Updates the budget from the rate limit headers of a response.
+
+            headers: headers of the API response
+        """
+        if 'x-rate-limit-remaining' not in headers or 'x-rate-limit-reset' not in headers:
+            return
+        with self.lock:
+            reset = float(headers['x-rate-limit-reset'])
+            remaining = int(headers['x-rate-limit-remaining'])
+            # keep the lowest budget when concurrent responses arrive out of order
+            if reset != self.reset or self.remaining is None or remaining < self.remaining:
+                self.reset = reset
+                self.remaining = remaining
+
+    def exhaust(self, headers):
+
+        """
+        Marks the budget as used up after a 429 response.
+
+            headers: headers of the API response
+        """
+        with self.lock:
+            self.remaining = 0
+            self.reset = float(headers.get('x-rate-limit-reset', time.time() + 60))
+
+
+def fetch_batch(session, url, tweet_ids, limiter, max_retries=5):
+
+    """
+    Looks up a batch of up to 100 tweet ids and returns the tweets found and the ids not found.
+
+        session: requests session with the OAuth credentials
+        url: url of the statuses lookup endpoint
+        tweet_ids: ids of the tweets to look up
+        limiter: RateLimiter shared by the threads
+        max_retries: number of retries after a 429 or 5xx response
+    """
+    params = {'id': ','.join(str(tweet_id) for tweet_id in tweet_ids), 'tweet_mode': 'extended'}
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        response = session.get(url, params=params, timeout=60)
+        if response.status_code == 429:
+            limiter.exhaust(response.headers)
+            continue
+        if response.status_code >= 500 and attempt < max_retries:
+            time.sleep(2 ** attempt)
+            continue
+        limiter.update(response.headers)
+        response.raise_for_status()
+
+        tweets = response.json()
+        found = {tweet['id'] for tweet in tweets}
+        return tweets, [tweet_id for tweet_id in tweet_ids if tweet_id not in found]
+
+    raise RuntimeError('rate limited {} times for ids {}...{}'.format(max_retries + 1, tweet_ids[0], tweet_ids[-1]))
+
+
+def read_checkpoint(checkpoint):
+
+    """
+    Returns the ids already requested, found or not, and the ids not found.
+
+        checkpoint: filepath of the checkpoint file
+    """
+    done, failed = set(), set()
+    if os.path.exists(checkpoint):
+        with open(checkpoint, 'r', encoding='utf-8') as file:
+            for line in file:
+                # a line cut short by a crash is ignored, its batch is fetched again
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                done.update(entry['done'])
+                failed.update(entry['failed'])
+    return done, failed
+
+
+def read_fetched_ids(outfile):
+
+    """
+    Returns the ids of the tweets already in outfile, covering a run stopped between writing
+    the tweets of a batch and its checkpoint.
+
+        outfile: filepath of tweet_json.txt
+    """
+    fetched = set()
+    if os.path.exists(outfile):
+        with open(outfile, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    fetched.add(json.loads(line)['id'])
+                except ValueError:
+                    continue
+    return fetched
+
+
+def open_for_append(filepath):
+
+    """
+    Opens a file for appending lines, ending first a last line cut short by a crash,
+    so the first line appended is not merged into it.
+
+        filepath: filepath of the file
+    """
+    cut_short = False
+    if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+        with open(filepath, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            cut_short = file.read(1) != b'\n'
+    file = open(filepath, 'a', encoding='utf-8')
+    if cut_short:
+        file.write('\n')
+    return file
+
+
+def fetch_tweets(session, tweet_ids, outfile, checkpoint, url=API_URL + LOOKUP_PATH, workers=4):
+
+    """
+    Fetches the tweets not requested yet in batches on a thread pool and appends them to outfile.
+    Returns the ids of the tweets that were not found.
+
+        session: requests session with the OAuth credentials
+        tweet_ids: ids of the tweets of the Twitter archive
+        outfile: filepath of tweet_json.txt
+        checkpoint: filepath of the checkpoint file
+        url: url of the statuses lookup endpoint
+        workers: number of requests sent at the same time
+    """
+    done, failed = read_checkpoint(checkpoint)
+    done |= read_fetched_ids(outfile)
+    todo = [tweet_id for tweet_id in tweet_ids if tweet_id not in done]
+    batches = [todo[i:i + BATCH_SIZE] for i in range(0, len(todo), BATCH_SIZE)]
+    print('{} of {} tweets already fetched, {} batches to go'.format(len(tweet_ids) - len(todo), len(tweet_ids), len(batches)))
+
+    limiter = RateLimiter()
+    count = len(tweet_ids) - len(todo)
+    with open_for_append(outfile) as out, open_for_append(checkpoint) as check, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_batch, session, url, batch, limiter): batch for batch in batches}
+        for future in as_completed(futures):
+            tweets, missing = future.result()
+            for tweet in tweets:
+                json.dump(tweet, out)
+                out.write('\n')
+            out.flush()
+            os.fsync(out.fileno())
+
+            # the checkpoint is written once the tweets are on disk
+            json.dump({'done': futures[future], 'failed': missing}, check)
+            check.write('\n')
+            check.flush()
+
+            failed.update(missing)
+            count += len(futures[future])
+            print('{}/{} tweets fetched, {} not found'.format(count, len(tweet_ids), len(failed)))
+
+    return failed
+
+
+def read_tweet_ids(archive):
+
+    """
+    Returns the tweet ids of the Twitter archive.
+
+        archive: filepath of twitter-archive-enhanced.csv
+    """
+    with open(archive, 'r', encoding='utf-8', newline='') as file:
+        return [int(row['tweet_id']) for row in csv.DictReader(file)]
+
+
+def main():
+
+    """
+    Fetches the tweets of the Twitter archive, resuming from the checkpoint of an earlier run.
+    """
+    parser = argparse.ArgumentParser(description='Fetches the tweets of the Twitter archive into tweet_json.txt.')
+    parser.add_argument('--archive', default='twitter-archive-enhanced.csv', help='Twitter archive csv file')
+    parser.add_argument('--outfile', default='tweet_json.txt', help='file the tweets are appended to')
+    parser.add_argument('--checkpoint', default='tweet_json.checkpoint', help='file recording the ids already requested')
+    parser.add_argument('--api-url', default=API_URL, help='base url of the Twitter API')
+    parser.add_argument('--workers', type=int, default=4, help='number of requests sent at the same time')
+    args = parser.parse_args()
+
+    # These are read from the environment to comply with Twitter's API terms and conditions
+    auth = OAuthHandler(os.environ['TWITTER_CONSUMER_KEY'], os.environ['TWITTER_CONSUMER_SECRET'])
+    auth.set_access_token(os.environ['TWITTER_ACCESS_TOKEN'], os.environ['TWITTER_ACCESS_SECRET'])
+    session = requests.Session()
+    session.auth = auth.apply_auth()
+
+    start = time.time()
+    failed = fetch_tweets(session, read_tweet_ids(args.archive), args.outfile, args.checkpoint,
+                          url=args.api_url.rstrip('/') + LOOKUP_PATH, workers=args.workers)
+    print(time.time() - start)
+    print('{} tweets not found'.format(len(failed)))
+
+
+if __name__ == "__main__":
+    main()
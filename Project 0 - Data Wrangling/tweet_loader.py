@@ -0,0 +1,103 @@
+import os
+import glob
+import json
+import numpy as np
+import pandas as pd
+
+# orjson parses each line several times faster than json, it is used when installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Load only the fields of tweet_json.txt used in the wrangling notebook into typed columns,
+# and cache the result as Parquet next to the file, keyed on its modification time.
+COLUMNS = ['timestamp', 'tweet_id', 'favourites_count', 'retweets_count']
+CREATED_AT_FORMAT = '%a %b %d %H:%M:%S %z %Y'
+
+
+def parse_tweet_json(filepath):
+
+    """
+    Parses tweet_json.txt line by line, keeping only id, favorite_count, retweet_count and created_at,
+    and returns them as a DataFrame with int64 counts and a datetime timestamp.
+    A line cut short by a crash of tweet_fetcher.py is skipped, its tweet is fetched again by the next run.
+
+        filepath: filepath of tweet_json.txt
+    """
+    tweet_ids, favourites, retweets, created_at = [], [], [], []
+    with open(filepath, 'rb') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                tweet = json_loads(line)
+            except ValueError:
+                continue
+            tweet_ids.append(tweet['id'])
+            favourites.append(tweet['favorite_count'])
+            retweets.append(tweet['retweet_count'])
+            created_at.append(tweet['created_at'])
+
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(pd.Series(created_at, dtype=object), format=CREATED_AT_FORMAT),
+        'tweet_id': np.array(tweet_ids, dtype='int64'),
+        'favourites_count': np.array(favourites, dtype='int64'),
+        'retweets_count': np.array(retweets, dtype='int64'),
+    }, columns=COLUMNS)
+
+
+def format_created_at(timestamps):
+
+    """
+    Formats the parsed timestamps back into the created_at format of the Twitter API, e.g. Tue Aug 01 00:17:27 +0000 2017,
+    the format of the timestamp_y column of twitter_archive_master.csv.
+
+        timestamps: datetime Series of the timestamp column
+    """
+    return timestamps.dt.strftime(CREATED_AT_FORMAT)
+
+
+def cache_path(filepath):
+
+    """
+    Returns the Parquet cache filepath of a file, keyed on its modification time.
+
+        filepath: filepath of tweet_json.txt
+    """
+    base, _ = os.path.splitext(filepath)
+    return '{}.{}.parquet'.format(base, os.stat(filepath).st_mtime_ns)
+
+
+def load_tweet_json(filepath='tweet_json.txt', cache=True):
+
+    """
+    Returns the tweets of tweet_json.txt as a DataFrame, read from the Parquet cache when the file
+    has not changed since it was cached. The cache is skipped when no Parquet engine is installed.
+
+        filepath: filepath of tweet_json.txt
+        cache: whether to read and write the Parquet cache
+    """
+    if not cache:
+        return parse_tweet_json(filepath)
+
+    path = cache_path(filepath)
+    if os.path.exists(path):
+        try:
+            return pd.read_parquet(path)
+        except ImportError:
+            return parse_tweet_json(filepath)
+
+    df = parse_tweet_json(filepath)
+    try:
+        df.to_parquet(path, index=False)
+    except ImportError:
+        return df
+
+    # remove the caches of earlier versions of the file
+    base, _ = os.path.splitext(filepath)
+    for old in glob.glob(glob.escape(base) + '.*.parquet'):
+        if old != path and old[len(base) + 1:-len('.parquet')].isdigit():
+            os.remove(old)
+    return df
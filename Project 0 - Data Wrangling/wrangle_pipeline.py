@@ -0,0 +1,313 @@
+import os
+import glob
+import time
+import hashlib
+import inspect
+import argparse
+import numpy as np
+import pandas as pd
+from tweet_loader import load_tweet_json, format_created_at
+
+# The cleaning steps of wrangle_act.ipynb as a pipeline of stages. Each stage modifies the frame in place,
+# and its result is cached as Parquet, keyed on a hash of the input files and of the code of the stage
+# and of every stage before it, so a rerun after editing one stage recomputes only that stage and the ones after it.
+
+# Names wrongly extracted from the text of the tweets, dropped with the missing names
+INVALID_NAMES = ['a', 'an', 'the', 'Mo', 'Bo', 'my', 'al', 'quite', 'by', 'None']
+DOG_TYPES = ['doggo', 'floofer', 'pupper', 'puppo']
+SOURCE_TAGS = r'<(?:a\b[^>]*>|/a>)'
+WRONG_DENOMINATORS = [50, 7]
+
+ARCHIVE_DTYPES = {'source': 'category', 'name': 'category', 'doggo': 'category', 'floofer': 'category',
+                  'pupper': 'category', 'puppo': 'category'}
+PREDICTION_DTYPES = {'p1': 'category', 'p2': 'category', 'p3': 'category'}
+
+# Columns of twitter_archive_master.csv
+MASTER_COLUMNS = ['tweet_id', 'timestamp_x', 'source', 'text', 'retweeted_status_timestamp', 'rating_numerator', 'name',
+                  'timestamp_y', 'favourites_count', 'retweets_count', 'dog_type', 'breed', 'CI']
+
+
+def map_categories(series, func):
+
+    """
+    Applies a string function to the categories of a categorical column instead of to each of its rows,
+    and returns the new categorical column. Categories mapped to the same value are merged.
+
+        series: categorical column
+        func: function taking and returning an Index of strings
+    """
+    categories = series.cat.categories
+    mapped = func(categories)
+    if mapped.is_unique:
+        return series.cat.rename_categories(mapped)
+    return series.map(dict(zip(categories, mapped))).astype('category')
+
+
+def merge_sources(archive, predictions, tweets):
+
+    """
+    Combines the twitter archive, the image predictions and the Twitter API data into one table,
+    keeping the tweets found in all three.
+
+        archive: twitter archive DataFrame
+        predictions: image predictions DataFrame
+        tweets: Twitter API DataFrame returned by load_tweet_json
+    """
+    df = archive.merge(tweets, on='tweet_id', how='inner')
+    return df.merge(predictions, on='tweet_id', how='inner')
+
+
+def clean_names(df):
+
+    """
+    Drops the tweets whose dog name is missing or is one of the words wrongly extracted as a name.
+    read_csv reads the 'None' names of the archive as missing values.
+
+        df: merged DataFrame
+    """
+    df.drop(df.index[df['name'].isna() | df['name'].isin(INVALID_NAMES)], inplace=True)
+    df['name'] = df['name'].cat.remove_unused_categories()
+
+
+def clean_source(df):
+
+    """
+    Removes the html tags around the names of the sources.
+
+        df: merged DataFrame
+    """
+    df['source'] = map_categories(df['source'], lambda sources: sources.str.replace(SOURCE_TAGS, '', regex=True))
+
+
+def extract_dog_type(df):
+
+    """
+    Combines the doggo, floofer, pupper and puppo columns into the dog_type column, extracted from the text.
+
+        df: merged DataFrame
+    """
+    dog_type = df['text'].str.extract('({})'.format('|'.join(DOG_TYPES)), expand=False)
+    df['dog_type'] = pd.Categorical(dog_type, categories=DOG_TYPES)
+
+
+def clean_breed_names(df):
+
+    """
+    Separates the words of the predicted breeds with spaces instead of underscores.
+
+        df: merged DataFrame
+    """
+    for column in ['p1', 'p2', 'p3']:
+        df[column] = map_categories(df[column], lambda breeds: breeds.str.replace('_', ' ', regex=False))
+
+
+def keep_dog_predictions(df):
+
+    """
+    Drops the tweets where any of the three predictions is not a dog.
+
+        df: merged DataFrame
+    """
+    df.drop(df.index[~(df['p1_dog'] & df['p2_dog'] & df['p3_dog'])], inplace=True)
+
+
+def drop_duplicate_images(df):
+
+    """
+    Drops the tweets whose image was already posted by an earlier tweet.
+
+        df: merged DataFrame
+    """
+    df.drop_duplicates(subset='jpg_url', inplace=True)
+
+
+def choose_breed(df):
+
+    """
+    Sets the breed and CI columns to the first prediction that is a dog, or to Error and NaN when none is.
+
+        df: merged DataFrame
+    """
+    conditions = [df['p1_dog'].to_numpy(), df['p2_dog'].to_numpy(), df['p3_dog'].to_numpy()]
+    breeds = [df[column].to_numpy(dtype=object) for column in ['p1', 'p2', 'p3']]
+    confidences = [df[column].to_numpy() for column in ['p1_conf', 'p2_conf', 'p3_conf']]
+    df['breed'] = pd.Categorical(np.select(conditions, breeds, default='Error'))
+    df['CI'] = np.select(conditions, confidences, default=np.nan)
+
+
+def keep_original_tweets(df):
+
+    """
+    Drops the retweets.
+
+        df: merged DataFrame
+    """
+    df.drop(df.index[df['retweeted_status_id'].notna()], inplace=True)
+
+
+def fix_denominators(df):
+
+    """
+    Sets the rating denominators that were wrongly extracted from the text to 10.
+
+        df: merged DataFrame
+    """
+    df.loc[df['rating_denominator'].isin(WRONG_DENOMINATORS), 'rating_denominator'] = 10
+
+
+# Cleaning stages, in the order of wrangle_act.ipynb
+STAGES = [clean_names, clean_source, extract_dog_type, clean_breed_names, keep_dog_predictions,
+          drop_duplicate_images, choose_breed, keep_original_tweets, fix_denominators]
+
+
+def file_hash(filepath):
+
+    """
+    Returns the sha256 hash of the content of a file.
+
+        filepath: filepath of the file
+    """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def settings_hash():
+
+    """
+    Returns the hash of the module constants and helpers the stages depend on, so editing one of them
+    invalidates every cached stage.
+    """
+    settings = [INVALID_NAMES, DOG_TYPES, SOURCE_TAGS, WRONG_DENOMINATORS, ARCHIVE_DTYPES, PREDICTION_DTYPES,
+                MASTER_COLUMNS]
+    code = [inspect.getsource(func) for func in [read_sources, map_categories]]
+    return hashlib.sha256((repr(settings) + ''.join(code)).encode()).hexdigest()
+
+
+def stage_keys(inputs, stages):
+
+    """
+    Returns the cache key of the merge and of each stage: the hash of the input files, of the constants
+    and helpers used by the stages and of the code of the merge, chained with the code of every stage up to it,
+    so editing a stage changes its key and the keys of the stages after it only.
+
+        inputs: filepaths of the archive, the image predictions and tweet_json.txt
+        stages: cleaning stages
+    """
+    key = hashlib.sha256((''.join(file_hash(path) for path in inputs) + settings_hash()).encode()).hexdigest()
+    keys = []
+    for func in [merge_sources] + stages:
+        key = hashlib.sha256((key + inspect.getsource(func)).encode()).hexdigest()
+        keys.append(key)
+    return keys
+
+
+def stage_cache_path(cache_dir, index, name, key):
+    return os.path.join(cache_dir, '{:02d}-{}.{}.parquet'.format(index, name, key[:16]))
+
+
+def write_stage(df, cache_dir, index, name, key):
+
+    """
+    Writes the result of a stage to its cache, and removes the caches of the earlier versions of the stage.
+    Returns False when no Parquet engine is installed.
+
+        df: result of the stage
+        cache_dir: directory of the cache
+        index: position of the stage, 0 for the merge
+        name: name of the stage
+        key: cache key of the stage
+    """
+    path = stage_cache_path(cache_dir, index, name, key)
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        df.to_parquet(path)
+    except ImportError:
+        return False
+    for old in glob.glob(os.path.join(glob.escape(cache_dir), '{:02d}-{}.*.parquet'.format(index, name))):
+        if old != path:
+            os.remove(old)
+    return True
+
+
+def read_sources(archive_path, predictions_path, tweets_path):
+
+    """
+    Reads the three datasets with categorical columns for the repeated strings.
+
+        archive_path: filepath of twitter-archive-enhanced.csv
+        predictions_path: filepath of image-predictions.tsv
+        tweets_path: filepath of tweet_json.txt
+    """
+    archive = pd.read_csv(archive_path, dtype=ARCHIVE_DTYPES)
+    predictions = pd.read_csv(predictions_path, sep='\t', dtype=PREDICTION_DTYPES)
+    return archive, predictions, load_tweet_json(tweets_path)
+
+
+def run_pipeline(archive_path='twitter-archive-enhanced.csv', predictions_path='image-predictions.tsv',
+                 tweets_path='tweet_json.txt', cache_dir='.wrangle_cache', cache=True, verbose=False):
+
+    """
+    Returns the cleaned master DataFrame. The result of the last stage found in the cache is read,
+    and only the stages after it are run, each writing its result to the cache.
+
+        archive_path: filepath of twitter-archive-enhanced.csv
+        predictions_path: filepath of image-predictions.tsv
+        tweets_path: filepath of tweet_json.txt
+        cache_dir: directory of the Parquet caches of the stages
+        cache: whether to read and write the caches
+        verbose: whether to print whether each stage was read from the cache or run, and how long it took
+    """
+    names = [merge_sources.__name__] + [func.__name__ for func in STAGES]
+    keys = stage_keys([archive_path, predictions_path, tweets_path], STAGES) if cache else [None] * len(names)
+
+    df = None
+    first = 0
+    if cache:
+        for index in reversed(range(len(names))):
+            path = stage_cache_path(cache_dir, index, names[index], keys[index])
+            if os.path.exists(path):
+                try:
+                    df = pd.read_parquet(path)
+                except ImportError:
+                    cache = False
+                    break
+                first = index + 1
+                if verbose:
+                    print('{:<24} read from the cache'.format(names[index]))
+                break
+
+    for index in range(first, len(names)):
+        start = time.perf_counter()
+        if index == 0:
+            df = merge_sources(*read_sources(archive_path, predictions_path, tweets_path))
+        else:
+            STAGES[index - 1](df)
+        if cache:
+            cache = write_stage(df, cache_dir, index, names[index], keys[index])
+        if verbose:
+            print('{:<24} ran in {:.3f}s'.format(names[index], time.perf_counter() - start))
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cleans the twitter archive into twitter_archive_master.csv.')
+    parser.add_argument('--archive', default='twitter-archive-enhanced.csv', help='Twitter archive csv file')
+    parser.add_argument('--predictions', default='image-predictions.tsv', help='image predictions tsv file')
+    parser.add_argument('--tweets', default='tweet_json.txt', help='Twitter API data fetched by tweet_fetcher.py')
+    parser.add_argument('--output', default='twitter_archive_master.csv', help='csv file the master dataset is written to')
+    parser.add_argument('--cache-dir', default='.wrangle_cache', help='directory of the Parquet caches of the stages')
+    parser.add_argument('--no-cache', action='store_true', help='run every stage without reading or writing the caches')
+    args = parser.parse_args()
+
+    df = run_pipeline(args.archive, args.predictions, args.tweets, args.cache_dir, not args.no_cache, verbose=True)
+    master = df[MASTER_COLUMNS].copy()
+    master['timestamp_y'] = format_created_at(master['timestamp_y'])
+    master.to_csv(args.output, index=False)
+    print('{} tweets written to {}'.format(len(df), args.output))
+
+
+if __name__ == '__main__':
+    main()
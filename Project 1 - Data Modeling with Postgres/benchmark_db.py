@@ -0,0 +1,119 @@
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from sql_queries import create_table_queries, drop_table_queries, songplay_table_insert
+from db import dsn, connect, execute_batch, prepare_queries
+
+
+def time_schema_reset(conn, repeats):
+
+    """
+    Times the drop and create of all the tables, committed after each statement as create_tables.py used to,
+    and committed once as it does now.
+
+        PARAMETERS:
+            CONN: Connection to the sparkify database.
+            REPEATS: Number of schema resets timed for each mode.
+
+    """
+    queries = drop_table_queries + create_table_queries
+    cur = conn.cursor()
+    timings = {}
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for query in queries:
+            cur.execute(query)
+            conn.commit()
+    timings['commit per statement'] = (time.perf_counter() - start, repeats * len(queries))
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        execute_batch(cur, queries)
+        conn.commit()
+    timings['single transaction'] = (time.perf_counter() - start, repeats)
+    return timings
+
+
+def songplay_rows(rows, seed=0):
+
+    """
+    Returns rows shaped like the songplays of the log files, for the SONGPLAYS insert.
+
+        PARAMETERS:
+            ROWS: Number of rows.
+            SEED: Seed of the random generator.
+
+    """
+    rng = random.Random(seed)
+    start = datetime(2018, 11, 1)
+    return [(start + timedelta(milliseconds=i * 1000 + rng.randrange(1000)), rng.randrange(1, 97),
+             rng.choice(['free', 'paid']), None, None, rng.randrange(1, 1000),
+             'San Francisco-Oakland-Hayward, CA', 'Mozilla/5.0') for i in range(rows)]
+
+
+def time_inserts(conn, rows, commit_every):
+
+    """
+    Times the row by row inserts of the songplays, sent as plain statements and as a prepared statement,
+    and returns the seconds and the number of commits of each mode. The table is emptied before each mode.
+
+        PARAMETERS:
+            CONN: Connection to the sparkify database, opened by db.connect.
+            ROWS: Rows returned by songplay_rows.
+            COMMIT_EVERY: Number of rows per commit, 1 for a commit after each insert.
+
+    """
+    cur = conn.cursor()
+    timings = {}
+    for prepared in (False, True):
+        cur.execute("TRUNCATE SONGPLAYS")
+        conn.commit()
+        # a copy of the insert that is not registered runs as a plain statement
+        query = songplay_table_insert if prepared else songplay_table_insert + ' '
+        commits = 0
+        start = time.perf_counter()
+        for i, row in enumerate(rows, 1):
+            cur.execute(query, row)
+            if i % commit_every == 0:
+                conn.commit()
+                commits += 1
+        conn.commit()
+        timings['prepared' if prepared else 'plain'] = (time.perf_counter() - start, commits + 1)
+    cur.execute("TRUNCATE SONGPLAYS")
+    conn.commit()
+    return timings
+
+
+def print_timings(title, timings):
+    print(title)
+    for mode, (seconds, commits) in timings.items():
+        print('    {:<22} {:>8.3f}s  {:>7} commits'.format(mode, seconds, commits))
+
+
+def main():
+
+    """
+    Compares the cost of the commits and of the statement planning of create_tables.py and etl.py.
+    Runs against the database set by the SPARKIFY_* environment variables and leaves its tables empty,
+    run create_tables.py and etl.py afterwards to load them again.
+    """
+    parser = argparse.ArgumentParser(description='Times commit batching and prepared statements on the sparkify database.')
+    parser.add_argument('--rows', type=int, default=20000, help='number of songplays inserted per mode')
+    parser.add_argument('--repeats', type=int, default=20, help='number of schema resets per mode')
+    args = parser.parse_args()
+
+    prepare_queries({'songplay_insert': songplay_table_insert})
+    conn = connect(dsn())
+    rows = songplay_rows(args.rows)
+
+    print_timings('Schema reset, {} times:'.format(args.repeats), time_schema_reset(conn, args.repeats))
+    print_timings('{} inserts, commit after each:'.format(args.rows), time_inserts(conn, rows, 1))
+    print_timings('{} inserts, commit per 1000:'.format(args.rows), time_inserts(conn, rows, 1000))
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
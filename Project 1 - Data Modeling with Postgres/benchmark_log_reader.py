@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+PAGES = ['NextSong'] * 8 + ['Home', 'Logout', 'Settings', 'Help']
+LOCATIONS = ['San Francisco-Oakland-Hayward, CA', 'Chicago-Naperville-Elgin, IL-IN-WI', 'Lansing-East Lansing, MI',
+             'Atlanta-Sandy Springs-Roswell, GA', 'New York-Newark-Jersey City, NY-NJ-PA', 'Portland-South Portland, ME']
+USER_AGENTS = ['"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 (KHTML, like Gecko) '
+               'Chrome/36.0.1985.143 Safari/537.36"',
+               '"Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0"',
+               'Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.2; WOW64; Trident/6.0)']
+
+
+def write_log_file(filepath, events, seed=0):
+
+    """
+    Writes a log file of events shaped like the log files of the event simulator, most of them NextSong events.
+
+        PARAMETERS:
+            FILEPATH: Filepath of the log file written.
+            EVENTS: Number of events.
+            SEED: Seed of the random generator.
+
+    """
+    rng = random.Random(seed)
+    start = int(datetime(2018, 11, 1).timestamp() * 1000)
+    with open(filepath, 'w') as f:
+        for i in range(events):
+            page = rng.choice(PAGES)
+            user = rng.randrange(1, 100)
+            event = {
+                'artist': 'Artist {}'.format(rng.randrange(10000)) if page == 'NextSong' else None,
+                'auth': 'Logged In',
+                'firstName': 'First{}'.format(user),
+                'gender': 'F' if user % 2 else 'M',
+                'itemInSession': rng.randrange(100),
+                'lastName': 'Last{}'.format(user),
+                'length': round(rng.uniform(60, 600), 5) if page == 'NextSong' else None,
+                'level': rng.choice(['free', 'paid']),
+                'location': LOCATIONS[user % len(LOCATIONS)],
+                'method': 'PUT' if page == 'NextSong' else 'GET',
+                'page': page,
+                'registration': 1540000000000.0 + user,
+                'sessionId': i // 50,
+                'song': 'Song {}'.format(rng.randrange(15000)) if page == 'NextSong' else None,
+                'status': 200,
+                'ts': start + i * 100,
+                'userAgent': USER_AGENTS[user % len(USER_AGENTS)],
+                'userId': str(user),
+            }
+            f.write(json.dumps(event) + '\n')
+
+
+def read_whole_file(filepath, chunksize):
+
+    """
+    Reads a log file the way process_log_file used to: the whole file into a DataFrame with the inferred types,
+    then filtered on the NextSong events. Returns the number of events kept.
+    """
+    import pandas as pd
+    df = pd.read_json(filepath, lines=True)
+    df = df[df['page'] == 'NextSong']
+    return len(df)
+
+
+def read_chunks(filepath, chunksize):
+
+    """
+    Reads a log file with log_reader.read_log_chunks, as process_log_file does now. Returns the number of events kept.
+    """
+    from log_reader import read_log_chunks
+    return sum(len(df) for df in read_log_chunks(filepath, chunksize))
+
+
+def measure(reader, filepath, chunksize, results):
+
+    """
+    Runs a reader in a new process and puts the number of events, the seconds and the growth of the peak resident memory
+    over the memory used once pandas is imported into RESULTS.
+    """
+    import pandas
+    import log_reader
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    events = reader(filepath, chunksize)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux
+    results.put((events, elapsed, (peak - baseline) / 1024))
+
+
+def run(reader, filepath, chunksize):
+
+    """
+    Measures a reader in a new process, so the peak memory of each measure starts from the same baseline.
+    Returns the number of events, the seconds and the peak memory growth in MB.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=measure, args=(reader, filepath, chunksize, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError('{} exited with code {}, e.g. killed when out of memory'.format(reader.__name__, process.exitcode))
+    return results.get()
+
+
+def main():
+
+    """
+    Compares the peak memory of reading log files of growing sizes whole, as process_log_file used to,
+    and by chunks of NextSong events with the compact column types of log_reader.py, as it does now.
+    The peak memory of the chunked reader should stay about the same whatever the size of the file.
+    """
+    parser = argparse.ArgumentParser(description='Measures the peak memory of reading a log file whole and by chunks.')
+    parser.add_argument('--events', type=int, nargs='+', default=[25000, 100000, 400000],
+                        help='number of events of each log file generated')
+    parser.add_argument('--chunksize', type=int, default=10000, help='number of events read at a time by the chunked reader')
+    args = parser.parse_args()
+
+    print('{:>10} {:>10} {:>10}   {:>12} {:>10}   {:>12} {:>10}'.format(
+        'events', 'file (MB)', 'NextSong', 'whole (MB)', 'whole (s)', 'chunks (MB)', 'chunks (s)'))
+    with tempfile.TemporaryDirectory() as directory:
+        for events in args.events:
+            filepath = os.path.join(directory, 'events-{}.json'.format(events))
+            write_log_file(filepath, events)
+            whole = run(read_whole_file, filepath, args.chunksize)
+            chunks = run(read_chunks, filepath, args.chunksize)
+            if whole[0] != chunks[0]:
+                raise RuntimeError('{} NextSong events read whole, {} by chunks'.format(whole[0], chunks[0]))
+            print('{:>10} {:>10.1f} {:>10}   {:>12.1f} {:>10.2f}   {:>12.1f} {:>10.2f}'.format(
+                events, os.path.getsize(filepath) / 1e6, whole[0], whole[2], whole[1], chunks[2], chunks[1]))
+            os.remove(filepath)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import time
+import argparse
+import psycopg2
+import pandas as pd
+from db import dsn, connect, execute_batch
+from partitions import ensure_partitions
+from sql_queries import songplay_table_create, songplay_table_create_partitioned, songplay_time_brin_create
+
+# Compares the analytic queries of the songplays on generated data, stored as the row store of create_tables.py,
+# as the tuned schema of create_tables.py --tuned, partitioned by month with a BRIN index on START_TIME,
+# and as a columnar table when a columnar extension is available. Each layout is loaded into its own schema.
+
+COLUMNAR_EXTENSIONS = ['citus_columnar', 'columnar', 'citus']
+
+songplay_table_create_columnar = ("""CREATE TABLE IF NOT EXISTS SONGPLAYS ( SONGPLAY_ID BIGINT,
+                                                                            START_TIME TIMESTAMP NOT NULL,
+                                                                            USER_ID INT NOT NULL,
+                                                                            LEVEL VARCHAR NOT NULL,
+                                                                            SONG_ID VARCHAR,
+                                                                            ARTIST_ID VARCHAR,
+                                                                            SESSION_ID INT NOT NULL,
+                                                                            LOCATION VARCHAR NOT NULL,
+                                                                            USER_AGENT VARCHAR NOT NULL)
+                                     USING columnar""")
+
+# Songplays over the 12 months of 2018, in the order of START_TIME like the log files, with a skewed song popularity.
+# The seed is set before each load so every layout holds the same rows.
+songplay_generate = ("""INSERT INTO SONGPLAYS ( SONGPLAY_ID, START_TIME, USER_ID, LEVEL, SONG_ID, ARTIST_ID,
+                                                SESSION_ID, LOCATION, USER_AGENT)
+                        SELECT G,
+                               TIMESTAMP '2018-01-01' + ((G - 1)::FLOAT8 / %(rows)s) * INTERVAL '365 days',
+                               1 + FLOOR(RANDOM() * 1000)::INT,
+                               CASE WHEN RANDOM() < 0.3 THEN 'paid' ELSE 'free' END,
+                               'SO' || LPAD(FLOOR(RANDOM() ^ 2 * 15000)::INT::TEXT, 6, '0'),
+                               'AR' || LPAD(FLOOR(RANDOM() ^ 2 * 10000)::INT::TEXT, 6, '0'),
+                               G / 20,
+                               (ARRAY['San Francisco-Oakland-Hayward, CA', 'Chicago-Naperville-Elgin, IL-IN-WI',
+                                      'Lansing-East Lansing, MI', 'Atlanta-Sandy Springs-Roswell, GA',
+                                      'New York-Newark-Jersey City, NY-NJ-PA', 'Portland-South Portland, ME'])[1 + FLOOR(RANDOM() * 6)::INT],
+                               'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36'
+                        FROM GENERATE_SERIES(1, %(rows)s) G""")
+
+# name and statement of the analytic queries
+QUERIES = [
+    ('plays by month and level', """SELECT DATE_TRUNC('month', START_TIME), LEVEL, COUNT(*) FROM SONGPLAYS
+                                    GROUP BY 1, 2 ORDER BY 1, 2"""),
+    ('plays by location', """SELECT LOCATION, COUNT(*) FROM SONGPLAYS GROUP BY 1 ORDER BY 2 DESC, 1"""),
+    ('plays in one week', """SELECT COUNT(*) FROM SONGPLAYS
+                             WHERE START_TIME >= '2018-11-05' AND START_TIME < '2018-11-12'"""),
+    ('top songs of a month', """SELECT SONG_ID, COUNT(*) FROM SONGPLAYS
+                                WHERE START_TIME >= '2018-11-01' AND START_TIME < '2018-12-01'
+                                GROUP BY 1 ORDER BY 2 DESC, 1 LIMIT 10"""),
+    ('paid users per day of a month', """SELECT START_TIME::DATE, COUNT(DISTINCT USER_ID) FROM SONGPLAYS
+                                         WHERE LEVEL = 'paid' AND START_TIME >= '2018-11-01' AND START_TIME < '2018-12-01'
+                                         GROUP BY 1 ORDER BY 1"""),
+]
+
+# layout name: statements creating the table, and statements run after the load
+LAYOUTS = {
+    'row': ([songplay_table_create], []),
+    'partitioned': ([songplay_table_create_partitioned], [songplay_time_brin_create]),
+    'columnar': ([songplay_table_create_columnar], []),
+}
+
+
+def columnar_extension(cur, conn):
+
+    """
+    Creates the first columnar extension available on the server and returns its name, or None when there is none.
+
+        PARAMETERS:
+            CUR: Connection cursor to the database.
+            CONN: The database connection
+
+    """
+    cur.execute("SELECT name FROM pg_available_extensions WHERE name = ANY(%s)", (COLUMNAR_EXTENSIONS,))
+    available = {row[0] for row in cur.fetchall()}
+    for name in COLUMNAR_EXTENSIONS:
+        if name in available:
+            try:
+                cur.execute("CREATE EXTENSION IF NOT EXISTS {}".format(name))
+                conn.commit()
+                return name
+            except psycopg2.Error:
+                # e.g. citus, which has to be in shared_preload_libraries
+                conn.rollback()
+    return None
+
+
+def load_layout(cur, conn, layout, rows):
+
+    """
+    Creates the songplays of a layout in the bench_<layout> schema and loads the generated rows into it.
+    Returns the seconds the load took, including the indexes built after it, and the size of the table with its indexes.
+
+        PARAMETERS:
+            CUR: Connection cursor to the database.
+            CONN: The database connection
+            LAYOUT: Name of the layout in LAYOUTS
+            ROWS: Number of songplays generated
+
+    """
+    schema = 'bench_' + layout
+    creates, deferred = LAYOUTS[layout]
+    cur.execute("DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}; SET search_path TO {0}".format(schema))
+    execute_batch(cur, creates)
+    ensure_partitions(cur, pd.date_range('2018-01-01', '2018-12-31', freq='MS'))
+    conn.commit()
+
+    start = time.perf_counter()
+    cur.execute("SELECT SETSEED(0.5)")
+    cur.execute(songplay_generate, {'rows': rows})
+    execute_batch(cur, deferred)
+    cur.execute("ANALYZE SONGPLAYS")
+    conn.commit()
+    elapsed = time.perf_counter() - start
+
+    # pg_partition_tree has no rows for a table that is not partitioned
+    cur.execute("""SELECT COALESCE((SELECT SUM(pg_total_relation_size(relid)) FROM pg_partition_tree('songplays')),
+                                   pg_total_relation_size('songplays'))""")
+    return elapsed, int(cur.fetchone()[0])
+
+
+def time_queries(cur, layout, repeats):
+
+    """
+    Runs the analytic queries on a layout and returns the best time of each and its results.
+
+        PARAMETERS:
+            CUR: Connection cursor to the database.
+            LAYOUT: Name of the layout in LAYOUTS
+            REPEATS: Number of runs of each query, the fastest is kept
+
+    """
+    cur.execute("SET search_path TO bench_{}".format(layout))
+    timings, results = [], []
+    for name, query in QUERIES:
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            cur.execute(query)
+            rows = cur.fetchall()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings.append(best)
+        results.append(rows)
+    return timings, results
+
+
+def main():
+
+    """
+    Loads the generated songplays into each layout, runs the analytic queries on them and prints the load time,
+    the size and the time of each query of every layout. The bench_ schemas are dropped at the end unless --keep is given.
+    """
+    parser = argparse.ArgumentParser(description='Compares row, partitioned and columnar storage of the songplays.')
+    parser.add_argument('--rows', type=int, default=1000000, help='number of songplays generated')
+    parser.add_argument('--repeats', type=int, default=3, help='number of runs of each query, the fastest is kept')
+    parser.add_argument('--keep', action='store_true', help='keep the bench_ schemas instead of dropping them')
+    args = parser.parse_args()
+
+    conn = connect(dsn())
+    cur = conn.cursor()
+
+    layouts = ['row', 'partitioned']
+    extension = columnar_extension(cur, conn)
+    if extension:
+        layouts.append('columnar')
+        print('columnar storage of the {} extension'.format(extension))
+    else:
+        print('columnar storage skipped: none of the {} extensions is available'.format(', '.join(COLUMNAR_EXTENSIONS)))
+
+    loads, timings, results = {}, {}, {}
+    for layout in layouts:
+        loads[layout] = load_layout(cur, conn, layout, args.rows)
+        timings[layout], results[layout] = time_queries(cur, layout, args.repeats)
+
+    print('{:<32}'.format('{} songplays'.format(args.rows)) + ''.join('{:>14}'.format(layout) for layout in layouts))
+    print('{:<32}'.format('load (s)') + ''.join('{:>14.2f}'.format(loads[layout][0]) for layout in layouts))
+    print('{:<32}'.format('size (MB)') + ''.join('{:>14.1f}'.format(loads[layout][1] / 1e6) for layout in layouts))
+    for i, (name, _) in enumerate(QUERIES):
+        same = all(results[layout][i] == results['row'][i] for layout in layouts)
+        print('{:<32}'.format(name) + ''.join('{:>14.3f}'.format(timings[layout][i]) for layout in layouts) +
+              ('' if same else '  DIFFERENT results'))
+
+    if not args.keep:
+        cur.execute("SET search_path TO public")
+        execute_batch(cur, ['DROP SCHEMA IF EXISTS bench_{} CASCADE'.format(layout) for layout in layouts])
+        conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
+import time
+import argparse
 import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+from db import admin_dsn, connect, execute_batch
+from sql_queries import create_table_queries, create_table_queries_tuned, drop_table_queries
 
 
 def create_database():
@@ -8,8 +11,8 @@ def create_database():
     - Returns the connection and cursor to sparkifydb
     """
     
-    # connect to default database
-    conn = psycopg2.connect("host=127.0.0.1 dbname=studentdb user=student password=student")
+    # connect to default database, set by the SPARKIFY_* environment variables (see db.py)
+    conn = psycopg2.connect(admin_dsn())
     conn.set_session(autocommit=True)
     cur = conn.cursor()
     
@@ -21,7 +24,7 @@ def create_database():
     conn.close()    
     
     # connect to sparkify database
-    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+    conn = connect()
     cur = conn.cursor()
     
     return cur, conn
@@ -29,20 +32,28 @@ def create_database():
 
 def drop_tables(cur, conn):
     """
-    Drops each table using the queries in `drop_table_queries` list.
+    Drops each table using the queries in `drop_table_queries` list, in a single transaction.
     """
-    for query in drop_table_queries:
-        cur.execute(query)
-        conn.commit()
+    execute_batch(cur, drop_table_queries)
+    conn.commit()
 
 
 def create_tables(cur, conn):
     """
-    Creates each table using the queries in `create_table_queries` list. 
+    Creates each table using the queries in `create_table_queries` list, in a single transaction. 
     """
-    for query in create_table_queries:
-        cur.execute(query)
-        conn.commit()
+    execute_batch(cur, create_table_queries)
+    conn.commit()
+
+
+def reset_tables(cur, conn, tuned=False):
+    """
+    Drops and creates all the tables in a single transaction, so the schema is never left half created
+    and the server flushes its log once instead of after every statement.
+    With TUNED, SONGPLAYS is partitioned by month, and etl.py builds the lookup and BRIN indexes after loading the rows.
+    """
+    execute_batch(cur, drop_table_queries + (create_table_queries_tuned if tuned else create_table_queries))
+    conn.commit()
 
 
 def main():
@@ -52,18 +63,23 @@ def main():
     - Establishes connection with the sparkify database and gets
     cursor to it.  
     
-    - Drops all the tables.  
-    
-    - Creates all tables needed. 
+    - Drops all the tables and creates all tables needed, in a single transaction.  
     
     - Finally, closes the connection. 
     """
+    parser = argparse.ArgumentParser(description='Creates the sparkifydb database and its tables.')
+    parser.add_argument('--tuned', action='store_true',
+                        help='partition SONGPLAYS by month and let etl.py build the lookup and BRIN indexes after the load')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
     cur, conn = create_database()
     
-    drop_tables(cur, conn)
-    create_tables(cur, conn)
+    reset_tables(cur, conn, args.tuned)
 
     conn.close()
+    print('Schema reset in {:.2f}s, {} statements in 1 commit.'.format(
+        time.perf_counter() - start, len(drop_table_queries) + len(create_table_queries)))
 
 
 if __name__ == "__main__":
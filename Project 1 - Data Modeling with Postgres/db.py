@@ -0,0 +1,185 @@
+import os
+import re
+import threading
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+# Connection settings of the sparkify database, read from the environment with the course defaults.
+# SPARKIFY_DSN, when set, is used as is instead of the other variables.
+DEFAULTS = {
+    'host': ('SPARKIFY_DB_HOST', '127.0.0.1'),
+    'port': ('SPARKIFY_DB_PORT', '5432'),
+    'dbname': ('SPARKIFY_DB_NAME', 'sparkifydb'),
+    'user': ('SPARKIFY_DB_USER', 'student'),
+    'password': ('SPARKIFY_DB_PASSWORD', 'student'),
+}
+ADMIN_DB = ('SPARKIFY_ADMIN_DB', 'studentdb')
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def dsn(dbname=None):
+
+    """
+    Returns the connection string of the sparkify database, or of another database on the same server.
+
+        PARAMETERS:
+            DBNAME: Optional database name, e.g. admin_dsn() for the database the sparkify database is created from.
+
+    """
+    if os.environ.get('SPARKIFY_DSN') and dbname is None:
+        return os.environ['SPARKIFY_DSN']
+    settings = {key: os.environ.get(variable, default) for key, (variable, default) in DEFAULTS.items()}
+    if dbname is not None:
+        settings['dbname'] = dbname
+    return ' '.join('{}={}'.format(key, value) for key, value in settings.items())
+
+
+def admin_dsn():
+
+    """
+    Returns the connection string of the database the sparkify database is dropped and created from.
+    """
+    return dsn(os.environ.get(*ADMIN_DB))
+
+
+def connect(conn_dsn=None):
+
+    """
+    Opens a connection whose cursors run the registered queries as prepared statements.
+
+        PARAMETERS:
+            CONN_DSN: Connection string, the sparkify database by default.
+
+    """
+    return psycopg2.connect(conn_dsn or dsn(), connection_factory=PreparedConnection)
+
+
+def get_pool(conn_dsn=None, maxconn=4):
+
+    """
+    Returns the connection pool of a database, created on first use and shared by the callers of the process,
+    so the connections are opened once per run instead of once per step. The pools are kept per process:
+    a worker process forked from the loader opens its own connections instead of sharing those of the loader.
+
+        PARAMETERS:
+            CONN_DSN: Connection string, the sparkify database by default.
+            MAXCONN: Maximum number of connections of the pool.
+
+    """
+    key = (os.getpid(), conn_dsn or dsn())
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ThreadedConnectionPool(1, maxconn, key[1], connection_factory=PreparedConnection)
+        return _pools[key]
+
+
+def close_pools():
+
+    """
+    Closes the connections of every pool of the current process.
+    """
+    with _pools_lock:
+        for key in [key for key in _pools if key[0] == os.getpid()]:
+            _pools.pop(key).closeall()
+
+
+@contextmanager
+def transaction(conn_dsn=None):
+
+    """
+    Lends a connection of the pool and yields a cursor on it. The statements run inside it are committed
+    together once the block ends, or rolled back if it raises, instead of a commit after each statement.
+
+        PARAMETERS:
+            CONN_DSN: Connection string, the sparkify database by default.
+
+    """
+    pool = get_pool(conn_dsn)
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            yield cur
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def execute_batch(cur, queries):
+
+    """
+    Runs the statements one after another in the current transaction, the caller commits them once.
+
+        PARAMETERS:
+            CUR: Connection cursor to the database.
+            QUERIES: SQL statements without parameters.
+
+    """
+    for query in queries:
+        cur.execute(query)
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+
+    """
+    Connection remembering the statements prepared on it, whose cursors are PreparedCursors.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.cursor_factory = PreparedCursor
+
+
+class PreparedCursor(psycopg2.extensions.cursor):
+
+    """
+    Cursor running the queries listed in PREPARED_QUERIES as server side prepared statements: the first execute
+    of such a query on a connection PREPAREs it, and every execute then sends EXECUTE with the parameters,
+    so the server parses and plans the statement once per connection instead of once per row.
+    Every other query runs as usual.
+    """
+
+    prepared_queries = {}
+
+    def execute(self, query, vars=None):
+        name = self.prepared_queries.get(query)
+        if name is None or vars is None:
+            return super().execute(query, vars)
+
+        values = list(vars)
+        if name not in self.connection.prepared:
+            super().execute('PREPARE {} AS {}'.format(name, to_positional(query)))
+            self.connection.prepared.add(name)
+        return super().execute('EXECUTE {} ({})'.format(name, ', '.join(['%s'] * len(values))), values)
+
+
+def to_positional(query):
+
+    """
+    Replaces the %s placeholders of a query with the $1, $2, ... parameters of PREPARE.
+
+        PARAMETERS:
+            QUERY: SQL statement with %s placeholders.
+
+    """
+    counter = iter(range(1, query.count('%s') + 1))
+    return re.sub(r'%s', lambda match: '${}'.format(next(counter)), query).replace('%%', '%')
+
+
+def prepare_queries(queries):
+
+    """
+    Registers the queries the cursors of the pools run as prepared statements.
+
+        PARAMETERS:
+            QUERIES: Dict of statement name to SQL statement with %s placeholders.
+
+    """
+    PreparedCursor.prepared_queries.update({query: name for name, query in queries.items()})
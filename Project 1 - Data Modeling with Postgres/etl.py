@@ -1,11 +1,52 @@
 import os
+import io
+import time
 import glob
-import psycopg2
+import argparse
+import functools
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from sql_queries import *
+from song_lookup import SongLookup
+from time_dimension import TimeDimension, time_rows
+from manifest import FileManifest, record_rows
+from db import dsn, get_pool, close_pools, transaction, execute_batch, prepare_queries
+from partitions import is_partitioned, ensure_partitions
+from log_reader import CHUNKSIZE, read_log_chunks
 
+# set by the SPARKIFY_* environment variables (see db.py)
+SPARKIFY_DSN = dsn()
 
-def process_song_file(cur, filepath):
+# the row by row inserts run as prepared statements, planned once per connection
+prepare_queries({
+    'song_insert': song_table_insert,
+    'artist_insert': artist_table_insert,
+    'user_insert': user_table_insert,
+    'time_insert': time_table_insert,
+    'songplay_insert': songplay_table_insert,
+    'song_lookup': song_select,
+})
+
+# connection string of the current worker process in parallel mode, whose pool is opened once by init_worker
+worker_dsn = None
+
+
+def read_data_file(filepath):
+    
+    """
+    Reads a song or log file: a line delimited JSON file, one of the source files or a part written by
+    compact_data.py of Project 4, or a Parquet part written by compact_data.py --format parquet.
+    
+        PARAMETERS:
+            FILEPATH: Filepath of the song or log data.
+    
+    """
+    if filepath.endswith('.parquet'):
+        return pd.read_parquet(filepath)
+    return pd.read_json(filepath, lines=True, precise_float=True)
+
+
+def process_song_file(cur, filepath, lookup=None):
     
     """
     This function processes the song files from the Millenium Dataset and inserts the data into the dimension tables: songs and artists
@@ -13,21 +54,39 @@ def process_song_file(cur, filepath):
         PARAMETERS:
             CUR: Connection cursor to insert the data into the database.
             FILEPATH: Filepath of the song data.
+            LOOKUP: Optional SongLookup index that the inserted songs are added to.
     
     """
-    # open song file
-    df = pd.read_json(filepath, lines=True)
+    # open song file, a compacted file holds many songs
+    df = read_data_file(filepath)
 
-    # insert song record
-    song_data = df[['song_id', 'title', 'artist_id', 'year', 'duration']].values[0].tolist()
-    cur.execute(song_table_insert, song_data)
+    # insert song records
+    for song_data in df[['song_id', 'title', 'artist_id', 'year', 'duration']].values.tolist():
+        cur.execute(song_table_insert, song_data)
     
-    # insert artist record
-    artist_data = df[['artist_id','artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']].values[0].tolist()
-    cur.execute(artist_table_insert, artist_data)
+    # insert artist records, missing coordinates as NULL like the bulk COPY instead of NaN
+    artists = df[['artist_id','artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']]
+    for artist_data in artists.astype(object).where(artists.notna(), None).values.tolist():
+        cur.execute(artist_table_insert, artist_data)
+
+    # keep the song lookup index up to date
+    if lookup is not None:
+        lookup.add(df)
 
 
-def process_log_file(cur, filepath):
+def build_time_df(df):
+    
+    """
+    Builds the time dimension records from the ts column of the NextSong events.
+    
+        PARAMETERS:
+            DF: DataFrame of NextSong events from the log files.
+    
+    """
+    return time_rows(df['ts'].unique())
+
+
+def process_log_file(cur, filepath, lookup=None, time_dim=None, chunksize=CHUNKSIZE):
     
     """
     This function processes the log files from the event simulator and inserts the data into the dimension tables: users and time
@@ -35,95 +94,496 @@ def process_log_file(cur, filepath):
         PARAMETERS:
             CUR: Connection cursor to insert the data into the database.
             FILEPATH: Filepath of the log data.
+            LOOKUP: Optional SongLookup index used to resolve song and artist ids without
+                    running song_select for every event.
+            TIME_DIM: Optional TimeDimension that collects the timestamps for a single
+                      time table load at the end of the run.
+            CHUNKSIZE: Number of log events read and inserted at a time.
     
     """
         
-    # open log file
-    df = pd.read_json(filepath, lines=True)
+    # open log file, the NextSong events are read chunk by chunk so the memory does not grow with the file
+    for df in read_log_chunks(filepath, chunksize):
+
+        # insert time data records, or collect them for the end of the run
+        if time_dim is not None:
+            time_dim.add(df['ts'])
+        else:
+            time_df = build_time_df(df)
+
+            for i, row in time_df.iterrows():
+                cur.execute(time_table_insert, list(row))
+
+        # load user table
+        user_df =  df[['userId', 'firstName', 'lastName', 'gender', 'level']]
+
+        # insert user records
+        for i, row in user_df.iterrows():
+            cur.execute(user_table_insert, row)
 
-    # filter by NextSong action
-    df =  df[df['page'] == 'NextSong']
+        # get songid and artistid for all the events at once from the lookup index
+        if lookup is not None:
+            df = lookup.resolve(df)
 
-    # convert timestamp column to datetime
-    df['timestamp'] =  pd.to_datetime(df['ts'], unit='ms')
-    t = df["timestamp"]
+        # create the monthly partitions of the songplays on the tuned schema
+        ensure_partitions(cur, pd.to_datetime(df['ts'], unit='ms'))
+
+        # insert songplay records
+        for index, row in df.iterrows():
+            
+            if lookup is not None:
+                songid, artistid = row.song_id, row.artist_id
+            else:
+                # get songid and artistid from song and artist tables
+                cur.execute(song_select, (row.song, row.artist, row.length))
+                results = cur.fetchone()
+                
+                if results:
+                    songid, artistid = results
+                else:
+                    songid, artistid = None, None
+
+            # insert songplay record
+            songplay_data = (pd.to_datetime(row.ts, unit='ms'), row.userId, row.level, songid, artistid, row.sessionId, row.location, row.userAgent)
+            cur.execute(songplay_table_insert, songplay_data)
+
+
+def copy_dataframe(cur, df, table):
+    
+    """
+    Streams the rows of a DataFrame into a table with COPY ... FROM STDIN.
     
-    # insert time data records
-    from datetime import datetime
-    time_data = (t, t.dt.hour, t.dt.day, t.dt.week, t.dt.month, t.dt.year, t.dt.weekday)
-    column_labels = ('ts', 'hour', 'day', 'week', 'month', 'year', 'weekday')
-    time_df = pd.DataFrame(dict(zip(column_labels, time_data)))
+        PARAMETERS:
+            CUR: Connection cursor to the database.
+            DF: DataFrame with the same columns, in the same order, as the table.
+            TABLE: Name of the staging table the rows are copied into.
+    
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep='\\N')
+    buffer.seek(0)
+    cur.copy_expert(copy_stage.format(table), buffer)
 
-    for i, row in time_df.iterrows():
-        cur.execute(time_table_insert, list(row))
 
-    # load user table
-    user_df =  df[['userId', 'firstName', 'lastName', 'gender', 'level']]
+def create_staging_tables(cur):
+    
+    """
+    Creates the temporary staging tables used by the bulk loader.
+    
+        PARAMETERS:
+            CUR: Connection cursor to the database.
+    
+    """
+    for query in create_stage_queries:
+        cur.execute(query)
 
-    # insert user records
-    for i, row in user_df.iterrows():
-        cur.execute(user_table_insert, row)
 
-    # insert songplay records
-    for index, row in df.iterrows():
-        
-        # get songid and artistid from song and artist tables
-        cur.execute(song_select, (row.song, row.artist, row.length))
-        results = cur.fetchone()
-        
-        if results:
-            songid, artistid = results
-        else:
-            songid, artistid = None, None
+def read_json_files(filepaths):
+    
+    """
+    Reads a list of song or log files into a single DataFrame, keeping the file order.
+    
+        PARAMETERS:
+            FILEPATHS: List of filepaths to read.
+    
+    """
+    return pd.concat([read_data_file(f) for f in filepaths], ignore_index=True)
 
-        # insert songplay record
-        songplay_data = (pd.to_datetime(row.ts, unit='ms'), row.userId, row.level, songid, artistid, row.sessionId, row.location, row.userAgent)
-        cur.execute(songplay_table_insert, songplay_data)
 
+def bulk_process_song_files(cur, filepaths):
+    
+    """
+    Bulk version of process_song_file: copies a batch of song files into the staging tables
+    and upserts them into the songs and artists tables with one statement per table.
+    
+        PARAMETERS:
+            CUR: Connection cursor to the database.
+            FILEPATHS: Filepaths of the song data in the batch.
+    
+    """
+    df = read_json_files(filepaths)
+
+    # stage and upsert song records
+    copy_dataframe(cur, df[['song_id', 'title', 'artist_id', 'year', 'duration']], 'SONGS_STAGE')
+    cur.execute(song_table_upsert)
 
-def process_data(cur, conn, filepath, func):
+    # stage and upsert artist records, with their position in the batch so the first row of each artist is kept
+    artists = df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']]
+    copy_dataframe(cur, artists.assign(ordinal=range(len(artists))), 'ARTISTS_STAGE')
+    cur.execute(artist_table_upsert)
+
+
+def bulk_process_log_files(cur, filepaths, time_dim=None, chunksize=CHUNKSIZE):
     
     """
-    Goes through all the files under the filepaths and processes the logs.
+    Bulk version of process_log_file: copies a batch of log files into the staging tables
+    and upserts them into the time, users and songplays tables with one statement per table.
+    The NextSong events are read and copied chunk by chunk, so the memory does not grow with the size of the batch.
+    
+        PARAMETERS:
+            CUR: Connection cursor to the database.
+            FILEPATHS: Filepaths of the log data in the batch.
+            TIME_DIM: Optional TimeDimension that collects the timestamps for a single
+                      time table load at the end of the run.
+            CHUNKSIZE: Number of log events read and copied at a time.
+    
+    """
+    user_dfs = []
+    for filepath in filepaths:
+        # read the NextSong events of the file with compact column types
+        for df in read_log_chunks(filepath, chunksize):
+
+            # stage time records, or collect them for the end of the run
+            if time_dim is not None:
+                time_dim.add(df['ts'])
+            else:
+                copy_dataframe(cur, build_time_df(df), 'TIME_STAGE')
+
+            # keep the last event of each user of the chunk, at most one row per user
+            user_dfs.append(df[['userId', 'firstName', 'lastName', 'gender', 'level']].drop_duplicates('userId', keep='last'))
+
+            # stage songplay records, song and artist ids are resolved by the upsert
+            songplay_df = pd.DataFrame({
+                'start_time': pd.to_datetime(df['ts'], unit='ms'),
+                'user_id': df['userId'],
+                'level': df['level'],
+                'song': df['song'],
+                'artist': df['artist'],
+                'length': df['length'],
+                'session_id': df['sessionId'],
+                'location': df['location'],
+                'user_agent': df['userAgent'],
+            })
+            ensure_partitions(cur, songplay_df['start_time'])
+            copy_dataframe(cur, songplay_df, 'SONGPLAYS_STAGE')
+
+    # upsert the staged time records
+    if time_dim is None:
+        cur.execute(time_table_upsert)
+
+    # stage and upsert user records, the last event of each user sets the level
+    user_df = pd.concat(user_dfs, ignore_index=True).drop_duplicates('userId', keep='last') if user_dfs else None
+    if user_df is not None:
+        copy_dataframe(cur, user_df, 'USERS_STAGE')
+        cur.execute(user_table_upsert)
+
+    # upsert the staged songplay records
+    cur.execute(songplay_table_upsert)
+
+    return user_df
+
+
+def get_files(filepath):
+    
+    """
+    Returns the absolute paths of all the JSON and Parquet files under the filepath, sorted so that the log files
+    of each day are loaded in order and the users get the level of their last event.
+    
+        PARAMETERS:
+            FILEPATH: Root directory to search.
+    
+    """
+    all_files = []
+    for root, dirs, files in os.walk(filepath):
+        files = glob.glob(os.path.join(root,'*.json')) + glob.glob(os.path.join(root,'*.parquet'))
+        for f in files :
+            all_files.append(os.path.abspath(f))
+    return sorted(all_files)
+
+
+def find_files(cur, conn, filepath, manifest=None):
+    
+    """
+    Returns the files under the filepath that need to be loaded: all of them, or only the
+    new and changed ones when a manifest is given.
     
     PARAMETERS:
             CUR: Connection cursor to the database.
             CONN: The database connection
             FILEPATH: Filepath of the logs to be analysed
-            FUNC: Function used to process each log
+            MANIFEST: Optional FileManifest of the files loaded by earlier runs
             
     """
     # get all files matching extension from directory
-    all_files = []
-    for root, dirs, files in os.walk(filepath):
-        files = glob.glob(os.path.join(root,'*.json'))
-        for f in files :
-            all_files.append(os.path.abspath(f))
+    all_files = get_files(filepath)
+    print('{} files found in {}'.format(len(all_files), filepath))
+
+    # skip the files loaded by earlier runs
+    if manifest is not None:
+        all_files = manifest.select_files(cur, all_files)
+        conn.commit()
+        print('{} new or changed files to load.'.format(len(all_files)))
+
+    return all_files
 
-    # get total number of files found
+
+def process_data(cur, conn, filepath, func, manifest=None):
+    
+    """
+    Goes through all the files under the filepaths and processes the logs.
+    
+    PARAMETERS:
+            CUR: Connection cursor to the database.
+            CONN: The database connection
+            FILEPATH: Filepath of the logs to be analysed
+            FUNC: Function used to process each log
+            MANIFEST: Optional FileManifest, only new or changed files are loaded and recorded in it
+            
+    """
+    # get all files to load
+    all_files = find_files(cur, conn, filepath, manifest)
     num_files = len(all_files)
-    print('{} files found in {}'.format(num_files, filepath))
 
     # iterate over files and process
     for i, datafile in enumerate(all_files, 1):
         func(cur, datafile)
+        if manifest is not None:
+            manifest.record(cur, [datafile])
         conn.commit()
         print('{}/{} files processed.'.format(i, num_files))
 
 
+def process_data_bulk(cur, conn, filepath, func, batch_size, manifest=None):
+    
+    """
+    Goes through all the files under the filepaths and processes them in batches.
+    
+    PARAMETERS:
+            CUR: Connection cursor to the database.
+            CONN: The database connection
+            FILEPATH: Filepath of the logs to be analysed
+            FUNC: Function used to process each batch of files
+            BATCH_SIZE: Number of files loaded per COPY and commit
+            MANIFEST: Optional FileManifest, only new or changed files are loaded and recorded in it
+            
+    """
+    # get all files to load
+    all_files = find_files(cur, conn, filepath, manifest)
+    num_files = len(all_files)
+
+    # iterate over batches of files and process
+    for start in range(0, num_files, batch_size):
+        batch = all_files[start:start + batch_size]
+        func(cur, batch)
+        if manifest is not None:
+            manifest.record(cur, batch)
+        conn.commit()
+        print('{}/{} files processed.'.format(start + len(batch), num_files))
+
+
+def init_worker(dsn):
+    
+    """
+    Opens the pool of a worker process, with a single connection, and creates its staging tables on it.
+    The connection is lent again for every batch the worker processes, so its staging tables are kept.
+    
+    PARAMETERS:
+            DSN: Connection string of the sparkify database
+            
+    """
+    global worker_dsn
+    worker_dsn = dsn
+    get_pool(dsn, maxconn=1)
+    with transaction(dsn) as cur:
+        create_staging_tables(cur)
+
+
+def process_batch(func, filepaths, manifest_rows=None):
+    
+    """
+    Processes one batch of files on the connection of the worker process and commits it.
+    Returns the number of files in the batch and the result of FUNC.
+    
+    PARAMETERS:
+            FUNC: Function used to process the batch of files
+            FILEPATHS: Filepaths in the batch
+            MANIFEST_ROWS: Optional manifest rows recorded in the same transaction as the batch
+            
+    """
+    with transaction(worker_dsn) as cur:
+        result = func(cur, filepaths)
+        if manifest_rows is not None:
+            record_rows(cur, manifest_rows)
+    return len(filepaths), result
+
+
+def process_data_parallel(cur, conn, dsn, filepath, func, batch_size, workers, manifest=None):
+    
+    """
+    Goes through all the files under the filepaths and processes them in batches on a pool of worker processes,
+    each with its own connection. Returns the results of FUNC in batch order.
+    
+    PARAMETERS:
+            CUR: Connection cursor to the database.
+            CONN: The database connection
+            DSN: Connection string of the sparkify database
+            FILEPATH: Filepath of the logs to be analysed
+            FUNC: Function used to process each batch of files
+            BATCH_SIZE: Number of files loaded per COPY and commit
+            WORKERS: Number of worker processes
+            MANIFEST: Optional FileManifest, only new or changed files are loaded and recorded in it
+            
+    """
+    # get all files to load
+    all_files = find_files(cur, conn, filepath, manifest)
+    num_files = len(all_files)
+
+    batches = [all_files[start:start + batch_size] for start in range(0, num_files, batch_size)]
+    results = [None] * len(batches)
+    processed = 0
+
+    # process the batches on the pool and collect the results as they finish
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(dsn,)) as executor:
+        futures = {}
+        for i, batch in enumerate(batches):
+            manifest_rows = manifest.rows(batch) if manifest is not None else None
+            futures[executor.submit(process_batch, func, batch, manifest_rows)] = i
+        for future in as_completed(futures):
+            count, result = future.result()
+            results[futures[future]] = result
+            processed += count
+            print('{}/{} files processed.'.format(processed, num_files))
+
+    if processed != num_files:
+        raise RuntimeError('{} of {} files processed in {}'.format(processed, num_files, filepath))
+
+    return results
+
+
+def apply_user_levels(cur, conn, user_dfs):
+    
+    """
+    Upserts the last known record of each user once all the log batches are loaded.
+    Batches finish in any order in parallel mode, so this makes the final level of each user
+    the same as when the files are processed one after the other.
+    
+    PARAMETERS:
+            CUR: Connection cursor to the database.
+            CONN: The database connection
+            USER_DFS: User records returned by bulk_process_log_files, in batch order
+            
+    """
+    user_dfs = [user_df for user_df in user_dfs if user_df is not None]
+    if not user_dfs:
+        return
+
+    user_df = pd.concat(user_dfs, ignore_index=True).drop_duplicates('userId', keep='last')
+    copy_dataframe(cur, user_df, 'USERS_STAGE')
+    cur.execute(user_table_upsert)
+    conn.commit()
+
+
+def load_time_dimension(cur, conn, time_dim):
+    
+    """
+    Loads the time rows collected during the run that are not in the time table yet.
+    
+    PARAMETERS:
+            CUR: Connection cursor to the database.
+            CONN: The database connection
+            TIME_DIM: TimeDimension the log files were collected into
+            
+    """
+    time_df = time_dim.flush()
+    copy_dataframe(cur, time_df, 'TIME_STAGE')
+    cur.execute(time_table_upsert)
+    conn.commit()
+    print('{} time records loaded.'.format(len(time_df)))
+
+
+def create_indexes(cur, conn, queries):
+    
+    """
+    Builds the deferred indexes of the tuned schema once the rows they index are loaded.
+    
+    PARAMETERS:
+            CUR: Connection cursor to the database.
+            CONN: The database connection
+            QUERIES: CREATE INDEX statements
+            
+    """
+    start = time.perf_counter()
+    execute_batch(cur, queries)
+    conn.commit()
+    print('{} indexes built in {:.2f}s.'.format(len(queries), time.perf_counter() - start))
+
+
 def main():
     
     """
     Inserts the song files and the log files into the sparkifydb database.
     """
+    parser = argparse.ArgumentParser(description='Loads the song and log files into the sparkifydb database.')
+    parser.add_argument('--bulk', action='store_true',
+                        help='load the files in batches through COPY and set based upserts')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='number of files loaded per batch in bulk mode')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes loading batches in parallel, implies --bulk')
+    parser.add_argument('--full-refresh', action='store_true',
+                        help='empty the tables and reload every file instead of only the new or changed ones')
+    parser.add_argument('--input', default='data',
+                        help='directory holding song_data and log_data, e.g. the output of compact_data.py of Project 4')
+    args = parser.parse_args()
+    song_data = os.path.join(args.input, 'song_data')
+    log_data = os.path.join(args.input, 'log_data')
     
-    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+    # the connection of the run, the worker processes of --workers open their own pools
+    conn = get_pool(SPARKIFY_DSN).getconn()
     cur = conn.cursor()
 
-    process_data(cur, conn, filepath='data/song_data', func=process_song_file)
-    process_data(cur, conn, filepath='data/log_data', func=process_log_file)
+    # add the manifest table and the songplays unique key to a database created before them
+    execute_batch(cur, migrate_queries)
+    conn.commit()
+
+    # the indexes of the tuned schema are built after the rows are loaded, see create_tables.py --tuned
+    tuned = is_partitioned(cur)
+
+    # empty the tables and the manifest, so every file is loaded again
+    if args.full_refresh:
+        cur.execute(truncate_tables)
+        if tuned:
+            execute_batch(cur, drop_index_queries)
+        conn.commit()
+
+    # files recorded in the manifest by earlier runs are skipped
+    manifest = FileManifest()
+    manifest.load(cur)
+
+    if args.workers > 1:
+        create_staging_tables(cur)
+        process_data_parallel(cur, conn, SPARKIFY_DSN, song_data, bulk_process_song_files, args.batch_size, args.workers, manifest)
+        if tuned:
+            create_indexes(cur, conn, lookup_index_queries)
+        user_dfs = process_data_parallel(cur, conn, SPARKIFY_DSN, log_data, bulk_process_log_files, args.batch_size, args.workers, manifest)
+        apply_user_levels(cur, conn, user_dfs)
+    else:
+        create_staging_tables(cur)
+
+        # the time table is built once from the distinct timestamps of the whole run
+        time_dim = TimeDimension()
+        time_dim.load(cur)
+
+        if args.bulk:
+            process_data_bulk(cur, conn, song_data, bulk_process_song_files, args.batch_size, manifest)
+            if tuned:
+                create_indexes(cur, conn, lookup_index_queries)
+            process_data_bulk(cur, conn, log_data, functools.partial(bulk_process_log_files, time_dim=time_dim), args.batch_size, manifest)
+        else:
+            # song/artist ids are resolved from an in memory index instead of one query per event
+            lookup = SongLookup()
+            lookup.load(cur)
+            process_data(cur, conn, filepath=song_data, func=functools.partial(process_song_file, lookup=lookup), manifest=manifest)
+            if tuned:
+                create_indexes(cur, conn, lookup_index_queries)
+            process_data(cur, conn, filepath=log_data, func=functools.partial(process_log_file, lookup=lookup, time_dim=time_dim), manifest=manifest)
+
+        load_time_dimension(cur, conn, time_dim)
+
+    if tuned:
+        create_indexes(cur, conn, songplay_index_queries)
 
-    conn.close()
+    close_pools()
 
 
 if __name__ == "__main__":
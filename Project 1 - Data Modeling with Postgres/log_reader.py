@@ -0,0 +1,60 @@
+import pandas as pd
+
+# number of log lines parsed at a time, the memory used by a log file scales with it instead of with the file size
+CHUNKSIZE = 10000
+
+# columns of the NextSong events used by etl.py and their types. The repeated strings with few values are categorical,
+# with fixed categories so the chunks and files can be concatenated, and the other strings are Arrow backed.
+LOG_DTYPES = {
+    'ts': 'int64',
+    'userId': 'int32',
+    'firstName': 'str',
+    'lastName': 'str',
+    'gender': pd.CategoricalDtype(['F', 'M']),
+    'level': pd.CategoricalDtype(['free', 'paid']),
+    'song': 'str',
+    'artist': 'str',
+    'length': 'float64',
+    'sessionId': 'int32',
+    'location': 'str',
+    'userAgent': 'str',
+}
+
+
+def read_log_chunks(filepath, chunksize=CHUNKSIZE):
+
+    """
+    Reads the NextSong events of a log file chunk by chunk, as DataFrames with the columns and types of LOG_DTYPES.
+    Each chunk is filtered on page before its columns are converted, so only the NextSong events are converted.
+    Parquet parts written by compact_data.py of Project 4 are read by batches of rows in the same way.
+
+        PARAMETERS:
+            FILEPATH: Filepath of the log data.
+            CHUNKSIZE: Number of events parsed at a time.
+
+    """
+    if filepath.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(filepath)
+        for batch in parquet_file.iter_batches(chunksize, columns=['page'] + list(LOG_DTYPES)):
+            yield next_song_events(batch.to_pandas())
+        return
+
+    with pd.read_json(filepath, lines=True, chunksize=chunksize, dtype=False, convert_dates=False,
+                      precise_float=True) as reader:
+        for chunk in reader:
+            yield next_song_events(chunk)
+
+
+def next_song_events(chunk):
+
+    """
+    Keeps the NextSong events of a chunk of log events, and converts their columns to the types of LOG_DTYPES.
+
+        PARAMETERS:
+            CHUNK: DataFrame of log events.
+
+    """
+    chunk = chunk[chunk['page'] == 'NextSong']
+    return chunk[list(LOG_DTYPES)].astype(LOG_DTYPES).reset_index(drop=True)
+
@@ -0,0 +1,112 @@
+import os
+import hashlib
+from sql_queries import loaded_files_select, loaded_files_upsert
+
+
+def file_hash(filepath):
+
+    """
+    Returns the SHA-256 hash of the content of a file, read in chunks.
+
+        PARAMETERS:
+            FILEPATH: Filepath of the file to hash.
+
+    """
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class FileManifest:
+
+    """
+    Tracks the files already loaded into the database in the LOADED_FILES table, so that
+    incremental runs of etl.py only load new or changed files.
+
+    A file whose size and mtime match the manifest is skipped without being read. The content
+    is only hashed when the size or mtime changed, and a file with the same content is skipped too.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.fingerprints = {}
+
+    def load(self, cur):
+
+        """
+        Loads the manifest of the files already loaded.
+
+            PARAMETERS:
+                CUR: Connection cursor to the database.
+
+        """
+        cur.execute(loaded_files_select)
+        for path, size, mtime, content_hash in cur.fetchall():
+            self.files[path] = (size, mtime, content_hash)
+
+    def select_files(self, cur, filepaths):
+
+        """
+        Returns the filepaths that are new or changed since they were loaded. Files that were
+        only touched get their new mtime recorded straight away; the caller commits.
+
+            PARAMETERS:
+                CUR: Connection cursor to the database.
+                FILEPATHS: Filepaths found in the data directory.
+
+        """
+        selected = []
+        for path in filepaths:
+            stat = os.stat(path)
+            loaded = self.files.get(path)
+            if loaded is not None and loaded[0] == stat.st_size and loaded[1] == stat.st_mtime:
+                continue
+
+            fingerprint = (stat.st_size, stat.st_mtime, file_hash(path))
+            self.fingerprints[path] = fingerprint
+            if loaded is not None and loaded[2] == fingerprint[2]:
+                self.record(cur, [path])
+            else:
+                selected.append(path)
+        return selected
+
+    def rows(self, filepaths):
+
+        """
+        Returns the manifest rows of selected filepaths, to be recorded by a worker process.
+
+            PARAMETERS:
+                FILEPATHS: Filepaths returned by select_files.
+
+        """
+        return [(path,) + self.fingerprints[path] for path in filepaths]
+
+    def record(self, cur, filepaths):
+
+        """
+        Records filepaths as loaded, in the same transaction as their data.
+
+            PARAMETERS:
+                CUR: Connection cursor to the database.
+                FILEPATHS: Filepaths returned by select_files.
+
+        """
+        record_rows(cur, self.rows(filepaths))
+        for path in filepaths:
+            self.files[path] = self.fingerprints[path]
+
+
+def record_rows(cur, rows):
+
+    """
+    Upserts manifest rows of (path, size, mtime, content hash) into LOADED_FILES.
+
+        PARAMETERS:
+            CUR: Connection cursor to the database.
+            ROWS: Manifest rows to record.
+
+    """
+    for row in rows:
+        cur.execute(loaded_files_upsert, row)
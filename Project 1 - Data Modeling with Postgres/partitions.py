@@ -0,0 +1,65 @@
+import pandas as pd
+from sql_queries import (songplay_partitioned_select, songplay_partitions_select, songplay_partitions_lock,
+                         songplay_partition_create)
+
+
+def is_partitioned(cur):
+
+    """
+    Returns whether SONGPLAYS is the partitioned table of the tuned schema.
+
+        PARAMETERS:
+            CUR: Connection cursor to the database.
+
+    """
+    cur.execute(songplay_partitioned_select)
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+
+def partition_name(month):
+
+    """
+    Returns the name of the SONGPLAYS partition of a month, e.g. songplays_y2018m11.
+
+        PARAMETERS:
+            MONTH: Period of the month.
+
+    """
+    return 'songplays_y{:04d}m{:02d}'.format(month.year, month.month)
+
+
+def existing_partitions(cur):
+    cur.execute(songplay_partitions_select)
+    return {row[0] for row in cur.fetchall()}
+
+
+def ensure_partitions(cur, start_times):
+
+    """
+    Creates the monthly SONGPLAYS partitions missing for a batch of songplays, when SONGPLAYS is partitioned.
+    The partitions are only locked when one is missing, so the parallel workers only wait on each other
+    the first time a month is loaded. Returns the names of the partitions created.
+
+        PARAMETERS:
+            CUR: Connection cursor to the database.
+            START_TIMES: Series of the START_TIME of the songplays.
+
+    """
+    if len(start_times) == 0 or not is_partitioned(cur):
+        return []
+
+    months = pd.to_datetime(pd.Series(start_times)).dt.to_period('M').unique()
+    missing = {partition_name(month): month for month in months}
+    for name in existing_partitions(cur):
+        missing.pop(name, None)
+    if not missing:
+        return []
+
+    # another worker may have created them while waiting for the lock
+    cur.execute(songplay_partitions_lock)
+    for name in existing_partitions(cur):
+        missing.pop(name, None)
+    for name, month in sorted(missing.items()):
+        cur.execute(songplay_partition_create.format(name), (month.start_time, (month + 1).start_time))
+    return sorted(missing)
@@ -0,0 +1,83 @@
+import pandas as pd
+from sql_queries import song_lookup_select
+
+
+class SongLookup:
+
+    """
+    In memory index from (title, artist name, duration) to (song_id, artist_id).
+
+    It replaces the song_select query that was run once per NextSong event: the index is
+    loaded once per run from the database and kept up to date while the song files are processed,
+    so songplays can be resolved with a single pandas merge per log file.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self._frame = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def load(self, cur):
+
+        """
+        Loads every song and artist already in the database into the index.
+
+            PARAMETERS:
+                CUR: Connection cursor to the database.
+
+        """
+        cur.execute(song_lookup_select)
+        for title, name, duration, song_id, artist_id in cur.fetchall():
+            self.index.setdefault((title, name, duration), (song_id, artist_id))
+        self._frame = None
+
+    def add(self, df):
+
+        """
+        Adds the songs of a song file DataFrame to the index. As with song_select, the first
+        song found for a key is kept.
+
+            PARAMETERS:
+                DF: DataFrame with the song_id, title, artist_id, artist_name and duration columns.
+
+        """
+        keys = zip(df['title'], df['artist_name'], df['duration'])
+        ids = zip(df['song_id'], df['artist_id'])
+        for key, value in zip(keys, ids):
+            self.index.setdefault(key, value)
+        self._frame = None
+
+    def frame(self):
+
+        """
+        Returns the index as a DataFrame keyed on the log column names: song, artist and length.
+        The DataFrame is cached until the index changes.
+        """
+        if self._frame is None:
+            keys = list(self.index.keys())
+            ids = list(self.index.values())
+            self._frame = pd.DataFrame({
+                'song': [k[0] for k in keys],
+                'artist': [k[1] for k in keys],
+                'length': pd.Series([k[2] for k in keys], dtype='float64'),
+                'song_id': [v[0] for v in ids],
+                'artist_id': [v[1] for v in ids],
+            })
+        return self._frame
+
+    def resolve(self, df):
+
+        """
+        Adds the song_id and artist_id columns to a DataFrame of NextSong events. Events without
+        a matching song get None for both ids, the same as when song_select returns no row.
+
+            PARAMETERS:
+                DF: DataFrame of NextSong events with the song, artist and length columns.
+
+        """
+        resolved = df.merge(self.frame(), how='left', on=['song', 'artist', 'length'])
+        resolved[['song_id', 'artist_id']] = resolved[['song_id', 'artist_id']].astype(object).where(
+            resolved[['song_id', 'artist_id']].notnull(), None)
+        return resolved
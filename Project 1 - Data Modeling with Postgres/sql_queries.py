@@ -5,6 +5,7 @@ user_table_drop = "DROP TABLE IF EXISTS USERS"
 song_table_drop = "DROP TABLE IF EXISTS SONGS"
 artist_table_drop = "DROP TABLE IF EXISTS ARTISTS"
 time_table_drop = "DROP TABLE IF EXISTS TIME"
+loaded_files_table_drop = "DROP TABLE IF EXISTS LOADED_FILES"
 
 # CREATE TABLES
 # NEXT QUERIES WILL CREATE THE TABLES 
@@ -16,7 +17,8 @@ songplay_table_create = ("""CREATE TABLE IF NOT EXISTS SONGPLAYS ( SONGPLAY_ID S
                                                                     ARTIST_ID VARCHAR, 
                                                                     SESSION_ID INT NOT NULL, 
                                                                     LOCATION VARCHAR NOT NULL, 
-                                                                    USER_AGENT VARCHAR NOT NULL)""")
+                                                                    USER_AGENT VARCHAR NOT NULL,
+                                                                    UNIQUE (START_TIME, USER_ID, SESSION_ID))""")
 
 user_table_create = ("""CREATE TABLE IF NOT EXISTS USERS ( USER_ID INT PRIMARY KEY, 
                                                            FIRST_NAME VARCHAR, 
@@ -44,6 +46,75 @@ time_table_create = ("""CREATE TABLE IF NOT EXISTS TIME ( START_TIME TIMESTAMP P
                                                           YEAR INT, 
                                                           WEEKDAY VARCHAR)""")
 
+# MANIFEST OF THE FILES LOADED BY THE INCREMENTAL RUNS OF etl.py
+loaded_files_table_create = ("""CREATE TABLE IF NOT EXISTS LOADED_FILES ( PATH VARCHAR PRIMARY KEY, 
+                                                                          SIZE BIGINT NOT NULL, 
+                                                                          MTIME DOUBLE PRECISION NOT NULL, 
+                                                                          CONTENT_HASH VARCHAR(64) NOT NULL, 
+                                                                          LOADED_AT TIMESTAMP NOT NULL DEFAULT NOW())""")
+
+# MIGRATION
+# Brings a database created before the incremental runs of etl.py up to date: CREATE TABLE IF NOT EXISTS keeps
+# the existing SONGPLAYS, so its unique key is added here, after removing the duplicate plays it would reject.
+songplay_unique_add = ("""DO $$
+                          BEGIN
+                              IF NOT EXISTS (SELECT 1 FROM pg_constraint 
+                                             WHERE conrelid = 'songplays'::regclass AND contype = 'u') THEN
+                                  DELETE FROM SONGPLAYS S USING SONGPLAYS D 
+                                  WHERE S.START_TIME = D.START_TIME 
+                                  AND S.USER_ID = D.USER_ID 
+                                  AND S.SESSION_ID = D.SESSION_ID 
+                                  AND S.SONGPLAY_ID > D.SONGPLAY_ID;
+                                  ALTER TABLE SONGPLAYS ADD CONSTRAINT SONGPLAYS_START_TIME_USER_ID_SESSION_ID_KEY 
+                                  UNIQUE (START_TIME, USER_ID, SESSION_ID);
+                              END IF;
+                          END $$""")
+
+# TUNED SCHEMA
+# Created by create_tables.py --tuned. SONGPLAYS is partitioned by month on START_TIME, so time range queries
+# only read the partitions of their months. The partitions are created by partitions.py as the log files are loaded.
+# The primary key of a partitioned table has to include the partition column.
+songplay_table_create_partitioned = ("""CREATE TABLE IF NOT EXISTS SONGPLAYS ( SONGPLAY_ID BIGSERIAL, 
+                                                                               START_TIME TIMESTAMP NOT NULL, 
+                                                                               USER_ID INT NOT NULL, 
+                                                                               LEVEL VARCHAR NOT NULL, 
+                                                                               SONG_ID VARCHAR, 
+                                                                               ARTIST_ID VARCHAR, 
+                                                                               SESSION_ID INT NOT NULL, 
+                                                                               LOCATION VARCHAR NOT NULL, 
+                                                                               USER_AGENT VARCHAR NOT NULL,
+                                                                               PRIMARY KEY (SONGPLAY_ID, START_TIME),
+                                                                               UNIQUE (START_TIME, USER_ID, SESSION_ID)) 
+                                        PARTITION BY RANGE (START_TIME)""")
+
+songplay_partition_create = ("""CREATE TABLE IF NOT EXISTS {} PARTITION OF SONGPLAYS FOR VALUES FROM (%s) TO (%s)""")
+
+# whether SONGPLAYS is partitioned, and the lower bounds of its partitions
+songplay_partitioned_select = (""" SELECT relkind = 'p' FROM pg_class 
+                                   WHERE relname = 'songplays' AND pg_table_is_visible(oid) ;""")
+
+songplay_partitions_select = (""" SELECT child.relname FROM pg_inherits 
+                                  JOIN pg_class parent ON pg_inherits.inhparent = parent.oid 
+                                  JOIN pg_class child ON pg_inherits.inhrelid = child.oid 
+                                  WHERE parent.relname = 'songplays' AND pg_table_is_visible(parent.oid) ;""")
+
+# serializes the creation of the partitions between the parallel workers, until the end of the transaction
+songplay_partitions_lock = ("""SELECT pg_advisory_xact_lock(hashtext('songplays partitions'))""")
+
+# DEFERRED INDEXES
+# Built by etl.py on the tuned schema once the rows are loaded, which is faster than updating them row by row.
+# The lookup indexes cover song_select and the song lookup of songplay_table_upsert, so both run as index only scans,
+# and are built after the song files, before the log files that use them.
+song_lookup_index_create = ("""CREATE INDEX IF NOT EXISTS SONGS_LOOKUP_IDX ON SONGS (TITLE, DURATION) INCLUDE (SONG_ID, ARTIST_ID)""")
+
+artist_lookup_index_create = ("""CREATE INDEX IF NOT EXISTS ARTISTS_LOOKUP_IDX ON ARTISTS (NAME, ARTIST_ID)""")
+
+# BRIN indexes store the range of START_TIME of each block of pages. They are a few pages in size and skip
+# the blocks outside of a time range, as the songplays are loaded in about the order of their START_TIME.
+songplay_time_brin_create = ("""CREATE INDEX IF NOT EXISTS SONGPLAYS_START_TIME_BRIN ON SONGPLAYS USING BRIN (START_TIME)""")
+
+time_brin_create = ("""CREATE INDEX IF NOT EXISTS TIME_START_TIME_BRIN ON TIME USING BRIN (START_TIME)""")
+
 # INSERT RECORDS
 # Queries to insert data into tables
 songplay_table_insert = (""" INSERT INTO SONGPLAYS ( START_TIME, 
@@ -101,7 +172,129 @@ song_select = (""" SELECT SONGS.SONG_ID, ARTISTS.ARTIST_ID
                    AND ARTISTS.NAME = %s
                    AND SONGS.DURATION = %s ;""")
 
+# SONG LOOKUP
+# Loads every (title, artist name, duration) key with its ids for the in memory index in song_lookup.py
+song_lookup_select = (""" SELECT SONGS.TITLE, ARTISTS.NAME, SONGS.DURATION, SONGS.SONG_ID, ARTISTS.ARTIST_ID 
+                          FROM SONGS JOIN ARTISTS ON SONGS.ARTIST_ID = ARTISTS.ARTIST_ID ;""")
+
+# MANIFEST
+# Queries used by manifest.py to skip the files loaded by earlier runs
+loaded_files_select = (""" SELECT PATH, SIZE, MTIME, CONTENT_HASH FROM LOADED_FILES ;""")
+
+loaded_files_upsert = (""" INSERT INTO LOADED_FILES ( PATH, 
+                                                       SIZE, 
+                                                       MTIME, 
+                                                       CONTENT_HASH) 
+                            VALUES(%s, %s, %s, %s) 
+                            ON CONFLICT (PATH) DO UPDATE 
+                            SET SIZE = EXCLUDED.SIZE, 
+                                MTIME = EXCLUDED.MTIME, 
+                                CONTENT_HASH = EXCLUDED.CONTENT_HASH, 
+                                LOADED_AT = NOW();""")
+
+# Empties every table and the manifest before a full refresh
+truncate_tables = ("""TRUNCATE SONGPLAYS, USERS, SONGS, ARTISTS, TIME, LOADED_FILES RESTART IDENTITY""")
+
+# TIME LOOKUP
+# Timestamps already in the time table, in epoch milliseconds, for the time dimension builder in time_dimension.py
+time_loaded_select = (""" SELECT ROUND(EXTRACT(EPOCH FROM START_TIME) * 1000)::BIGINT FROM TIME ;""")
+
+time_missing_select = (""" SELECT DISTINCT ROUND(EXTRACT(EPOCH FROM SONGPLAYS.START_TIME) * 1000)::BIGINT 
+                           FROM SONGPLAYS LEFT JOIN TIME ON SONGPLAYS.START_TIME = TIME.START_TIME 
+                           WHERE TIME.START_TIME IS NULL ;""")
+
+# STAGING TABLES
+# Temporary tables filled with COPY ... FROM STDIN by the bulk loader in etl.py.
+# Rows are cleared on every commit, so each batch starts with empty staging tables.
+song_stage_create = ("""CREATE TEMP TABLE IF NOT EXISTS SONGS_STAGE (LIKE SONGS) ON COMMIT DELETE ROWS""")
+
+# ORDINAL is the position of the row in its batch, in file order, so the upsert keeps the first row of an artist like the row by row inserts
+artist_stage_create = ("""CREATE TEMP TABLE IF NOT EXISTS ARTISTS_STAGE (LIKE ARTISTS, ORDINAL INT) ON COMMIT DELETE ROWS""")
+
+user_stage_create = ("""CREATE TEMP TABLE IF NOT EXISTS USERS_STAGE (LIKE USERS) ON COMMIT DELETE ROWS""")
+
+time_stage_create = ("""CREATE TEMP TABLE IF NOT EXISTS TIME_STAGE (LIKE TIME) ON COMMIT DELETE ROWS""")
+
+songplay_stage_create = ("""CREATE TEMP TABLE IF NOT EXISTS SONGPLAYS_STAGE ( START_TIME TIMESTAMP, 
+                                                                             USER_ID INT, 
+                                                                             LEVEL VARCHAR, 
+                                                                             SONG VARCHAR, 
+                                                                             ARTIST VARCHAR, 
+                                                                             LENGTH FLOAT, 
+                                                                             SESSION_ID INT, 
+                                                                             LOCATION VARCHAR, 
+                                                                             USER_AGENT VARCHAR) 
+                            ON COMMIT DELETE ROWS""")
+
+copy_stage = """COPY {} FROM STDIN WITH (FORMAT csv, NULL '\\N')"""
+
+# UPSERT RECORDS
+# Set-based versions of the inserts above, reading from the staging tables.
+# The conflict rules are the same as for the single row inserts. Rows are inserted in key order
+# so that concurrent loaders lock conflicting keys in the same order and cannot deadlock.
+songplay_table_upsert = (""" INSERT INTO SONGPLAYS ( START_TIME, 
+                                                      USER_ID, 
+                                                      LEVEL, 
+                                                      SONG_ID, 
+                                                      ARTIST_ID,  
+                                                      SESSION_ID, 
+                                                      LOCATION, 
+                                                      USER_AGENT) 
+                            SELECT ST.START_TIME, ST.USER_ID, ST.LEVEL, SA.SONG_ID, SA.ARTIST_ID, 
+                                   ST.SESSION_ID, ST.LOCATION, ST.USER_AGENT 
+                            FROM SONGPLAYS_STAGE ST 
+                            LEFT JOIN LATERAL ( SELECT SONGS.SONG_ID, ARTISTS.ARTIST_ID 
+                                                FROM SONGS JOIN ARTISTS ON SONGS.ARTIST_ID = ARTISTS.ARTIST_ID 
+                                                WHERE SONGS.TITLE = ST.SONG 
+                                                AND ARTISTS.NAME = ST.ARTIST 
+                                                AND SONGS.DURATION = ST.LENGTH 
+                                                LIMIT 1) SA ON TRUE 
+                            ON CONFLICT DO NOTHING;""")
+
+user_table_upsert = (""" INSERT INTO USERS ( USER_ID, 
+                                             FIRST_NAME, 
+                                             LAST_NAME, 
+                                             GENDER, 
+                                             LEVEL) 
+                        SELECT USER_ID, FIRST_NAME, LAST_NAME, GENDER, LEVEL FROM USERS_STAGE ORDER BY USER_ID 
+                        ON CONFLICT (USER_ID) DO UPDATE
+                        SET level = EXCLUDED.level;""")
+
+song_table_upsert = (""" INSERT INTO SONGS ( SONG_ID, 
+                                             TITLE, 
+                                             ARTIST_ID, 
+                                             YEAR, 
+                                             DURATION) 
+                        SELECT SONG_ID, TITLE, ARTIST_ID, YEAR, DURATION FROM SONGS_STAGE ORDER BY SONG_ID 
+                        ON CONFLICT DO NOTHING;""")
+
+artist_table_upsert = (""" INSERT INTO ARTISTS ( ARTIST_ID, 
+                                                 NAME, 
+                                                 LOCATION, 
+                                                 LATITUDE, 
+                                                 LONGITUDE) 
+                            SELECT DISTINCT ON (ARTIST_ID) ARTIST_ID, NAME, LOCATION, LATITUDE, LONGITUDE 
+                            FROM ARTISTS_STAGE ORDER BY ARTIST_ID, ORDINAL 
+                            ON CONFLICT DO NOTHING;""")
+
+time_table_upsert = (""" INSERT INTO TIME ( START_TIME, 
+                                            HOUR, 
+                                            DAY, 
+                                            WEEK, 
+                                            MONTH, 
+                                            YEAR, 
+                                            WEEKDAY) 
+                        SELECT START_TIME, HOUR, DAY, WEEK, MONTH, YEAR, WEEKDAY FROM TIME_STAGE ORDER BY START_TIME 
+                        ON CONFLICT DO NOTHING;""")
+
 # QUERY LISTS
 
-create_table_queries = [songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
\ No newline at end of file
+create_table_queries = [songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, loaded_files_table_create]
+drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, loaded_files_table_drop]
+create_table_queries_tuned = [songplay_table_create_partitioned, user_table_create, song_table_create, artist_table_create, time_table_create, loaded_files_table_create]
+lookup_index_queries = [song_lookup_index_create, artist_lookup_index_create]
+songplay_index_queries = [songplay_time_brin_create, time_brin_create]
+drop_index_queries = ["DROP INDEX IF EXISTS SONGS_LOOKUP_IDX", "DROP INDEX IF EXISTS ARTISTS_LOOKUP_IDX",
+                      "DROP INDEX IF EXISTS SONGPLAYS_START_TIME_BRIN", "DROP INDEX IF EXISTS TIME_START_TIME_BRIN"]
+migrate_queries = [loaded_files_table_create, songplay_unique_add]
+create_stage_queries = [songplay_stage_create, user_stage_create, song_stage_create, artist_stage_create, time_stage_create]
\ No newline at end of file
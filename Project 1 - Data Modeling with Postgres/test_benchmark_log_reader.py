@@ -0,0 +1,22 @@
+import os
+from benchmark_log_reader import write_log_file, read_chunks, run
+
+# Runs the chunked log reader of benchmark_log_reader.py on log files of growing sizes, each read in a new process,
+# and checks that its peak memory stays about the same while the file grows eightfold.
+
+
+def test_chunked_peak_memory_stays_flat(tmp_path):
+    peaks = {}
+    for events in [20000, 160000]:
+        filepath = str(tmp_path / 'events-{}.json'.format(events))
+        write_log_file(filepath, events)
+        file_mb = os.path.getsize(filepath) / 1e6
+        count, _, peak = run(read_chunks, filepath, 5000)
+        assert 0 < count < events
+        peaks[events] = (file_mb, peak)
+
+    (small_mb, small_peak), (large_mb, large_peak) = peaks[20000], peaks[160000]
+    assert large_mb > 7 * small_mb
+    # the peak of the large file grows by much less than the file itself, and stays below its size
+    assert large_peak < small_peak + 0.25 * (large_mb - small_mb) + 10
+    assert large_peak < large_mb
@@ -0,0 +1,146 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+import psycopg2
+from db import dsn
+from create_tables import reset_tables
+from etl import get_files
+from manifest import FileManifest
+
+# Runs etl.py in each of its modes on a small dataset, in its own schema of a local Postgres given by SPARKIFY_DSN
+# or the SPARKIFY_DB_* variables (see db.py), e.g. SPARKIFY_DB_HOST=localhost, and checks that every mode loads the
+# same tables and that a second run loads no file. Skipped when no Postgres is reachable.
+
+SCHEMA = 'etl_test'
+PROJECT = os.path.dirname(os.path.abspath(__file__))
+
+MODES = {
+    'row': ([], False),
+    'bulk': (['--bulk', '--batch-size', '2'], False),
+    'workers': (['--workers', '2', '--batch-size', '1'], False),
+    'tuned': (['--bulk', '--batch-size', '2'], True),
+}
+
+SONGS = [('SO1', 'AR1', 'Artist One', 'Song One'), ('SO2', 'AR1', 'Artist One', 'Song Two'),
+         ('SO3', 'AR2', 'Artist Two', 'Song Three'), ('SO4', 'AR3', 'Artist Three', 'Song Four'),
+         ('SO5', 'AR3', 'Artist Three', 'Song Five'), ('SO6', 'AR4', 'Artist Four', 'Song Six')]
+
+TABLES = {
+    'songs': 'SELECT * FROM songs ORDER BY song_id',
+    'users': 'SELECT * FROM users ORDER BY user_id',
+    'time': 'SELECT * FROM time ORDER BY start_time',
+    'songplays': 'SELECT start_time, user_id, level, song_id, artist_id, session_id, location, user_agent '
+                 'FROM songplays ORDER BY start_time, user_id',
+}
+
+
+@pytest.fixture
+def schema_dsn():
+    try:
+        conn = psycopg2.connect(dsn(), connect_timeout=3)
+    except psycopg2.OperationalError as error:
+        pytest.skip('no Postgres reachable: {}'.format(error))
+    cur = conn.cursor()
+    cur.execute('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0};'.format(SCHEMA))
+    conn.commit()
+    # every connection of etl.py and of its workers uses the schema
+    yield "{} options='-csearch_path={}'".format(dsn(), SCHEMA)
+    conn.rollback()
+    cur.execute('DROP SCHEMA {} CASCADE;'.format(SCHEMA))
+    conn.commit()
+    conn.close()
+
+
+def write_song(directory, song_id, artist_id, artist_name, title):
+    path = os.path.join(directory, 'song_data', song_id[0], song_id[1], song_id + '.json')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'num_songs': 1, 'artist_id': artist_id, 'artist_latitude': None, 'artist_longitude': None,
+                   'artist_location': '', 'artist_name': artist_name, 'song_id': song_id, 'title': title,
+                   'duration': 200.5, 'year': 0}, f)
+
+
+def event(ts, user_id, level, page='NextSong', song=None, artist=None):
+    return {'artist': artist, 'auth': 'Logged In' if user_id else 'Logged Out', 'firstName': 'First', 'gender': 'F',
+            'itemInSession': 0, 'lastName': 'Last', 'length': 200.5 if song else None, 'level': level,
+            'location': 'Atlanta, GA', 'method': 'PUT', 'page': page, 'registration': 1540000000000.0,
+            'sessionId': 7, 'song': song, 'status': 200, 'ts': ts, 'userAgent': 'agent', 'userId': str(user_id or '')}
+
+
+def write_log(directory, day, events):
+    path = os.path.join(directory, 'log_data', '2018', '11', '2018-11-{:02d}-events.json'.format(day))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        for e in events:
+            f.write(json.dumps(e) + '\n')
+
+
+def write_data(directory):
+    for song in SONGS:
+        write_song(directory, *song)
+    day = 1541030400000
+    write_log(directory, 1, [event(day + 1000, 1, 'free', song='Song One', artist='Artist One'),
+                             event(day + 2000, 1, 'free', song='Song Two', artist='Artist One'),
+                             event(day + 3000, 1, 'free', page='Home'),
+                             event(day + 4000, None, 'free', page='Home'),
+                             event(day + 5000, 2, 'paid', song='Song Three', artist='Artist Two'),
+                             event(day + 6000, 2, 'paid', song='Unknown Song', artist='Unknown Artist')])
+    write_log(directory, 2, [event(day + 86400000, 1, 'paid', song='Song Four', artist='Artist Three'),
+                             event(day + 86401000, 3, 'free', song='Song Five', artist='Artist Three')])
+    write_log(directory, 3, [event(day + 2 * 86400000, 2, 'free', song='Song Six', artist='Artist Four'),
+                             event(day + 2 * 86400000 + 1000, 3, 'free', song='Song One', artist='Artist One')])
+
+
+def run_etl(conn_dsn, input_data, args):
+    env = dict(os.environ, SPARKIFY_DSN=conn_dsn)
+    subprocess.run([sys.executable, os.path.join(PROJECT, 'etl.py'), '--input', input_data] + args,
+                   cwd=PROJECT, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def read_tables(cur):
+    tables = {}
+    for table, query in TABLES.items():
+        cur.execute(query)
+        tables[table] = cur.fetchall()
+    cur.connection.commit()
+    return tables
+
+
+def files_to_load(cur, input_data):
+    manifest = FileManifest()
+    manifest.load(cur)
+    files = manifest.select_files(cur, get_files(os.path.join(input_data, 'song_data')) +
+                                  get_files(os.path.join(input_data, 'log_data')))
+    cur.connection.commit()
+    return files
+
+
+def test_modes_load_the_same_tables(schema_dsn, tmp_path):
+    input_data = str(tmp_path)
+    write_data(input_data)
+    conn = psycopg2.connect(schema_dsn)
+    cur = conn.cursor()
+    loaded = {}
+    try:
+        for mode, (args, tuned) in MODES.items():
+            reset_tables(cur, conn, tuned)
+            assert len(files_to_load(cur, input_data)) == 9
+            run_etl(schema_dsn, input_data, args)
+            loaded[mode] = read_tables(cur)
+            assert files_to_load(cur, input_data) == [], mode
+
+            # a second run finds every file in the manifest and leaves the tables as they are
+            run_etl(schema_dsn, input_data, args)
+            assert read_tables(cur) == loaded[mode], mode
+    finally:
+        conn.close()
+
+    for mode in MODES:
+        assert loaded[mode] == loaded['row'], mode
+    tables = loaded['row']
+    assert {table: len(rows) for table, rows in tables.items()} == {'songs': 6, 'users': 3, 'time': 8, 'songplays': 8}
+    # the level of a user is the one of their last event
+    assert [(row[0], row[4]) for row in tables['users']] == [(1, 'paid'), (2, 'free'), (3, 'free')]
+    assert [row[3] for row in tables['songplays']] == ['SO1', 'SO2', 'SO3', None, 'SO4', 'SO5', 'SO6', 'SO1']
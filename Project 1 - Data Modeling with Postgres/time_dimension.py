@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from sql_queries import time_loaded_select, time_missing_select
+
+
+def time_rows(ts):
+
+    """
+    Derives the time dimension columns for an array of epoch millisecond timestamps in one vectorized pass.
+
+        PARAMETERS:
+            TS: Array or Series of timestamps in milliseconds.
+
+    """
+    t = pd.to_datetime(np.asarray(ts, dtype='int64'), unit='ms')
+    return pd.DataFrame({
+        'ts': t,
+        'hour': t.hour,
+        'day': t.day,
+        'week': t.isocalendar().week.to_numpy(dtype='int64'),
+        'month': t.month,
+        'year': t.year,
+        'weekday': t.weekday,
+    })
+
+
+class TimeDimension:
+
+    """
+    Collects the distinct timestamps of a run and builds the time dimension rows once, at the end.
+
+    Timestamps already in the TIME table, or already built earlier in the run, are skipped,
+    so they are neither derived again nor sent to the server only to be rejected by ON CONFLICT.
+    """
+
+    def __init__(self):
+        self.loaded = np.empty(0, dtype='int64')
+        self.pending = []
+
+    def load(self, cur):
+
+        """
+        Marks every timestamp already in the TIME table as loaded, and collects the songplay
+        timestamps missing from it, e.g. when an earlier run stopped before its time load.
+
+            PARAMETERS:
+                CUR: Connection cursor to the database.
+
+        """
+        cur.execute(time_loaded_select)
+        loaded = np.array([row[0] for row in cur.fetchall()], dtype='int64')
+        self.loaded = np.union1d(self.loaded, loaded)
+
+        cur.execute(time_missing_select)
+        self.add([row[0] for row in cur.fetchall()])
+
+    def add(self, ts):
+
+        """
+        Collects the timestamps of a batch of NextSong events.
+
+            PARAMETERS:
+                TS: Array or Series of timestamps in milliseconds.
+
+        """
+        self.pending.append(np.unique(np.asarray(ts, dtype='int64')))
+
+    def flush(self):
+
+        """
+        Returns the time dimension rows for the collected timestamps that are not loaded yet,
+        and marks them as loaded.
+        """
+        if not self.pending:
+            return time_rows([])
+
+        new = np.setdiff1d(np.unique(np.concatenate(self.pending)), self.loaded, assume_unique=True)
+        self.loaded = np.union1d(self.loaded, new)
+        self.pending = []
+        return time_rows(new)
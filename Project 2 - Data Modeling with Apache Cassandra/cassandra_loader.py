@@ -0,0 +1,219 @@
+import csv
+import time
+import argparse
+from collections import defaultdict, deque
+from cassandra.cluster import Cluster
+from cassandra.query import BatchStatement, BatchType
+from schema_engine import QUERIES, build_table
+
+# tables generated from the query specs in schema_engine.py
+TABLES = [build_table(spec) for spec in QUERIES]
+
+
+def read_events(filepath):
+
+    """
+    Reads event_datafile_new.csv once and yields each row as a dict keyed on the csv header.
+
+        PARAMETERS:
+            FILEPATH: Filepath of the event data csv file.
+
+    """
+    with open(filepath, encoding='utf8', newline='') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def row_mapper(table):
+
+    """
+    Returns a function building the values of the table's INSERT from a row of the event data.
+
+        PARAMETERS:
+            TABLE: Table of the data model.
+
+    """
+    columns = [(csv_column, convert) for _, csv_column, convert in table.columns]
+    return lambda row: tuple(convert(row[csv_column]) for csv_column, convert in columns)
+
+
+class PartitionBatcher:
+
+    """
+    Groups the rows of one table by partition key into UNLOGGED batches, so that each batch
+    is written to a single partition (and a single replica set). At most MAX_PENDING rows are
+    held back, so memory use does not grow with the input.
+    """
+
+    def __init__(self, statement, key_positions, batch_size, max_pending):
+        self.statement = statement
+        self.key_positions = key_positions
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.groups = defaultdict(list)
+        self.pending = 0
+
+    def add(self, values):
+
+        """
+        Adds the values of a row and returns the batches ready to be written: the batch of its
+        partition once it is full, or every batch when too many rows are held back.
+
+            PARAMETERS:
+                VALUES: Values of the prepared INSERT.
+
+        """
+        key = tuple(values[i] for i in self.key_positions)
+        group = self.groups[key]
+        group.append(values)
+        self.pending += 1
+        if len(group) >= self.batch_size:
+            del self.groups[key]
+            self.pending -= len(group)
+            return [self.batch(group)]
+        if self.pending >= self.max_pending:
+            return self.drain()
+        return []
+
+    def drain(self):
+
+        """
+        Returns the batches of all the partitions that are not full yet.
+        """
+        batches = [self.batch(group) for group in self.groups.values()]
+        self.groups.clear()
+        self.pending = 0
+        return batches
+
+    def batch(self, group):
+        batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+        for values in group:
+            batch.add(self.statement, values)
+        return batch
+
+
+class InFlightWindow:
+
+    """
+    Executes statements asynchronously with at most MAX_IN_FLIGHT requests waiting on the cluster.
+    """
+
+    def __init__(self, session, max_in_flight):
+        self.session = session
+        self.max_in_flight = max_in_flight
+        self.futures = deque()
+
+    def submit(self, statement):
+
+        """
+        Sends a statement, first waiting for the oldest request when the window is full.
+
+            PARAMETERS:
+                STATEMENT: Statement or batch to execute.
+
+        """
+        if len(self.futures) >= self.max_in_flight:
+            self.futures.popleft().result()
+        self.futures.append(self.session.execute_async(statement))
+
+    def wait(self):
+
+        """
+        Waits for every request still in flight, raising the first error.
+        """
+        while self.futures:
+            self.futures.popleft().result()
+
+
+def create_tables(session, tables=TABLES):
+
+    """
+    Creates the tables of the data model.
+
+        PARAMETERS:
+            SESSION: Cassandra session with the keyspace set.
+            TABLES: Tables of the data model.
+
+    """
+    for table in tables:
+        session.execute(table.create)
+
+
+def load_events(session, rows, tables=TABLES, batch_size=20, max_in_flight=64):
+
+    """
+    Fans out every event row to all the tables: rows are mapped with prepared statements,
+    grouped by partition key into unlogged batches and written with a bounded number of
+    requests in flight. Returns the number of rows read and the elapsed seconds.
+
+        PARAMETERS:
+            SESSION: Cassandra session with the keyspace set.
+            ROWS: Iterable of event rows, e.g. read_events(filepath).
+            TABLES: Tables of the data model.
+            BATCH_SIZE: Maximum number of rows per unlogged batch.
+            MAX_IN_FLIGHT: Maximum number of requests waiting on the cluster.
+
+    """
+    mappers = []
+    for table in tables:
+        statement = session.prepare(table.insert)
+        names = [name for name, _, _ in table.columns]
+        key_positions = [names.index(name) for name in table.partition_key]
+        batcher = PartitionBatcher(statement, key_positions, batch_size, max_pending=batch_size * max_in_flight)
+        mappers.append((row_mapper(table), batcher))
+
+    window = InFlightWindow(session, max_in_flight)
+    start = time.perf_counter()
+    count = 0
+
+    for row in rows:
+        count += 1
+        for mapper, batcher in mappers:
+            for batch in batcher.add(mapper(row)):
+                window.submit(batch)
+
+    for _, batcher in mappers:
+        for batch in batcher.drain():
+            window.submit(batch)
+    window.wait()
+
+    return count, time.perf_counter() - start
+
+
+def rows_per_second(count, elapsed):
+    return count / elapsed if elapsed else 0.0
+
+
+def main():
+
+    """
+    Creates the sparkify keyspace and tables on a Cassandra node and loads event_datafile_new.csv into them.
+    """
+    parser = argparse.ArgumentParser(description='Loads event_datafile_new.csv into the sparkify Cassandra tables.')
+    parser.add_argument('--host', default='127.0.0.1', help='Cassandra contact point')
+    parser.add_argument('--file', default='event_datafile_new.csv', help='event data csv file')
+    parser.add_argument('--batch-size', type=int, default=20, help='maximum number of rows per unlogged batch')
+    parser.add_argument('--max-in-flight', type=int, default=64, help='maximum number of requests in flight')
+    args = parser.parse_args()
+
+    cluster = Cluster([args.host])
+    session = cluster.connect()
+
+    session.execute("""
+    CREATE KEYSPACE IF NOT EXISTS sparkify
+    WITH REPLICATION =
+    { 'class': 'SimpleStrategy', 'replication_factor' : 1}""")
+    session.set_keyspace('sparkify')
+
+    create_tables(session)
+    count, elapsed = load_events(session, read_events(args.file), batch_size=args.batch_size,
+                                 max_in_flight=args.max_in_flight)
+    print('{} rows loaded into {} tables in {:.2f}s ({:.0f} rows/sec)'.format(
+        count, len(TABLES), elapsed, rows_per_second(count, elapsed)))
+
+    session.shutdown()
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import os
+import csv
+import glob
+import argparse
+from collections import deque
+from itertools import chain, islice
+from concurrent.futures import ProcessPoolExecutor
+
+# columns of event_datafile_new.csv and their positions in the event_data csv files
+EVENT_COLUMNS = ['artist', 'firstName', 'gender', 'itemInSession', 'lastName', 'length',
+                 'level', 'location', 'sessionId', 'song', 'userId']
+EVENT_POSITIONS = [0, 2, 3, 4, 5, 6, 7, 8, 12, 13, 16]
+
+csv.register_dialect('myDialect', quoting=csv.QUOTE_ALL, skipinitialspace=True)
+
+
+def event_files(filepath):
+
+    """
+    Returns the csv files under the event data directory, sorted so that every run reads them in the same order.
+
+        PARAMETERS:
+            FILEPATH: Filepath of the event_data directory.
+
+    """
+    file_path_list = []
+    for root, dirs, files in os.walk(filepath):
+        file_path_list.extend(glob.glob(os.path.join(root, '*.csv')))
+    return sorted(file_path_list)
+
+
+def read_event_file(filepath):
+
+    """
+    Lazily yields the rows of an event data file that have an artist, keeping only the columns of event_datafile_new.csv.
+
+        PARAMETERS:
+            FILEPATH: Filepath of the event data csv file.
+
+    """
+    with open(filepath, 'r', encoding='utf8', newline='') as csvfile:
+        csvreader = csv.reader(csvfile)
+        next(csvreader, None)
+        for line in csvreader:
+            if line[0] == '':
+                continue
+            yield tuple(line[i] for i in EVENT_POSITIONS)
+
+
+def read_event_file_rows(filepath):
+
+    """
+    Returns the filtered rows of an event data file as a list, for the worker processes of stream_events.
+
+        PARAMETERS:
+            FILEPATH: Filepath of the event data csv file.
+
+    """
+    return list(read_event_file(filepath))
+
+
+def stream_events(file_path_list, workers=1):
+
+    """
+    Yields the filtered rows of all the event data files, file after file.
+
+    With more than one worker, the files are read in worker processes. The rows are still yielded
+    in the order of FILE_PATH_LIST, and only a few files are read ahead, so memory stays bounded.
+
+        PARAMETERS:
+            FILE_PATH_LIST: Filepaths of the event data files, e.g. event_files(filepath).
+            WORKERS: Number of worker processes reading the files.
+
+    """
+    if workers <= 1:
+        yield from chain.from_iterable(read_event_file(f) for f in file_path_list)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        files = iter(file_path_list)
+        futures = deque(executor.submit(read_event_file_rows, f) for f in islice(files, 2 * workers))
+        while futures:
+            rows = futures.popleft().result()
+            f = next(files, None)
+            if f is not None:
+                futures.append(executor.submit(read_event_file_rows, f))
+            yield from rows
+
+
+def as_records(rows):
+
+    """
+    Yields the rows as dicts keyed on the columns of event_datafile_new.csv, the form read by cassandra_loader.load_events.
+
+        PARAMETERS:
+            ROWS: Rows yielded by stream_events.
+
+    """
+    for row in rows:
+        yield dict(zip(EVENT_COLUMNS, row))
+
+
+def write_event_datafile(rows, filepath):
+
+    """
+    Writes the rows to event_datafile_new.csv as they are read and returns the number of rows written.
+
+        PARAMETERS:
+            ROWS: Rows yielded by stream_events.
+            FILEPATH: Filepath of the csv file to write.
+
+    """
+    count = 0
+    with open(filepath, 'w', encoding='utf8', newline='') as f:
+        writer = csv.writer(f, dialect='myDialect')
+        writer.writerow(EVENT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def main():
+
+    """
+    Merges the event_data csv files into event_datafile_new.csv, or loads them straight into Cassandra.
+    """
+    parser = argparse.ArgumentParser(description='Merges the event_data csv files into event_datafile_new.csv.')
+    parser.add_argument('--input', default='event_data', help='event data directory')
+    parser.add_argument('--output', default='event_datafile_new.csv', help='csv file to write')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes reading the files')
+    parser.add_argument('--cassandra', metavar='HOST',
+                        help='load the rows into the sparkify keyspace on this Cassandra host instead of writing the csv file')
+    args = parser.parse_args()
+
+    rows = stream_events(event_files(args.input), args.workers)
+
+    if args.cassandra:
+        # the Cassandra driver is only needed when loading directly
+        from cassandra.cluster import Cluster
+        from cassandra_loader import create_tables, load_events
+
+        cluster = Cluster([args.cassandra])
+        session = cluster.connect('sparkify')
+        create_tables(session)
+        count, elapsed = load_events(session, as_records(rows))
+        print('{} rows loaded in {:.2f}s'.format(count, elapsed))
+        session.shutdown()
+        cluster.shutdown()
+    else:
+        count = write_event_datafile(rows, args.output)
+        print('{} rows written to {}'.format(count, args.output))
+
+
+if __name__ == "__main__":
+    main()
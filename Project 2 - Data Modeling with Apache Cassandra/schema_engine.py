@@ -0,0 +1,199 @@
+import csv
+import argparse
+from collections import defaultdict, namedtuple
+
+# A table of the data model: CREATE statement, prepared INSERT, the (table column, csv column, converter)
+# mapping used to build its rows from event_datafile_new.csv, and the columns of its partition key
+Table = namedtuple('Table', ['name', 'create', 'insert', 'columns', 'partition_key'])
+
+# A query the data model has to answer: the table serving it, the columns filtered on with equality,
+# the columns the result is sorted on, and the columns returned. UNIQUE lists extra clustering columns
+# that keep rows distinct, and PARTITION the leading filter columns that form the partition key
+# (all the filters by default); the other filters become clustering columns.
+QuerySpec = namedtuple('QuerySpec', ['table', 'filters', 'sorts', 'columns', 'unique', 'partition'],
+                       defaults=((), None))
+
+# table column -> (csv column of event_datafile_new.csv, CQL type, converter)
+COLUMNS = {
+    'artist_name': ('artist', 'text', str),
+    'first_name': ('firstName', 'text', str),
+    'gender': ('gender', 'text', str),
+    'item_in_session': ('itemInSession', 'int', int),
+    'last_name': ('lastName', 'text', str),
+    'song_duration': ('length', 'float', float),
+    'level': ('level', 'text', str),
+    'location': ('location', 'text', str),
+    'session_id': ('sessionId', 'int', int),
+    'song': ('song', 'text', str),
+    'song_title': ('song', 'text', str),
+    'user_id': ('userId', 'int', int),
+}
+
+# bytes per value of the fixed size CQL types, text values count their utf8 length
+TYPE_SIZES = {'int': 4, 'float': 4, 'bigint': 8, 'double': 8}
+
+QUERIES = [
+    # Query 1: artist, song title and song length heard during sessionId = 338, and itemInSession = 4
+    QuerySpec(table='music_library',
+              filters=['session_id', 'item_in_session'],
+              sorts=[],
+              columns=['artist_name', 'song_title', 'song_duration'],
+              partition=['session_id']),
+
+    # Query 2: artist, song (sorted by itemInSession) and user (first and last name) for userid = 10, sessionid = 182
+    QuerySpec(table='artist_library',
+              filters=['user_id', 'session_id'],
+              sorts=['item_in_session'],
+              columns=['artist_name', 'song', 'first_name', 'last_name']),
+
+    # Query 3: every user name (first and last) who listened to the song 'All Hands Against His Own'
+    QuerySpec(table='music_app_history',
+              filters=['song'],
+              sorts=[],
+              columns=['first_name', 'last_name'],
+              unique=['user_id']),
+]
+
+
+def unique_list(columns):
+    seen = []
+    for column in columns:
+        if column not in seen:
+            seen.append(column)
+    return seen
+
+
+def primary_key(spec):
+
+    """
+    Returns the partition key and clustering columns of the table serving a query.
+
+        PARAMETERS:
+            SPEC: QuerySpec of the query.
+
+    """
+    partition = list(spec.partition) if spec.partition is not None else list(spec.filters)
+    if partition != list(spec.filters[:len(partition)]):
+        raise ValueError('partition of {} must be a prefix of its filters'.format(spec.table))
+    clustering = unique_list(list(spec.filters[len(partition):]) + list(spec.sorts) + list(spec.unique))
+    return partition, [column for column in clustering if column not in partition]
+
+
+def build_table(spec):
+
+    """
+    Builds the CREATE TABLE statement, prepared INSERT and row mapping of the table serving a query.
+
+        PARAMETERS:
+            SPEC: QuerySpec of the query.
+
+    """
+    partition, clustering = primary_key(spec)
+    names = unique_list(partition + clustering + list(spec.columns))
+    unknown = [name for name in names if name not in COLUMNS]
+    if unknown:
+        raise ValueError('unknown columns in {}: {}'.format(spec.table, ', '.join(unknown)))
+
+    partition_cql = partition[0] if len(partition) == 1 else '({})'.format(', '.join(partition))
+    key_cql = ', '.join([partition_cql] + clustering)
+    create = 'CREATE TABLE IF NOT EXISTS {} ({}, PRIMARY KEY({}))'.format(
+        spec.table, ', '.join('{} {}'.format(name, COLUMNS[name][1]) for name in names), key_cql)
+    insert = 'INSERT INTO {} ({}) VALUES ({})'.format(spec.table, ', '.join(names), ', '.join('?' * len(names)))
+    columns = [(name, COLUMNS[name][0], COLUMNS[name][2]) for name in names]
+
+    return Table(name=spec.table, create=create, insert=insert, columns=columns, partition_key=partition)
+
+
+def select_statement(spec):
+
+    """
+    Returns the prepared SELECT answering a query from its table.
+
+        PARAMETERS:
+            SPEC: QuerySpec of the query.
+
+    """
+    return 'SELECT {} FROM {} WHERE {}'.format(
+        ', '.join(spec.columns), spec.table, ' AND '.join('{} = ?'.format(column) for column in spec.filters))
+
+
+def value_size(name, value):
+    cql_type = COLUMNS[name][1]
+    return TYPE_SIZES.get(cql_type, len(value.encode('utf8')))
+
+
+def partition_sizes(spec, filepath):
+
+    """
+    Estimates the number of rows and bytes of each partition of the table serving a query,
+    from the rows of event_datafile_new.csv. Rows with the same primary key are counted once,
+    as Cassandra upserts them.
+
+        PARAMETERS:
+            SPEC: QuerySpec of the query.
+            FILEPATH: Filepath of event_datafile_new.csv.
+
+    """
+    table = build_table(spec)
+    partition, clustering = primary_key(spec)
+    rows = defaultdict(dict)
+    with open(filepath, encoding='utf8', newline='') as f:
+        for line in csv.DictReader(f):
+            values = {name: line[csv_column] for name, csv_column, _ in table.columns}
+            key = tuple(values[name] for name in partition)
+            row_key = tuple(values[name] for name in clustering)
+            rows[key][row_key] = sum(value_size(name, value) for name, value in values.items())
+
+    return {key: (len(partition_rows), sum(partition_rows.values())) for key, partition_rows in rows.items()}
+
+
+def check_partitions(spec, sizes, max_rows=100000, max_bytes=100 * 1024 * 1024, hot_factor=10):
+
+    """
+    Returns warnings for the partitions of a table that are oversized, or hot: holding more than
+    HOT_FACTOR times the average number of rows per partition.
+
+        PARAMETERS:
+            SPEC: QuerySpec of the query.
+            SIZES: Partition sizes returned by partition_sizes.
+            MAX_ROWS: Maximum number of rows per partition.
+            MAX_BYTES: Maximum estimated bytes per partition.
+            HOT_FACTOR: Ratio to the average partition above which a partition is hot.
+
+    """
+    warnings = []
+    if not sizes:
+        return warnings
+
+    mean_rows = sum(rows for rows, _ in sizes.values()) / len(sizes)
+    for key, (rows, size) in sorted(sizes.items(), key=lambda item: -item[1][0]):
+        if rows > max_rows or size > max_bytes:
+            warnings.append('{}: partition {} is oversized ({} rows, ~{} bytes)'.format(spec.table, key, rows, size))
+        elif rows > hot_factor * mean_rows:
+            warnings.append('{}: partition {} is hot ({} rows, {:.1f} on average)'.format(spec.table, key, rows, mean_rows))
+    return warnings
+
+
+def main():
+
+    """
+    Prints the CQL of the tables generated from the query specs and the partition size estimates.
+    """
+    parser = argparse.ArgumentParser(description='Generates the Cassandra tables of the sparkify queries.')
+    parser.add_argument('--file', default='event_datafile_new.csv', help='event data csv file used for the estimates')
+    args = parser.parse_args()
+
+    for spec in QUERIES:
+        table = build_table(spec)
+        sizes = partition_sizes(spec, args.file)
+        print(table.create)
+        print(table.insert)
+        print(select_statement(spec))
+        print('{} partitions, largest {} rows'.format(len(sizes), max(rows for rows, _ in sizes.values()) if sizes else 0))
+        for warning in check_partitions(spec, sizes):
+            print('WARNING', warning)
+        print()
+
+
+if __name__ == "__main__":
+    main()
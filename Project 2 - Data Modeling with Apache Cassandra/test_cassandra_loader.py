@@ -0,0 +1,64 @@
+import os
+import csv
+import itertools
+import pytest
+
+pytest.importorskip('cassandra')
+
+from cassandra.cluster import Cluster, NoHostAvailable
+from cassandra_loader import TABLES, create_tables, load_events, read_events, rows_per_second
+from schema_engine import QUERIES, partition_sizes
+
+# Integration tests of cassandra_loader.py, run against the node at CASSANDRA_HOST (127.0.0.1 by default)
+# in a keyspace of their own, and skipped when no node is reachable.
+
+KEYSPACE = 'sparkify_test'
+SAMPLE_ROWS = 500
+
+
+@pytest.fixture(scope='module')
+def session():
+    cluster = Cluster([os.environ.get('CASSANDRA_HOST', '127.0.0.1')], connect_timeout=5)
+    try:
+        session = cluster.connect()
+    except NoHostAvailable:
+        cluster.shutdown()
+        pytest.skip('no Cassandra node reachable')
+    session.execute("""CREATE KEYSPACE IF NOT EXISTS {}
+                       WITH REPLICATION = {{'class': 'SimpleStrategy', 'replication_factor': 1}}""".format(KEYSPACE))
+    session.set_keyspace(KEYSPACE)
+    yield session
+    session.execute('DROP KEYSPACE IF EXISTS {}'.format(KEYSPACE))
+    cluster.shutdown()
+
+
+@pytest.fixture
+def sample(tmp_path):
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'event_datafile_new.csv')
+    path = str(tmp_path / 'sample.csv')
+    with open(source, encoding='utf8', newline='') as f, open(path, 'w', encoding='utf8', newline='') as out:
+        reader = csv.reader(f)
+        csv.writer(out, quoting=csv.QUOTE_ALL).writerows(itertools.islice(reader, SAMPLE_ROWS + 1))
+    return path
+
+
+def test_load_events(session, sample):
+    for table in TABLES:
+        session.execute('DROP TABLE IF EXISTS {}'.format(table.name))
+    create_tables(session)
+
+    # small batches and window, so several batches per partition and waits on the window are exercised
+    count, elapsed = load_events(session, read_events(sample), batch_size=5, max_in_flight=4)
+
+    assert count == SAMPLE_ROWS
+    assert elapsed > 0
+    assert rows_per_second(count, elapsed) == pytest.approx(count / elapsed)
+    for spec in QUERIES:
+        # rows with the same primary key are upserted, as estimated by partition_sizes
+        expected = sum(rows for rows, _ in partition_sizes(spec, sample).values())
+        assert session.execute('SELECT COUNT(*) FROM {}'.format(spec.table)).one()[0] == expected
+
+
+def test_rows_per_second():
+    assert rows_per_second(1000, 2.0) == 500
+    assert rows_per_second(0, 0) == 0
@@ -1,36 +1,44 @@
-import configparser
+import argparse
 import psycopg2
 from sql_queries import create_table_queries, drop_table_queries
+from postgres_dialect import postgres_create_table_queries, postgres_drop_table_queries
+from db import dsn, run_in_transaction
 def drop_tables(cur, conn):
     """
-    The purpose of this function is to drop any existing tables in the Redshift cluster.
+    The purpose of this function is to drop any existing tables in the Redshift cluster, in a single transaction.
         :param cur: cursor object to the database connection
         :param conn: connection object to the database
         
     """
-    for query in drop_table_queries:
-        cur.execute(query)
-        conn.commit()
+    run_in_transaction(cur, conn, drop_table_queries)
 def create_tables(cur, conn):
     """
-    The purpose of this function is to create the tables in the Redshift cluster.
+    The purpose of this function is to create the tables in the Redshift cluster, in a single transaction.
         :param cur: cursor object to the database connection
         :param conn: connection object to the database
     """
     for query in create_table_queries:
         print(query)
-        cur.execute(query)
-        conn.commit()
+    run_in_transaction(cur, conn, create_table_queries)
 def main():
     """
-    This function connects to the redshift cluster and resets all the tables in the database.
+    This function connects to the redshift cluster and resets all the tables in the database, dropping and creating them
+    in a single transaction. The [CLUSTER] settings of dwh.cfg can be overridden by the DWH_* environment variables, see db.py.
+    With --postgres the tables are created with the statements translated for a local Postgres by postgres_dialect.py.
     """
-    config = configparser.ConfigParser()
-    config.read('dwh.cfg')
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    parser = argparse.ArgumentParser(description="Drops and creates the tables of the Sparkify warehouse.")
+    parser.add_argument("--dsn", help="connection string used instead of the [CLUSTER] settings, e.g. of a local Postgres")
+    parser.add_argument("--postgres", action="store_true", help="create the tables on Postgres instead of Redshift")
+    args = parser.parse_args()
+    drop_queries, create_queries = drop_table_queries, create_table_queries
+    if args.postgres:
+        drop_queries, create_queries = postgres_drop_table_queries, postgres_create_table_queries
+
+    conn = psycopg2.connect(args.dsn or dsn())
     cur = conn.cursor()
-    drop_tables(cur, conn)
-    create_tables(cur, conn)
+    for query in create_queries:
+        print(query)
+    run_in_transaction(cur, conn, drop_queries + create_queries)
     conn.close()
 if __name__ == "__main__":
     main()
\ No newline at end of file
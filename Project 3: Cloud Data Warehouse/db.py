@@ -0,0 +1,51 @@
+import os
+import configparser
+from psycopg2.pool import ThreadedConnectionPool
+
+# Environment variables overriding the [CLUSTER] settings of dwh.cfg, in the order of the section.
+# DWH_DSN, when set, is used as is instead of all of them.
+CLUSTER_VARIABLES = ['DWH_HOST', 'DWH_DB_NAME', 'DWH_DB_USER', 'DWH_DB_PASSWORD', 'DWH_DB_PORT']
+
+
+def dsn(config_file='dwh.cfg'):
+    """
+    This function returns the connection string of the cluster, from the [CLUSTER] section of the config file,
+    where every setting can be overridden by its environment variable, e.g. DWH_HOST for a local Postgres.
+    :param config_file: the path of the config file
+    """
+    if os.environ.get('DWH_DSN'):
+        return os.environ['DWH_DSN']
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    values = list(config['CLUSTER'].values()) if config.has_section('CLUSTER') else [''] * len(CLUSTER_VARIABLES)
+    values = [os.environ.get(variable, value) for variable, value in zip(CLUSTER_VARIABLES, values)]
+    return "host={} dbname={} user={} password={} port={}".format(*values)
+
+
+def create_pool(dsn, connections):
+    """
+    This function opens a pool of connections to the cluster, shared by the steps of a run,
+    so every statement reuses an open connection instead of connecting again.
+    :param dsn: the connection string of the cluster
+    :param connections: the maximum number of connections of the pool
+    """
+    return ThreadedConnectionPool(1, connections, dsn)
+
+
+def run_in_transaction(cur, conn, queries):
+    """
+    This function runs the statements one after another and commits them once, so they are applied together
+    and the cluster commits once instead of after every statement. Nothing is applied if one of them fails.
+    Returns the number of statements run.
+    :param cur: the database cursor
+    :param conn: the database connection
+    :param queries: the statements to run
+    """
+    try:
+        for query in queries:
+            cur.execute(query)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(queries)
@@ -1,44 +1,112 @@
+import argparse
 import configparser
 import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
+from sql_queries import copy_table_queries, insert_table_queries, etl_steps, LOG_DATA, SONG_DATA, MANIFESTS
+from scheduler import Step, run_steps, print_timings
+from db import dsn as cluster_dsn, create_pool, run_in_transaction
+from rollups import refresh_rollups
+from postgres_dialect import local_etl_steps
 
 
 def load_staging_tables(cur, conn):
     """
-    This function loads the data from all the logs by using all the copy table queries into the staging tables.
+    This function loads the data from all the logs by using all the copy table queries into the staging tables, in a single transaction.
     :param cur: the database cursur
     :param conn:the database connection
     """
-    for query in copy_table_queries:
-        cur.execute(query)
-        conn.commit()
+    run_in_transaction(cur, conn, copy_table_queries)
 
 
 def insert_tables(cur, conn):
     """
-    This function inserts the data from the staging tables into the five tables designed as part of the star schema.
+    This function inserts the data from the staging tables into the five tables designed as part of the star schema, in a single transaction.
     :param cur: the database cursur
     :param conn:the database connection
     """
-    for query in insert_table_queries:
-        cur.execute(query)
-        conn.commit()
+    run_in_transaction(cur, conn, insert_table_queries)
+
+
+def run_etl(dsn, workers, local_data=None):
+    """
+    This function runs the copy and insert queries on a pool of connections, each one as soon as the steps it depends on
+    are committed, so the two staging COPYs, and then the dimension inserts, run at the same time. It prints the time of each step.
+    :param dsn: the connection string of the database
+    :param workers: the number of statements run at the same time
+    :param local_data: a local directory holding song_data and log_data, loaded into a local Postgres
+                       with the statements translated by postgres_dialect.py, instead of the COPYs from S3
+    """
+    steps = local_etl_steps(local_data) if local_data else [Step(*step) for step in etl_steps]
+    pool = create_pool(dsn, workers)
+    try:
+        timings = run_steps(pool, steps, workers)
+    finally:
+        pool.closeall()
+    print_timings(timings)
+
+
+def refresh_aggregates(dsn):
+    """
+    This function refreshes the partitions of the aggregate tables changed by the load and prints how many were refreshed.
+    :param dsn: the connection string of the database
+    """
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    for name, partitions in refresh_rollups(cur, conn).items():
+        print("{}: {} partitions refreshed".format(name, partitions))
+    conn.close()
 
 
 def main():
     """
-    This is where we're actually calling the functions insert_tables and load_staging_tables to run. Connection details are specified as part of dwh.cfg file.  
+    This is where we're actually calling the functions insert_tables and load_staging_tables to run. Connection details are specified as part of dwh.cfg file,
+    and can be overridden by the DWH_* environment variables, see db.py.
     """
+    parser = argparse.ArgumentParser(description="Loads the Sparkify data from S3 into the Redshift star schema.")
+    parser.add_argument("--workers", type=int, default=4, help="number of statements run at the same time")
+    parser.add_argument("--serial", action="store_true", help="run the statements one after another on a single connection")
+    parser.add_argument("--dsn", help="connection string used instead of the [CLUSTER] settings, e.g. of a local Postgres")
+    parser.add_argument("--local", metavar="DIR",
+                        help="load the song_data and log_data of a local directory into a local Postgres given by --dsn, "
+                             "whose tables are created by create_tables.py --postgres")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only load the S3 objects not loaded yet, from COPY manifests written under MANIFESTS of dwh.cfg")
+    parser.add_argument("--refresh-rollups", action="store_true",
+                        help="refresh the partitions of the aggregate tables of rollups.py changed by the load")
+    args = parser.parse_args()
+
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
+    dsn = args.dsn or cluster_dsn()
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
-    cur = conn.cursor()
-    
-    load_staging_tables(cur, conn)
-    insert_tables(cur, conn)
+    if args.local:
+        run_etl(dsn, 1 if args.serial else args.workers, args.local)
+    elif args.incremental:
+        # boto3 is only needed to list the new objects and write the manifests
+        import boto3
+        from incremental import load_incremental
 
-    conn.close()
+        if not MANIFESTS:
+            parser.error("--incremental needs MANIFESTS in the [S3] section of dwh.cfg")
+        s3 = boto3.client('s3', aws_access_key_id=config.get('AWS', 'KEY'), aws_secret_access_key=config.get('AWS', 'SECRET'),
+                          region_name=config.get('AWS', 'REGION_NAME').strip("'"))
+        conn = psycopg2.connect(dsn)
+        cur = conn.cursor()
+        logs, songs = load_incremental(cur, conn, s3, LOG_DATA, SONG_DATA, MANIFESTS)
+        print("{} new log files and {} new song files loaded".format(logs, songs))
+        conn.close()
+    elif not args.serial:
+        run_etl(dsn, args.workers)
+    else:
+        conn = psycopg2.connect(dsn)
+        cur = conn.cursor()
+
+        load_staging_tables(cur, conn)
+        insert_tables(cur, conn)
+
+        conn.close()
+
+    if args.refresh_rollups:
+        refresh_aggregates(dsn)
 
 
 if __name__ == "__main__":
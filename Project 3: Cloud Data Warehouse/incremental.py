@@ -0,0 +1,92 @@
+import json
+import time
+from psycopg2.extras import execute_values
+from sql_queries import (staging_events_clear, staging_songs_clear, staging_events_copy_manifest, staging_songs_copy_manifest,
+                         loaded_files_select, loaded_files_insert, insert_table_queries)
+
+
+def split_url(url):
+    """
+    This function splits an S3 url, quoted or not, into its bucket and key prefix.
+    :param url: the S3 url, e.g. 's3://udacity-dend/log_data'
+    """
+    bucket, _, prefix = url.strip("'").replace('s3://', '', 1).partition('/')
+    return bucket, prefix
+
+
+def list_objects(s3, url):
+    """
+    This function lists the JSON objects under an S3 prefix, with their size and etag.
+    :param s3: the boto3 S3 client
+    :param url: the S3 url of the prefix, e.g. 's3://udacity-dend/log_data'
+    """
+    bucket, prefix = split_url(url)
+    objects = {}
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix.rstrip('/') + '/'):
+        for item in page.get('Contents', []):
+            if item['Key'].endswith('.json'):
+                objects['s3://{}/{}'.format(bucket, item['Key'])] = (item['Size'], item['ETag'].strip('"'))
+    return objects
+
+
+def new_objects(cur, url, objects):
+    """
+    This function returns the objects of a prefix that are not in the loaded_files control table yet.
+    :param cur: the database cursor
+    :param url: the S3 url of the prefix
+    :param objects: the objects returned by list_objects
+    """
+    bucket, prefix = split_url(url)
+    cur.execute(loaded_files_select, {'prefix': 's3://{}/{}/'.format(bucket, prefix.rstrip('/'))})
+    loaded = {row[0] for row in cur.fetchall()}
+    return {key: value for key, value in objects.items() if key not in loaded}
+
+
+def write_manifest(s3, url, keys):
+    """
+    This function writes the COPY manifest listing the objects to load and returns its url.
+    Every entry is mandatory, so the COPY fails instead of skipping an object that cannot be read.
+    :param s3: the boto3 S3 client
+    :param url: the S3 url of the manifest
+    :param keys: the S3 urls of the objects
+    """
+    bucket, key = split_url(url)
+    body = json.dumps({"entries": [{"url": k, "mandatory": True} for k in sorted(keys)]})
+    s3.put_object(Bucket=bucket, Key=key, Body=body.encode('utf-8'))
+    return 's3://{}/{}'.format(bucket, key)
+
+
+def load_incremental(cur, conn, s3, log_data, song_data, manifests):
+    """
+    This function loads only the objects of log_data and song_data that are not in the loaded_files control table.
+    The staging tables are reloaded from COPY manifests of the new objects, merged into the star schema by the insert queries,
+    which skip the rows already loaded, and the objects are recorded in loaded_files, all in a single transaction,
+    so a failed run leaves the tables and the control table as they were.
+    Returns the number of new log and song objects loaded.
+    :param cur: the database cursor
+    :param conn: the database connection
+    :param s3: the boto3 S3 client
+    :param log_data: the S3 url of log_data
+    :param song_data: the S3 url of song_data
+    :param manifests: the S3 url of the prefix the manifests are written to
+    """
+    run = time.strftime('%Y%m%dT%H%M%S')
+    new_logs = new_objects(cur, log_data, list_objects(s3, log_data))
+    new_songs = new_objects(cur, song_data, list_objects(s3, song_data))
+
+    cur.execute(staging_events_clear)
+    cur.execute(staging_songs_clear)
+    if new_logs:
+        cur.execute(staging_events_copy_manifest.format(
+            write_manifest(s3, '{}/{}/log_data.manifest'.format(manifests.rstrip('/'), run), new_logs)))
+    if new_songs:
+        cur.execute(staging_songs_copy_manifest.format(
+            write_manifest(s3, '{}/{}/song_data.manifest'.format(manifests.rstrip('/'), run), new_songs)))
+
+    if new_logs or new_songs:
+        for query in insert_table_queries:
+            cur.execute(query)
+        loaded = dict(new_logs, **new_songs)
+        execute_values(cur, loaded_files_insert, [(key, size, etag) for key, (size, etag) in loaded.items()])
+    conn.commit()
+    return len(new_logs), len(new_songs)
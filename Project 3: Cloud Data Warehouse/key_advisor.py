@@ -0,0 +1,329 @@
+import re
+import json
+import argparse
+from itertools import product
+from sql_queries import songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create
+from db import dsn
+
+# Recommends the distribution style and sort key of the star schema tables for a workload of analytic queries,
+# by modelling the rows each join moves between the nodes under every combination of DISTSTYLE KEY, ALL and EVEN,
+# and prints the CREATE TABLE statements with the recommended keys.
+
+TABLE_CREATES = {
+    'songplays': songplay_table_create,
+    'users': user_table_create,
+    'songs': song_table_create,
+    'artists': artist_table_create,
+    'time': time_table_create,
+}
+
+# rows and bytes per row of the tables loaded from the Udacity datasets, multiplied by --scale
+TABLE_SIZES = {
+    'songplays': (6820, 120),
+    'users': (96, 40),
+    'songs': (14896, 70),
+    'artists': (10025, 80),
+    'time': (6813, 36),
+}
+
+# distinct values of the filtered columns that are neither keys nor joined, in the Udacity datasets: the time table
+# covers one month of one year, and the songs about fifty years. Other filtered columns are given DEFAULT_VALUES.
+COLUMN_VALUES = {
+    ('time', 'year'): 1,
+    ('time', 'month'): 1,
+    ('songs', 'year'): 50,
+}
+DEFAULT_VALUES = 10
+
+# representative analytic queries and how many times each runs for one full load of the tables
+QUERIES = [
+    (20, """SELECT a.name, COUNT(*) FROM songplays as sp JOIN artists as a ON sp.artist_id = a.artist_id
+            GROUP BY a.name ORDER BY 2 DESC LIMIT 10;"""),
+    (20, """SELECT s.title, COUNT(*) FROM songplays as sp JOIN songs as s ON sp.song_id = s.song_id
+            JOIN time as t ON sp.start_time = t.start_time WHERE t.year = 2018 AND t.month = 11 GROUP BY s.title;"""),
+    (10, """SELECT u.level, t.hour, COUNT(*) FROM songplays as sp JOIN users as u ON sp.user_id = u.user_id
+            JOIN time as t ON sp.start_time = t.start_time GROUP BY u.level, t.hour;"""),
+    (10, """SELECT sp.user_id, COUNT(*) FROM songplays as sp WHERE sp.start_time >= '2018-11-01' GROUP BY sp.user_id;"""),
+    (5, """SELECT s.song_id, s.title, a.name, s.artist_id, s.year FROM songs as s JOIN artists as a ON s.artist_id = a.artist_id
+           WHERE s.year = 2000;"""),
+    (5, """SELECT u.gender, COUNT(*) FROM users as u GROUP BY 1;"""),
+]
+
+NODES = 4
+# a table copied to every node costs its bytes on every other node at each load, times this weight.
+# Only dimension tables up to ALL_MAX_ROWS are copied, the fact table grows with every load.
+ALL_LOAD_WEIGHT = 1.0
+ALL_MAX_ROWS = 5000000
+# a distribution key needs this many distinct values per slice to spread the rows evenly
+MIN_VALUES_PER_SLICE = 10
+SLICES_PER_NODE = 2
+
+TABLE_ALIAS = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+as)?\s+(\w+)', re.IGNORECASE)
+JOIN_CONDITION = re.compile(r'\bON\s+(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)', re.IGNORECASE)
+FILTER = re.compile(r'(\w+)\.(\w+)\s*(?:=|<|>|<=|>=|BETWEEN)\s*(?!\w+\.)', re.IGNORECASE)
+KEYWORDS = {'on', 'where', 'group', 'order', 'join', 'limit', 'inner', 'left'}
+
+
+def parse_query(query):
+    """
+    This function returns the joins, as (table, column, table, column) tuples, and the filtered (table, column) pairs of a query.
+    Only the simple form of the workload queries is understood: aliased tables and equality joins in ON clauses.
+    :param query: the SQL query
+    """
+    aliases = {}
+    for table, alias in TABLE_ALIAS.findall(query):
+        aliases[table] = table
+        if alias.lower() not in KEYWORDS:
+            aliases[alias] = table
+    joins = [(aliases[a], x, aliases[b], y) for a, x, b, y in JOIN_CONDITION.findall(query)]
+    where = re.split(r'\bWHERE\b', query, flags=re.IGNORECASE)
+    filters = [(aliases[a], column) for a, column in FILTER.findall(where[1])] if len(where) > 1 else []
+    return joins, filters
+
+
+def primary_key(create):
+    """
+    This function returns the primary key column of a CREATE TABLE statement.
+    :param create: the CREATE TABLE statement
+    """
+    match = re.search(r'PRIMARY KEY\s*\((\w+)\)', create, re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+def current_style(create):
+    """
+    This function returns the distribution of a CREATE TABLE statement, as ('KEY', column), ('ALL', None) or ('EVEN', None).
+    :param create: the CREATE TABLE statement
+    """
+    if re.search(r'DISTSTYLE\s+ALL', create, re.IGNORECASE):
+        return ('ALL', None)
+    match = re.search(r'^\s*(\w+)\s[^,\n]*\bdistkey\b', create, re.IGNORECASE | re.MULTILINE) or \
+        re.search(r'\bDISTKEY\s*\((\w+)\)', create, re.IGNORECASE)
+    return ('KEY', match.group(1)) if match else ('EVEN', None)
+
+
+def cardinalities(sizes, workload):
+    """
+    This function estimates the distinct values of the join columns: the rows of the table when the column is its primary key,
+    and the rows of the referenced table for a column joined to the primary key of another table.
+    The other filtered columns take their values from COLUMN_VALUES.
+    :param sizes: the rows and bytes per row of the tables
+    :param workload: the parsed queries, as (weight, joins, filters)
+    """
+    distinct = {}
+    for table, create in TABLE_CREATES.items():
+        distinct[(table, primary_key(create))] = sizes[table][0]
+    for _, joins, _ in workload:
+        for a, x, b, y in joins:
+            if (b, y) in distinct and primary_key(TABLE_CREATES[b]) == y:
+                distinct.setdefault((a, x), distinct[(b, y)])
+            if (a, x) in distinct and primary_key(TABLE_CREATES[a]) == x:
+                distinct.setdefault((b, y), distinct[(a, x)])
+    for column, values in COLUMN_VALUES.items():
+        distinct.setdefault(column, values)
+    return distinct
+
+
+def is_fact(create):
+    return re.search(r'\bREFERENCES\b', create, re.IGNORECASE) is not None
+
+
+def candidates(table, rows, workload, distinct, nodes):
+    """
+    This function returns the distributions worth trying for a table: KEY on each of its join columns with enough
+    distinct values to spread its rows over the slices, EVEN, and ALL for a dimension table small enough.
+    On equal cost the first one is kept.
+    :param table: the table name
+    :param rows: the rows of the table
+    :param workload: the parsed queries, as (weight, joins, filters)
+    :param distinct: the distinct values of the columns returned by cardinalities
+    :param nodes: the number of nodes of the cluster
+    """
+    columns = set()
+    for _, joins, _ in workload:
+        for a, x, b, y in joins:
+            if a == table:
+                columns.add(x)
+            if b == table:
+                columns.add(y)
+    keys = [('KEY', column) for column in sorted(columns)
+            if distinct.get((table, column), 0) >= MIN_VALUES_PER_SLICE * SLICES_PER_NODE * nodes]
+    styles = keys + [('EVEN', None)]
+    if not is_fact(TABLE_CREATES[table]) and rows <= ALL_MAX_ROWS:
+        styles.append(('ALL', None))
+    return styles
+
+
+def join_movement(a_bytes, a_style, a_column, b_bytes, b_style, b_column, nodes):
+    """
+    This function returns the bytes moved between the nodes to join two tables, as the Redshift planner would:
+    nothing when one of them is on every node or both are distributed on the join columns, the other table when one of
+    them is, and otherwise the cheaper of redistributing both tables and broadcasting the smaller one.
+    """
+    if a_style[0] == 'ALL' or b_style[0] == 'ALL':
+        return 0
+    a_collocated = a_style == ('KEY', a_column)
+    b_collocated = b_style == ('KEY', b_column)
+    if a_collocated and b_collocated:
+        return 0
+    if a_collocated:
+        return b_bytes
+    if b_collocated:
+        return a_bytes
+    return min(a_bytes + b_bytes, min(a_bytes, b_bytes) * nodes)
+
+
+def workload_cost(styles, sizes, workload, nodes):
+    """
+    This function returns the bytes moved by the joins of the workload, weighted by how often each query runs,
+    plus the bytes copied to the other nodes by the tables distributed ALL, and the bytes moved by each query.
+    Each join is modelled between the two base tables, ignoring the distribution of intermediate results.
+    :param styles: the distribution of every table
+    :param sizes: the rows and bytes per row of the tables
+    :param workload: the parsed queries, as (weight, joins, filters)
+    :param nodes: the number of nodes of the cluster
+    """
+    size = {table: rows * width for table, (rows, width) in sizes.items()}
+    per_query = []
+    for weight, joins, _ in workload:
+        per_query.append(sum(join_movement(size[a], styles[a], x, size[b], styles[b], y, nodes) for a, x, b, y in joins))
+    total = sum(weight * moved for (weight, _, _), moved in zip(workload, per_query))
+    total += sum(size[table] * (nodes - 1) * ALL_LOAD_WEIGHT for table, style in styles.items() if style[0] == 'ALL')
+    return total, per_query
+
+
+def recommend_distribution(sizes, workload, nodes):
+    """
+    This function tries every combination of the candidate distributions of the tables and returns the cheapest.
+    :param sizes: the rows and bytes per row of the tables
+    :param workload: the parsed queries, as (weight, joins, filters)
+    :param nodes: the number of nodes of the cluster
+    """
+    distinct = cardinalities(sizes, workload)
+    tables = sorted(TABLE_CREATES)
+    best = None
+    for combination in product(*[candidates(table, sizes[table][0], workload, distinct, nodes) for table in tables]):
+        styles = dict(zip(tables, combination))
+        cost, _ = workload_cost(styles, sizes, workload, nodes)
+        if best is None or cost < best[0]:
+            best = (cost, styles)
+    return best[1]
+
+
+def recommend_sort_keys(styles, workload, distinct):
+    """
+    This function picks the sort key of every table: the column its queries filter on most, each filter weighted by the
+    share of the rows it skips, 1 - 1 / distinct values, since sorted blocks let the filter skip the others.
+    On equal scores, e.g. when no filter skips any rows, its distribution key is preferred, then a column it is joined on,
+    so joins on it can be merge joins, then its primary key.
+    :param styles: the recommended distribution of every table
+    :param workload: the parsed queries, as (weight, joins, filters)
+    :param distinct: the distinct values of the columns returned by cardinalities
+    """
+    scores = {}
+    joined = set()
+    for weight, joins, filters in workload:
+        for table, column in filters:
+            skipped = 1 - 1 / max(1, distinct.get((table, column), DEFAULT_VALUES))
+            scores[(table, column)] = scores.get((table, column), 0) + weight * skipped
+        for a, x, b, y in joins:
+            joined.update([(a, x), (b, y)])
+    sort_keys = {}
+    for table, create in TABLE_CREATES.items():
+        dist_key = styles[table][1] if styles[table][0] == 'KEY' else None
+        columns = {column for t, column in list(scores) + list(joined) if t == table} | {primary_key(create)}
+        sort_keys[table] = min(columns, key=lambda column: (-round(scores.get((table, column), 0), 9), column != dist_key,
+                                                           (table, column) not in joined, column != primary_key(create),
+                                                           column))
+    return sort_keys
+
+
+def revised_create(create, style, sort_key):
+    """
+    This function rewrites the distribution and sort key clauses of a CREATE TABLE statement.
+    :param create: the CREATE TABLE statement
+    :param style: the distribution of the table
+    :param sort_key: the sort key column of the table
+    """
+    body = re.sub(r'\s+\b(?:distkey|sortkey)\b(?=\s*[,\n])', '', create.strip(), flags=re.IGNORECASE)
+    body = body[:body.rindex(')') + 1]
+    clauses = ['DISTSTYLE {}'.format(style[0])]
+    if style[0] == 'KEY':
+        clauses.append('DISTKEY({})'.format(style[1]))
+    clauses.append('SORTKEY({})'.format(sort_key))
+    return '{}\n{};'.format(body, '\n'.join(clauses))
+
+
+def describe(style):
+    return style[0] if style[0] != 'KEY' else 'KEY({})'.format(style[1])
+
+
+def read_sizes(dsn):
+    """
+    This function reads the rows and bytes per row of the tables from SVV_TABLE_INFO.
+    :param dsn: the connection string of the cluster
+    """
+    # psycopg2 is only needed to read the sizes from the cluster
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    cur.execute('SELECT "table", tbl_rows, size FROM svv_table_info WHERE "table" IN %s', (tuple(TABLE_CREATES),))
+    sizes = {table: (int(rows), max(1, int(blocks * 1024 * 1024 / max(rows, 1)))) for table, rows, blocks in cur.fetchall()}
+    conn.close()
+    return dict(TABLE_SIZES, **sizes)
+
+
+def main():
+    """
+    This function prints the recommended keys, the bytes moved by each query with the current and recommended keys,
+    and the revised CREATE TABLE statements.
+    """
+    parser = argparse.ArgumentParser(description="Recommends the distribution and sort keys of the star schema for a workload.")
+    parser.add_argument("--queries", help="JSON file of [weight, query] pairs used instead of the built-in workload")
+    parser.add_argument("--sizes", help="JSON file of {table: [rows, bytes per row]} used instead of the built-in sizes")
+    parser.add_argument("--scale", type=float, default=1, help="multiple of the table rows, e.g. 100 for 100x the Udacity data")
+    parser.add_argument("--nodes", type=int, default=NODES, help="number of nodes of the cluster")
+    parser.add_argument("--cluster", action="store_true", help="read the table sizes from SVV_TABLE_INFO of the cluster of dwh.cfg")
+    args = parser.parse_args()
+
+    queries = QUERIES
+    if args.queries:
+        with open(args.queries) as f:
+            queries = [tuple(pair) for pair in json.load(f)]
+    sizes = dict(TABLE_SIZES)
+    if args.sizes:
+        with open(args.sizes) as f:
+            sizes.update({table: tuple(size) for table, size in json.load(f).items()})
+    if args.cluster:
+        sizes = read_sizes(dsn())
+    sizes = {table: (int(rows * args.scale), width) for table, (rows, width) in sizes.items()}
+
+    workload = [(weight,) + parse_query(query) for weight, query in queries]
+    current = {table: current_style(create) for table, create in TABLE_CREATES.items()}
+    styles = recommend_distribution(sizes, workload, args.nodes)
+    sort_keys = recommend_sort_keys(styles, workload, cardinalities(sizes, workload))
+
+    current_total, current_moved = workload_cost(current, sizes, workload, args.nodes)
+    total, moved = workload_cost(styles, sizes, workload, args.nodes)
+
+    print("{:<12}{:>12}{:>22}{:>22}{:>14}".format("table", "rows", "current", "recommended", "sort key"))
+    for table in sorted(TABLE_CREATES):
+        print("{:<12}{:>12}{:>22}{:>22}{:>14}".format(table, sizes[table][0], describe(current[table]),
+                                                       describe(styles[table]), sort_keys[table]))
+    for table in sorted(TABLE_CREATES):
+        if current[table][0] == 'ALL' and sizes[table][0] > ALL_MAX_ROWS:
+            print("WARNING {} is distributed ALL with more than {} rows".format(table, ALL_MAX_ROWS))
+    print()
+    print("{:<8}{:>8}{:>22}{:>26}".format("query", "weight", "current MB moved", "recommended MB moved"))
+    for i, ((weight, _, _), before, after) in enumerate(zip(workload, current_moved, moved)):
+        print("{:<8}{:>8}{:>22.2f}{:>26.2f}".format(i + 1, weight, before / 1e6, after / 1e6))
+    print("{:<16}{:>22.2f}{:>26.2f}  (weighted, with the copies of the ALL tables)".format("total", current_total / 1e6, total / 1e6))
+    print()
+    for table in ['time', 'users', 'songs', 'artists', 'songplays']:
+        print(revised_create(TABLE_CREATES[table], styles[table], sort_keys[table]))
+        print()
+
+
+if __name__ == "__main__":
+    main()
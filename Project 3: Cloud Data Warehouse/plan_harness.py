@@ -0,0 +1,184 @@
+import time
+import argparse
+import psycopg2
+from sql_queries import (create_table_queries, insert_table_queries, loaded_files_table_create, user_table_create, time_table_create,
+                         songplay_table_create, user_table_insert, song_table_insert, artist_table_insert,
+                         staging_events_truncate, staging_events_copy, staging_songs_truncate, staging_songs_copy)
+from db import dsn
+
+# Loads the same data with the former and the current warehouse layout, each in its own schema,
+# and compares the query plan and the time of every statement.
+#
+# The former layout: ts staged as VARCHAR and converted in the time and songplays inserts,
+# staging and dimension tables without sort or dist keys, time rows built from all the events,
+# and the songplays matched by joining staging_events to staging_songs on the title and artist name.
+# The time and songplays inserts are the original statements of sql_queries.py.
+
+legacy_staging_events_table_create = (""" CREATE TABLE IF NOT EXISTS staging_events (
+        artist VARCHAR,
+        auth VARCHAR,
+        firstName VARCHAR,
+        gender CHAR(1),
+        itemInSession INT,
+        lastName VARCHAR,
+        length FLOAT,
+        level VARCHAR,
+        location VARCHAR,
+        method VARCHAR,
+        page VARCHAR,
+        registration VARCHAR,
+        sessionId INT,
+        song VARCHAR,
+        status INT,
+        ts VARCHAR(50),
+        userAgent VARCHAR,
+        userId INT
+); 
+""")
+legacy_staging_songs_table_create = (""" CREATE TABLE IF NOT EXISTS staging_songs (
+        num_songs INT,
+        artist_id VARCHAR,
+        artist_latitude FLOAT,
+        artist_longitude FLOAT,
+        artist_location VARCHAR,
+        artist_name VARCHAR,
+        song_id VARCHAR,
+        title VARCHAR,
+        duration FLOAT,
+        year INT
+);
+""")
+legacy_song_table_create = (""" CREATE TABLE IF NOT EXISTS songs (
+        song_id VARCHAR sortkey,
+        title VARCHAR        NOT NULL,
+        artist_id VARCHAR    NOT NULL,
+        year INT,
+        duration FLOAT,
+        PRIMARY KEY (song_id)
+);
+""")
+legacy_artist_table_create = (""" CREATE TABLE IF NOT EXISTS artists (
+        artist_id VARCHAR    sortkey,
+        name VARCHAR         NOT NULL,
+        location VARCHAR,
+        latitude FLOAT,
+        longitude FLOAT,
+        PRIMARY KEY(artist_id)
+);
+""")
+legacy_songplay_table_insert = (""" INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+    SELECT DISTINCT     TIMESTAMP 'epoch' + ts/1000 * INTERVAL '1 second' AS start_time, 
+                        se.userId, 
+                        se.level,
+                        ss.song_id,
+                        ss.artist_id, 
+                        se.sessionId, 
+                        se.location, 
+                        se.userAgent
+    FROM staging_events as se
+    INNER JOIN staging_songs as ss
+    ON se.song = ss.title and se.artist = ss.artist_name
+    WHERE se.page = 'NextSong';
+    
+""")
+legacy_time_table_insert = (""" INSERT INTO time (start_time, hour, day, week, month, year, weekday)
+    SELECT DISTINCT     ts as start_time,
+                        EXTRACT(hour from ts) as hour,
+                        EXTRACT(day from ts) as day,
+                        EXTRACT(week from ts) as week,
+                        EXTRACT(month from ts) as month,
+                        EXTRACT(year from ts) as year,
+                        EXTRACT(weekday from ts) as weekday
+    FROM ( 
+            SELECT DISTINCT  TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second' as ts
+        FROM staging_events);
+    
+""")
+
+
+legacy_create_table_queries = [legacy_staging_events_table_create, legacy_staging_songs_table_create, user_table_create,
+                               legacy_song_table_create, legacy_artist_table_create, time_table_create, songplay_table_create]
+legacy_insert_table_queries = [user_table_insert, song_table_insert, artist_table_insert, legacy_time_table_insert,
+                               legacy_songplay_table_insert]
+
+STATEMENTS = ["staging_events", "staging_songs", "users", "songs", "artists", "time", "songplays"]
+
+# plan steps of Redshift that move rows between the nodes
+REDISTRIBUTION = ("DS_DIST_INNER", "DS_DIST_OUTER", "DS_DIST_BOTH", "DS_DIST_ALL_INNER", "DS_BCAST_INNER")
+
+
+def explain(cur, query):
+    """
+    This function returns the plan of the last statement of a query.
+    :param cur: the database cursor
+    :param query: the query, e.g. the delete then insert of the users
+    """
+    statement = [part for part in query.split(";") if part.strip()][-1]
+    cur.execute("EXPLAIN " + statement)
+    return "\n".join(row[0] for row in cur.fetchall())
+
+
+def run_layout(cur, conn, schema, create_queries, insert_queries):
+    """
+    This function creates the tables of a layout in their own schema, loads them and returns, for every statement,
+    the seconds it took and the redistribution steps of its plan.
+    :param cur: the database cursor
+    :param conn: the database connection
+    :param schema: the schema the tables are created in
+    :param create_queries: the create table queries of the layout
+    :param insert_queries: the insert queries of the layout, in the order of STATEMENTS after the two COPYs
+    """
+    cur.execute("DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}; SET search_path TO {0};".format(schema))
+    for query in create_queries:
+        cur.execute(query)
+    conn.commit()
+
+    results = {}
+    copies = [staging_events_truncate + staging_events_copy, staging_songs_truncate + staging_songs_copy]
+    for name, query in zip(STATEMENTS, copies + list(insert_queries)):
+        plan = "" if name in ("staging_events", "staging_songs") else explain(cur, query)
+        start = time.perf_counter()
+        cur.execute(query)
+        conn.commit()
+        results[name] = (time.perf_counter() - start, sum(plan.count(step) for step in REDISTRIBUTION))
+    return results
+
+
+def print_results(legacy, current):
+    """
+    This function prints the seconds and redistribution steps of every statement with both layouts.
+    :param legacy: the results of run_layout with the former layout
+    :param current: the results of run_layout with the current layout
+    """
+    print("{:<16}{:>14}{:>14}{:>18}{:>18}".format("", "former (s)", "current (s)", "former redist.", "current redist."))
+    for name in STATEMENTS:
+        print("{:<16}{:>14.2f}{:>14.2f}{:>18}{:>18}".format(name, legacy[name][0], current[name][0], legacy[name][1], current[name][1]))
+    print("{:<16}{:>14.2f}{:>14.2f}".format("total", sum(r[0] for r in legacy.values()), sum(r[0] for r in current.values())))
+
+
+def main():
+    """
+    This function loads the data of dwh.cfg, e.g. a dataset generated by generate_data.py of Project 4 (DATA in its [S3] section),
+    with both layouts and prints the comparison.
+    """
+    parser = argparse.ArgumentParser(description="Compares the former and current warehouse layouts on the data of dwh.cfg.")
+    parser.add_argument("--dsn", help="connection string used instead of the [CLUSTER] settings")
+    parser.add_argument("--keep", action="store_true", help="keep the harness schemas instead of dropping them")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn or dsn())
+    cur = conn.cursor()
+
+    legacy = run_layout(cur, conn, "harness_former", legacy_create_table_queries, legacy_insert_table_queries)
+    current = run_layout(cur, conn, "harness_current",
+                         [query for query in create_table_queries if query != loaded_files_table_create], insert_table_queries)
+    print_results(legacy, current)
+
+    if not args.keep:
+        cur.execute("DROP SCHEMA harness_former CASCADE; DROP SCHEMA harness_current CASCADE;")
+        conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
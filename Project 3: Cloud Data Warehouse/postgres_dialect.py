@@ -0,0 +1,117 @@
+import io
+import os
+import re
+import csv
+import json
+import glob
+import functools
+from datetime import datetime, timedelta
+from sql_queries import etl_steps, create_table_queries, drop_table_queries
+from scheduler import Step
+
+# Translation of the Redshift statements of sql_queries.py for a local Postgres standing in for the cluster,
+# e.g. the sparkifydb database of Project 1, so the ETL steps can be run and tested without Redshift:
+#
+#   DISTKEY, SORTKEY and DISTSTYLE      dropped, Postgres has no distribution or sort keys
+#   REFERENCES                          dropped, Redshift does not enforce them, and the users step replaces
+#                                       users the songplays reference
+#   INT IDENTITY(0,1)                   an identity column starting at 0
+#   GETDATE()                           LOCALTIMESTAMP
+#   EXTRACT(weekday ...)                EXTRACT(dow ...), the same day numbers
+#
+# The COPYs read S3 with an IAM role, which Postgres cannot do: the staging steps copy the song_data and log_data
+# of a local directory instead, e.g. the data of Project 1 or the output of generate_data.py of Project 4,
+# converting the values as the COPYs do.
+
+TRANSLATIONS = [
+    (r'\)\s*DISTKEY\s*\([^)]*\)', ')'),
+    (r'\)\s*(COMPOUND\s+|INTERLEAVED\s+)?SORTKEY\s*\([^)]*\)', ')'),
+    (r'\)\s*DISTSTYLE\s+(ALL|EVEN|KEY|AUTO)', ')'),
+    (r'\s+(DISTKEY|SORTKEY)\b', ''),
+    (r'\s+REFERENCES\s+\w+\s*\([^)]*\)', ''),
+    (r'\bINT\s+IDENTITY\s*\(\s*0\s*,\s*1\s*\)', 'INT GENERATED BY DEFAULT AS IDENTITY (START WITH 0 MINVALUE 0)'),
+    (r'\bGETDATE\(\)', 'LOCALTIMESTAMP'),
+    (r'\bEXTRACT\(\s*weekday\s+from\b', 'EXTRACT(dow from'),
+]
+
+# columns of the staging tables, in the order of their CREATE TABLE, and the directory of the files copied into them
+STAGING_COLUMNS = {
+    'staging_events': ['artist', 'auth', 'firstName', 'gender', 'itemInSession', 'lastName', 'length', 'level', 'location',
+                       'method', 'page', 'registration', 'sessionId', 'song', 'status', 'ts', 'userAgent', 'userId'],
+    'staging_songs': ['num_songs', 'artist_id', 'artist_latitude', 'artist_longitude', 'artist_location', 'artist_name',
+                      'song_id', 'title', 'duration', 'year'],
+}
+STAGING_DATA = {'staging_events': 'log_data', 'staging_songs': 'song_data'}
+
+# columns holding numbers, whose empty strings are loaded as NULL like the COPYs do
+NUMERIC_COLUMNS = {'itemInSession', 'length', 'sessionId', 'status', 'userId', 'num_songs', 'artist_latitude',
+                   'artist_longitude', 'duration', 'year'}
+
+
+def to_postgres(query):
+    """
+    This function returns a Redshift statement of sql_queries.py translated for Postgres.
+    :param query: the Redshift statement
+    """
+    for pattern, replacement in TRANSLATIONS:
+        query = re.sub(pattern, replacement, query, flags=re.IGNORECASE)
+    return query
+
+
+def staging_value(table, column, value):
+    """
+    This function converts a value of a JSON record as the COPY of its staging table does: ts from epoch milliseconds
+    to a timestamp (timeformat 'epochmillisecs'), empty numbers to NULL, and empty song strings to NULL (EMPTYASNULL).
+    :param table: the staging table
+    :param column: the column of the value
+    :param value: the value of the JSON record
+    """
+    if value == '' and (column in NUMERIC_COLUMNS or table == 'staging_songs'):
+        return None
+    if column == 'ts' and value is not None:
+        return str(datetime(1970, 1, 1) + timedelta(milliseconds=int(value)))
+    return value
+
+
+def copy_local(cur, table, directory):
+    """
+    This function replaces the rows of a staging table with the JSON records of the files under a local directory,
+    one record per line, with COPY ... FROM STDIN.
+    :param cur: the database cursor
+    :param table: the staging table
+    :param directory: the local directory, e.g. data/log_data
+    """
+    columns = STAGING_COLUMNS[table]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for filepath in sorted(glob.glob(os.path.join(directory, '**', '*.json'), recursive=True)):
+        with open(filepath) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    values = [staging_value(table, column, record.get(column)) for column in columns]
+                    writer.writerow(['\\N' if value is None else value for value in values])
+    buffer.seek(0)
+    cur.execute("TRUNCATE {};".format(table))
+    cur.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(table, ', '.join(columns)), buffer)
+
+
+def local_etl_steps(input_data):
+    """
+    This function returns the steps of etl_steps for Postgres: the staging steps copy the files of a local directory
+    and the other statements are translated.
+    :param input_data: the local directory holding song_data and log_data
+    """
+    steps = []
+    for name, query, depends in etl_steps:
+        if name in STAGING_COLUMNS:
+            query = functools.partial(copy_local, table=name, directory=os.path.join(input_data, STAGING_DATA[name]))
+        else:
+            query = to_postgres(query)
+        steps.append(Step(name, query, depends))
+    return steps
+
+
+# the statements of create_tables.py translated for Postgres
+postgres_create_table_queries = [to_postgres(query) for query in create_table_queries]
+postgres_drop_table_queries = [to_postgres(query) for query in drop_table_queries]
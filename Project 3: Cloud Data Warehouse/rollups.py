@@ -0,0 +1,455 @@
+import time
+import argparse
+from itertools import combinations
+from collections import namedtuple
+import psycopg2
+from psycopg2.extras import execute_values
+from db import dsn
+
+# Pre-aggregated tables of the songplays, built with GROUPING SETS, CUBE and ROLLUP, refreshed one time partition
+# at a time after each load, and a router sending each aggregate query to the smallest table that can answer it.
+# The statements run on Redshift and on Postgres, e.g. on the sparkifydb database of Project 1.
+
+# An aggregate table: the time partition it is refreshed by (day or month), which is in every grouping set,
+# the dimensions grouped on, and how they are grouped: 'cube', 'rollup' or a list of grouping sets.
+Rollup = namedtuple('Rollup', ['name', 'partition', 'dimensions', 'grouping'])
+
+# An aggregate query: the dimensions it groups by, and the values or (low, high) ranges of its filters
+RollupQuery = namedtuple('RollupQuery', ['dimensions', 'filters'])
+
+ROLLUPS = [
+    Rollup('plays_by_day_level_location', 'day', ['level', 'location'],
+           [('level', 'location'), ('level',), ('location',), ()]),
+    Rollup('plays_by_month_level_gender', 'month', ['level', 'gender'], 'cube'),
+    Rollup('plays_by_day_hour_level', 'day', ['hour', 'level'], 'rollup'),
+]
+
+# Column types of the dimensions
+DIMENSIONS = {
+    'day': 'DATE',
+    'month': 'DATE',
+    'hour': 'INT',
+    'level': 'VARCHAR',
+    'location': 'VARCHAR',
+    'gender': 'CHAR(1)',
+}
+
+# Dimensions that can be computed from a finer time partition
+DERIVED = {
+    'month': ('day', "CAST(DATE_TRUNC('month', day) AS DATE)"),
+}
+
+# The songplays joined with the dimension tables, with one column per dimension and the song duration
+fact_select = ("""SELECT CAST(sp.start_time AS DATE) AS day,
+               CAST(DATE_TRUNC('month', sp.start_time) AS DATE) AS month,
+               t.hour AS hour,
+               sp.level AS level,
+               sp.location AS location,
+               u.gender AS gender,
+               s.duration AS duration
+        FROM songplays sp
+        JOIN time t ON t.start_time = sp.start_time
+        LEFT JOIN users u ON u.user_id = sp.user_id
+        LEFT JOIN songs s ON s.song_id = sp.song_id""")
+
+# Columns of fact_select read by the aggregates, whose content is checksummed to find the partitions changed by a load
+FACT_COLUMNS = ['day', 'hour', 'level', 'location', 'gender', 'duration']
+
+# Control table of the partitions of each aggregate: the songplays of the partition and the checksum of their columns
+# when it was refreshed, which tell whether a load changed it, and the rows of the aggregate in the partition,
+# used by the router.
+rollup_partitions_create = (""" CREATE TABLE IF NOT EXISTS rollup_partitions (
+        rollup_name VARCHAR(64)  NOT NULL,
+        partition_start DATE     NOT NULL,
+        plays BIGINT             NOT NULL,
+        checksum BIGINT,
+        agg_rows BIGINT          NOT NULL,
+        refreshed_at TIMESTAMP   NOT NULL,
+        PRIMARY KEY(rollup_name, partition_start)
+);
+""")
+rollup_partitions_drop = "DROP TABLE IF EXISTS rollup_partitions;"
+rollup_partitions_select = "SELECT partition_start, plays, checksum FROM rollup_partitions WHERE rollup_name = %s;"
+rollup_partitions_delete = "DELETE FROM rollup_partitions WHERE rollup_name = %s AND partition_start IN %s;"
+rollup_partitions_insert = ("INSERT INTO rollup_partitions (rollup_name, partition_start, plays, checksum, agg_rows, refreshed_at) "
+                            "VALUES %s")
+
+# the checksum column is added to a control table created before it, its partitions are then all refreshed once
+rollup_checksum_exists = ("SELECT COUNT(*) FROM information_schema.columns "
+                          "WHERE table_schema = CURRENT_SCHEMA() AND table_name = 'rollup_partitions' AND column_name = 'checksum';")
+rollup_checksum_add = "ALTER TABLE rollup_partitions ADD COLUMN checksum BIGINT;"
+rollup_rows_select = "SELECT rollup_name, SUM(agg_rows) FROM rollup_partitions GROUP BY rollup_name;"
+
+
+
+def day_checksums_select():
+    """
+    This function returns the statement counting the songplays of each day and summing a checksum of their FACT_COLUMNS,
+    compared with the control table to find the partitions changed by a load. The checksum of a row is the first
+    28 bits of the MD5 of its columns, read one hex digit at a time with STRPOS so it runs on Redshift and Postgres.
+    A load changing a row, or the level or gender it is joined with, changes the checksum of its day
+    even when the number of songplays stays the same.
+    """
+    row_text = " || '|' || ".join("COALESCE(CAST({} AS VARCHAR), '')".format(column) for column in FACT_COLUMNS)
+    digits = ' + '.join("(STRPOS('0123456789abcdef', SUBSTRING(digest, {}, 1)) - 1) * {}".format(i + 1, 16 ** (6 - i))
+                        for i in range(7))
+    return ("SELECT day, COUNT(*), SUM(CAST({digits} AS BIGINT))\n"
+            "FROM (SELECT day, MD5({row_text}) AS digest FROM ({fact}) f) d\n"
+            "GROUP BY 1;").format(digits=digits, row_text=row_text, fact=fact_select)
+
+
+def table_name(rollup):
+    return 'agg_' + rollup.name
+
+
+def grouping_sets(rollup):
+    """
+    This function returns the grouping sets of the dimensions of an aggregate, without its partition column.
+    :param rollup: the aggregate
+    """
+    dimensions = rollup.dimensions
+    if rollup.grouping == 'cube':
+        return [subset for size in range(len(dimensions), -1, -1) for subset in combinations(dimensions, size)]
+    if rollup.grouping == 'rollup':
+        return [tuple(dimensions[:size]) for size in range(len(dimensions), -1, -1)]
+    return [tuple(grouping_set) for grouping_set in rollup.grouping]
+
+
+def grouping_id(rollup, grouping_set):
+    """
+    This function returns the value of GROUPING() over the dimensions of an aggregate for the rows of a grouping set:
+    one bit per dimension, the first one the most significant, set when the dimension is aggregated away.
+    :param rollup: the aggregate
+    :param grouping_set: the dimensions grouped on
+    """
+    count = len(rollup.dimensions)
+    return sum(1 << (count - 1 - i) for i, dimension in enumerate(rollup.dimensions) if dimension not in grouping_set)
+
+
+def group_by_clause(rollup):
+    """
+    This function returns the GROUP BY clause computing all the grouping sets of an aggregate in one pass.
+    :param rollup: the aggregate
+    """
+    dimensions = ', '.join(rollup.dimensions)
+    if rollup.grouping == 'cube':
+        grouping = 'CUBE({})'.format(dimensions)
+    elif rollup.grouping == 'rollup':
+        grouping = 'ROLLUP({})'.format(dimensions)
+    else:
+        grouping = 'GROUPING SETS ({})'.format(', '.join('({})'.format(', '.join(grouping_set))
+                                                           for grouping_set in grouping_sets(rollup)))
+    return 'GROUP BY {}, {}'.format(rollup.partition, grouping)
+
+
+def rollup_create(rollup):
+    """
+    This function returns the CREATE TABLE statement of an aggregate.
+    :param rollup: the aggregate
+    """
+    columns = ['{} {} NOT NULL'.format(rollup.partition, DIMENSIONS[rollup.partition])]
+    columns += ['{} {}'.format(dimension, DIMENSIONS[dimension]) for dimension in rollup.dimensions]
+    columns += ['grouping_id INT NOT NULL', 'plays BIGINT NOT NULL', 'seconds FLOAT']
+    return "CREATE TABLE IF NOT EXISTS {} (\n        {}\n);".format(table_name(rollup), ',\n        '.join(columns))
+
+
+def rollup_insert(rollup):
+    """
+    This function returns the statement aggregating the songplays of some partitions into an aggregate,
+    with the partitions as its parameter.
+    :param rollup: the aggregate
+    """
+    dimensions = ', '.join(rollup.dimensions)
+    return ("INSERT INTO {table} ({partition}, {dimensions}, grouping_id, plays, seconds)\n"
+            "SELECT {partition}, {dimensions}, GROUPING({dimensions}), COUNT(*), SUM(duration)\n"
+            "FROM ({fact}) f\n"
+            "WHERE {partition} IN %s\n"
+            "{group_by};").format(table=table_name(rollup), partition=rollup.partition, dimensions=dimensions,
+                                  fact=fact_select, group_by=group_by_clause(rollup))
+
+
+def create_rollups(cur, conn, rollups=ROLLUPS):
+    """
+    This function creates the aggregate tables and the control table if they do not exist,
+    and adds the checksum column to a control table created without it.
+    :param cur: the database cursor
+    :param conn: the database connection
+    :param rollups: the aggregates
+    """
+    cur.execute(rollup_partitions_create)
+    cur.execute(rollup_checksum_exists)
+    if not cur.fetchone()[0]:
+        cur.execute(rollup_checksum_add)
+    for rollup in rollups:
+        cur.execute(rollup_create(rollup))
+    conn.commit()
+
+
+def drop_rollups(cur, conn, rollups=ROLLUPS):
+    """
+    This function drops the aggregate tables and the control table.
+    :param cur: the database cursor
+    :param conn: the database connection
+    :param rollups: the aggregates
+    """
+    for rollup in rollups:
+        cur.execute("DROP TABLE IF EXISTS {};".format(table_name(rollup)))
+    cur.execute(rollup_partitions_drop)
+    conn.commit()
+
+
+def partition_plays(day_plays, partition):
+    """
+    This function returns the songplays and the checksum of each partition of a time partitioning,
+    from those of each day. The checksum of a month is the sum of the checksums of its days.
+    :param day_plays: dict of day to (songplays, checksum)
+    :param partition: 'day' or 'month'
+    """
+    if partition == 'day':
+        return dict(day_plays)
+    plays = {}
+    for day, (count, checksum) in day_plays.items():
+        month = day.replace(day=1)
+        month_count, month_checksum = plays.get(month, (0, 0))
+        plays[month] = (month_count + count, month_checksum + checksum)
+    return plays
+
+
+def stale_partitions(cur, rollup, plays):
+    """
+    This function returns the partitions of an aggregate whose songplays or checksum changed since it was refreshed,
+    including the new partitions and the ones that no longer have songplays.
+    :param cur: the database cursor
+    :param rollup: the aggregate
+    :param plays: dict of partition to (songplays, checksum), returned by partition_plays
+    """
+    cur.execute(rollup_partitions_select, (rollup.name,))
+    refreshed = {partition: (count, checksum) for partition, count, checksum in cur.fetchall()}
+    return sorted(partition for partition in set(plays) | set(refreshed) if plays.get(partition) != refreshed.get(partition))
+
+
+def refresh_partitions(cur, rollup, partitions, plays):
+    """
+    This function replaces the rows of some partitions of an aggregate and records them in the control table.
+    :param cur: the database cursor
+    :param rollup: the aggregate
+    :param partitions: the partitions to refresh
+    :param plays: dict of partition to (songplays, checksum), returned by partition_plays
+    """
+    partitions = tuple(partitions)
+    cur.execute("DELETE FROM {} WHERE {} IN %s;".format(table_name(rollup), rollup.partition), (partitions,))
+    cur.execute(rollup_insert(rollup), (partitions,))
+    cur.execute("SELECT {0}, COUNT(*) FROM {1} WHERE {0} IN %s GROUP BY 1;".format(rollup.partition, table_name(rollup)),
+                (partitions,))
+    rows = dict(cur.fetchall())
+    cur.execute(rollup_partitions_delete, (rollup.name, partitions))
+    refreshed = [(rollup.name, partition) + tuple(plays[partition]) + (rows.get(partition, 0), time.strftime('%Y-%m-%d %H:%M:%S'))
+                 for partition in partitions if partition in plays]
+    if refreshed:
+        execute_values(cur, rollup_partitions_insert, refreshed)
+
+
+def refresh_rollups(cur, conn, rollups=ROLLUPS, full=False):
+    """
+    This function refreshes the partitions of the aggregates changed by the loads since the last refresh,
+    all in a single transaction, and returns the number of partitions refreshed for each aggregate.
+    :param cur: the database cursor
+    :param conn: the database connection
+    :param rollups: the aggregates
+    :param full: whether to refresh every partition
+    """
+    create_rollups(cur, conn, rollups)
+    cur.execute(day_checksums_select())
+    day_plays = {day: (count, int(checksum)) for day, count, checksum in cur.fetchall()}
+
+    refreshed = {}
+    for rollup in rollups:
+        plays = partition_plays(day_plays, rollup.partition)
+        partitions = sorted(plays) if full else stale_partitions(cur, rollup, plays)
+        if full:
+            cur.execute("DELETE FROM {};".format(table_name(rollup)))
+            cur.execute("DELETE FROM rollup_partitions WHERE rollup_name = %s;", (rollup.name,))
+        if partitions:
+            refresh_partitions(cur, rollup, partitions, plays)
+        refreshed[rollup.name] = len(partitions)
+    conn.commit()
+    return refreshed
+
+
+def column_expression(available, dimension):
+    """
+    This function returns the expression of a dimension over the columns of a grouping set, or None when it cannot be computed.
+    :param available: the columns of the grouping set
+    :param dimension: the dimension
+    """
+    if dimension in available:
+        return dimension
+    if dimension in DERIVED and DERIVED[dimension][0] in available:
+        return DERIVED[dimension][1]
+    return None
+
+
+def filter_clause(expressions, filters):
+    """
+    This function returns the conditions of the filters of a query and their parameters.
+    :param expressions: dict of dimension to its expression
+    :param filters: dict of dimension to a value or to a (low, high) range
+    """
+    conditions, params = [], []
+    for dimension, value in sorted(filters.items()):
+        if isinstance(value, tuple):
+            conditions.append('{} BETWEEN %s AND %s'.format(expressions[dimension]))
+            params.extend(value)
+        else:
+            conditions.append('{} = %s'.format(expressions[dimension]))
+            params.append(value)
+    return conditions, params
+
+
+def aggregate_query(source, expressions, query, conditions, measures):
+    """
+    This function returns the SELECT of an aggregate query over a table.
+    :param source: the table or subquery
+    :param expressions: dict of dimension to its expression
+    :param query: the RollupQuery
+    :param conditions: the WHERE conditions
+    :param measures: the expressions of the plays and seconds
+    """
+    columns = ['{} AS {}'.format(expressions[dimension], dimension) for dimension in query.dimensions]
+    sql = "SELECT {}\nFROM {}".format(', '.join(columns + measures), source)
+    if conditions:
+        sql += "\nWHERE " + " AND ".join(conditions)
+    if query.dimensions:
+        positions = ', '.join(str(i + 1) for i in range(len(query.dimensions)))
+        sql += "\nGROUP BY {0}\nORDER BY {0}".format(positions)
+    return sql + ";"
+
+
+def check_query(query):
+    """
+    This function checks that a query only uses known dimensions.
+    :param query: the RollupQuery
+    """
+    unknown = [dimension for dimension in list(query.dimensions) + list(query.filters) if dimension not in DIMENSIONS]
+    if unknown:
+        raise ValueError('unknown dimensions: {}'.format(', '.join(unknown)))
+
+
+def route(query, rollup_rows, rollups=ROLLUPS):
+    """
+    This function returns the name of the table answering a query, the SQL statement and its parameters.
+    The query is sent to the aggregate with the fewest rows having a grouping set with all its dimensions,
+    reading only the rows of that grouping set, and to the songplays when no aggregate can answer it.
+    :param query: the RollupQuery
+    :param rollup_rows: dict of aggregate name to its rows, from the control table
+    :param rollups: the aggregates
+    """
+    check_query(query)
+    needed = set(query.dimensions) | set(query.filters)
+    candidates = []
+    for rollup in rollups:
+        if not rollup_rows.get(rollup.name):
+            continue
+        for grouping_set in grouping_sets(rollup):
+            available = (rollup.partition,) + grouping_set
+            expressions = {dimension: column_expression(available, dimension) for dimension in needed}
+            if all(expressions.values()):
+                candidates.append((rollup_rows[rollup.name], len(grouping_set), rollup.name, rollup, grouping_set, expressions))
+
+    if not candidates:
+        conditions, params = filter_clause({dimension: dimension for dimension in needed}, query.filters)
+        sql = aggregate_query("({}) f".format(fact_select), {dimension: dimension for dimension in needed}, query,
+                              conditions, ["COUNT(*) AS plays", "SUM(duration) AS seconds"])
+        return 'songplays', sql, params
+
+    _, _, _, rollup, grouping_set, expressions = min(candidates, key=lambda candidate: candidate[:3])
+    conditions, params = filter_clause(expressions, query.filters)
+    conditions.insert(0, 'grouping_id = {}'.format(grouping_id(rollup, grouping_set)))
+    sql = aggregate_query(table_name(rollup), expressions, query, conditions, ["SUM(plays) AS plays", "SUM(seconds) AS seconds"])
+    return table_name(rollup), sql, params
+
+
+def read_rollup_rows(cur):
+    """
+    This function returns the rows of each aggregate recorded in the control table, or no rows if it does not exist.
+    :param cur: the database cursor
+    """
+    try:
+        cur.execute(rollup_rows_select)
+    except psycopg2.ProgrammingError:
+        cur.connection.rollback()
+        return {}
+    return {name: int(rows) for name, rows in cur.fetchall()}
+
+
+def run_query(cur, query, rollups=ROLLUPS):
+    """
+    This function runs a query on the table chosen by the router and returns the table name and the rows.
+    :param cur: the database cursor
+    :param query: the RollupQuery
+    :param rollups: the aggregates
+    """
+    source, sql, params = route(query, read_rollup_rows(cur), rollups)
+    cur.execute(sql, params)
+    return source, cur.fetchall()
+
+
+def parse_filter(text):
+    """
+    This function parses a --where filter, dimension=value or dimension=low:high.
+    :param text: the filter
+    """
+    dimension, _, value = text.partition('=')
+    low, separator, high = value.partition(':')
+    return dimension.strip(), (low, high) if separator else value
+
+
+def main():
+    """
+    This function creates, refreshes or drops the aggregates, or runs a query on the table chosen by the router.
+    With --check the query also runs on the songplays, and the rows and times of both are compared.
+    """
+    parser = argparse.ArgumentParser(description="Pre-aggregated songplays tables and the router of the aggregate queries.")
+    parser.add_argument("command", choices=["create", "refresh", "query", "drop"])
+    parser.add_argument("--dsn", help="connection string used instead of the [CLUSTER] settings, e.g. of a local Postgres")
+    parser.add_argument("--full", action="store_true", help="refresh every partition instead of the ones changed since the last refresh")
+    parser.add_argument("--by", default="", help="comma separated dimensions of the query, e.g. month,level")
+    parser.add_argument("--where", action="append", default=[], help="filter of the query, e.g. level=paid or day=2018-11-01:2018-11-07")
+    parser.add_argument("--check", action="store_true", help="also run the query on the songplays and compare the results")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn or dsn())
+    cur = conn.cursor()
+
+    if args.command == "create":
+        create_rollups(cur, conn)
+    elif args.command == "drop":
+        drop_rollups(cur, conn)
+    elif args.command == "refresh":
+        start = time.perf_counter()
+        for name, partitions in refresh_rollups(cur, conn, full=args.full).items():
+            print("{:<32} {:>4} partitions refreshed".format(name, partitions))
+        print("refreshed in {:.2f}s".format(time.perf_counter() - start))
+    else:
+        query = RollupQuery([dimension for dimension in args.by.split(',') if dimension],
+                            dict(parse_filter(text) for text in args.where))
+        start = time.perf_counter()
+        source, rows = run_query(cur, query)
+        elapsed = time.perf_counter() - start
+        for row in rows:
+            print(*row, sep='\t')
+        print("{} rows from {} in {:.3f}s".format(len(rows), source, elapsed))
+        if args.check:
+            start = time.perf_counter()
+            _, sql, params = route(query, {})
+            cur.execute(sql, params)
+            expected = cur.fetchall()
+            elapsed = time.perf_counter() - start
+            same = [row[:-1] + (round(row[-1] or 0, 3),) for row in rows] == \
+                   [row[:-1] + (round(row[-1] or 0, 3),) for row in expected]
+            print("{} rows from songplays in {:.3f}s, {}".format(len(expected), elapsed, "same results" if same else "DIFFERENT results"))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# A statement of the ETL, or a function running statements on the cursor it is given,
+# with the names of the steps that have to be committed before it runs
+Step = namedtuple('Step', ['name', 'query', 'depends'])
+
+# Timing of a step: seconds from the start of the run until it started, and seconds it took
+StepTiming = namedtuple('StepTiming', ['name', 'start', 'elapsed'])
+
+
+def check_steps(steps):
+    """
+    This function checks that every dependency names a step and that the dependencies have no cycle.
+    :param steps: the steps of the ETL
+    """
+    names = {step.name for step in steps}
+    for step in steps:
+        unknown = [name for name in step.depends if name not in names]
+        if unknown:
+            raise ValueError('step {} depends on unknown steps: {}'.format(step.name, ', '.join(unknown)))
+
+    done = set()
+    remaining = list(steps)
+    while remaining:
+        ready = [step for step in remaining if set(step.depends) <= done]
+        if not ready:
+            raise ValueError('dependency cycle between steps: {}'.format(', '.join(step.name for step in remaining)))
+        done.update(step.name for step in ready)
+        remaining = [step for step in remaining if step.name not in done]
+
+
+def run_step(pool, step):
+    """
+    This function runs one statement, or the function of the step, in its own transaction on a connection of the pool.
+    :param pool: the psycopg2 connection pool
+    :param step: the step to run
+    """
+    conn = pool.getconn()
+    try:
+        start = time.perf_counter()
+        with conn.cursor() as cur:
+            if callable(step.query):
+                step.query(cur)
+            else:
+                cur.execute(step.query)
+        conn.commit()
+        return time.perf_counter() - start
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def run_steps(pool, steps, workers=4):
+    """
+    This function runs the steps on up to workers connections of the pool, each one as soon as
+    the steps it depends on are committed, and returns the timing of every step in the order they finished.
+    When a step fails, the steps already running are waited for, no new step is started and the error is raised.
+    :param pool: the psycopg2 connection pool, holding at least workers connections
+    :param steps: the steps of the ETL
+    :param workers: the number of statements run at the same time
+    """
+    check_steps(steps)
+    run_start = time.perf_counter()
+    timings = []
+    done = set()
+    pending = list(steps)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for step in [step for step in pending if set(step.depends) <= done]:
+                pending.remove(step)
+                running[executor.submit(run_step, pool, step)] = (step, time.perf_counter() - run_start)
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step, start = running.pop(future)
+                if future.exception() is not None:
+                    wait(running)
+                    raise future.exception()
+                timings.append(StepTiming(step.name, start, future.result()))
+                done.add(step.name)
+    return timings
+
+
+def print_timings(timings):
+    """
+    This function prints when each step started and how long it took, and the elapsed time of the whole run.
+    :param timings: the timings returned by run_steps
+    """
+    for timing in sorted(timings, key=lambda timing: timing.start):
+        print('{:<20} started at {:>8.2f}s, took {:>8.2f}s'.format(timing.name, timing.start, timing.elapsed))
+    if timings:
+        print('{:<20} {:>8.2f}s'.format('total', max(timing.start + timing.elapsed for timing in timings)))
@@ -1,12 +1,23 @@
+import os
 import configparser
 # CONFIG
+# dwh.cfg of the working directory, or of this directory when the statements are imported from elsewhere, e.g. by the tests
 config = configparser.ConfigParser()
-config.read('dwh.cfg')
+config.read([os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dwh.cfg'), 'dwh.cfg'])
 ARN = config.get("IAM_ROLE", "ARN")
 LOG_DATA = config.get("S3", "LOG_DATA")
 LOG_JSONPATH = config.get("S3", "LOG_JSONPATH")
 SONG_DATA = config.get("S3", "SONG_DATA")
 REGION=config.get("AWS", "REGION_NAME")
+# S3 prefix the COPY manifests of the incremental loads are written to, in a bucket the cluster can read
+MANIFESTS = config.get("S3", "MANIFESTS", fallback="").strip("'")
+# DATA, when set, is the S3 prefix of a dataset written by generate_data.py of Project 4,
+# holding log_data, song_data and log_json_path.json, and replaces the three locations above
+DATA = config.get("S3", "DATA", fallback="").strip("'")
+if DATA:
+    LOG_DATA = "'{}/log_data'".format(DATA.rstrip("/"))
+    LOG_JSONPATH = "'{}/log_json_path.json'".format(DATA.rstrip("/"))
+    SONG_DATA = "'{}/song_data'".format(DATA.rstrip("/"))
 # DROP TABLES
 staging_events_table_drop = "DROP TABLE IF EXISTS staging_events"
 staging_songs_table_drop = " DROP TABLE IF EXISTS staging_songs"
@@ -15,7 +26,12 @@ user_table_drop = "DROP TABLE IF EXISTS users"
 song_table_drop = "DROP TABLE IF EXISTS songs"
 artist_table_drop = "DROP TABLE IF EXISTS artists"
 time_table_drop = "DROP TABLE IF EXISTS time"
+loaded_files_table_drop = "DROP TABLE IF EXISTS loaded_files"
 # CREATE TABLES
+# ts is converted from epoch milliseconds to a TIMESTAMP once, by the COPY (timeformat 'epochmillisecs').
+# staging_events is distributed on userId, so the users are deduplicated without moving rows, and sorted on page and ts,
+# so the NextSong filter of the time and songplays inserts skips the blocks of the other pages.
+# staging_songs is distributed and sorted on artist_id, the key the artists are deduplicated on.
 staging_events_table_create= (""" CREATE TABLE IF NOT EXISTS staging_events (
         artist VARCHAR,
         auth VARCHAR,
@@ -32,10 +48,12 @@ staging_events_table_create= (""" CREATE TABLE IF NOT EXISTS staging_events (
         sessionId INT,
         song VARCHAR,
         status INT,
-        ts VARCHAR(50),
+        ts TIMESTAMP,
         userAgent VARCHAR,
         userId INT
-); 
+)
+DISTKEY(userId)
+COMPOUND SORTKEY(page, ts);
 """)
 staging_songs_table_create = (""" CREATE TABLE IF NOT EXISTS staging_songs (
         num_songs INT,
@@ -48,7 +66,9 @@ staging_songs_table_create = (""" CREATE TABLE IF NOT EXISTS staging_songs (
         title VARCHAR,
         duration FLOAT,
         year INT
-);
+)
+DISTKEY(artist_id)
+SORTKEY(artist_id);
 """)
 songplay_table_create = (""" CREATE TABLE IF NOT EXISTS songplays (
         songplay_id INT IDENTITY(0,1),
@@ -79,7 +99,8 @@ song_table_create = (""" CREATE TABLE IF NOT EXISTS songs (
         year INT,
         duration FLOAT,
         PRIMARY KEY (song_id)
-);
+)
+DISTSTYLE ALL;
 """)
 artist_table_create = (""" CREATE TABLE IF NOT EXISTS artists (
         artist_id VARCHAR    sortkey,
@@ -88,7 +109,8 @@ artist_table_create = (""" CREATE TABLE IF NOT EXISTS artists (
         latitude FLOAT,
         longitude FLOAT,
         PRIMARY KEY(artist_id)
-);
+)
+DISTSTYLE ALL;
 """)
 time_table_create = (""" CREATE TABLE IF NOT EXISTS time (
         start_time TIMESTAMP  sortkey,
@@ -101,7 +123,22 @@ time_table_create = (""" CREATE TABLE IF NOT EXISTS time (
         PRIMARY KEY(start_time)
 );
 """)
+# control table of the S3 objects already loaded by the incremental loads
+loaded_files_table_create = (""" CREATE TABLE IF NOT EXISTS loaded_files (
+        s3_key VARCHAR(1024)  sortkey,
+        size BIGINT,
+        etag VARCHAR(64),
+        loaded_at TIMESTAMP   DEFAULT GETDATE(),
+        PRIMARY KEY(s3_key)
+);
+""")
 # STAGING TABLES
+# The staging tables only hold the data of the current run. TRUNCATE commits in Redshift,
+# so the incremental load, which runs in a single transaction, clears them with DELETE.
+staging_events_truncate = "TRUNCATE staging_events;"
+staging_songs_truncate = "TRUNCATE staging_songs;"
+staging_events_clear = "DELETE FROM staging_events;"
+staging_songs_clear = "DELETE FROM staging_songs;"
 staging_events_copy = ("""
     COPY staging_events
         FROM {0}
@@ -118,30 +155,70 @@ staging_songs_copy = ("""
         JSON 'auto'
         TRUNCATECOLUMNS BLANKSASNULL EMPTYASNULL;
 """).format(SONG_DATA, ARN, REGION)
+# the same COPYs reading only the objects listed in a manifest, whose url is formatted in by incremental.py
+staging_events_copy_manifest = ("""
+    COPY staging_events
+        FROM '{{}}'
+        IAM_ROLE {0}
+        REGION {1}
+        JSON {2}
+        MANIFEST
+        timeformat as 'epochmillisecs';
+""").format(ARN, REGION, LOG_JSONPATH)
+staging_songs_copy_manifest = ("""
+    COPY staging_songs
+        FROM '{{}}'
+        IAM_ROLE {0}
+        REGION {1}
+        JSON 'auto'
+        MANIFEST
+        TRUNCATECOLUMNS BLANKSASNULL EMPTYASNULL;
+""").format(ARN, REGION)
+# the keys under a prefix are compared with LEFT rather than LIKE, whose wildcards _ and % are common in S3 keys
+loaded_files_select = "SELECT s3_key FROM loaded_files WHERE LEFT(s3_key, LENGTH(%(prefix)s)) = %(prefix)s;"
+loaded_files_insert = "INSERT INTO loaded_files (s3_key, size, etag) VALUES %s;"
 # FINAL TABLES
+# The inserts skip the rows already in the tables, so loading the same data twice does not duplicate them.
+# The users are replaced (delete then insert) with their latest event, to keep their current level.
+# The songplays are matched with the songs and artists tables, which hold the songs of earlier runs too.
+# Both are small and copied to every node (DISTSTYLE ALL), so matching the events on title and artist name
+# does not redistribute the events, and neither does the join with songs and artists of the analytic queries.
 songplay_table_insert = (""" INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
-    SELECT DISTINCT     TIMESTAMP 'epoch' + ts/1000 * INTERVAL '1 second' AS start_time, 
+    SELECT DISTINCT     se.ts AS start_time, 
                         se.userId, 
                         se.level,
-                        ss.song_id,
-                        ss.artist_id, 
+                        s.song_id,
+                        s.artist_id, 
                         se.sessionId, 
                         se.location, 
                         se.userAgent
     FROM staging_events as se
-    INNER JOIN staging_songs as ss
-    ON se.song = ss.title and se.artist = ss.artist_name
-    WHERE se.page = 'NextSong';
+    INNER JOIN songs as s
+    ON se.song = s.title
+    INNER JOIN artists as a
+    ON a.artist_id = s.artist_id and se.artist = a.name
+    LEFT JOIN songplays as sp
+    ON sp.start_time = se.ts
+    AND sp.user_id = se.userId AND sp.session_id = se.sessionId
+    WHERE se.page = 'NextSong'
+    AND sp.songplay_id IS NULL;
     
 """)
-user_table_insert = (""" INSERT INTO users (user_id, first_name, last_name, gender, level)
-    SELECT DISTINCT     se.userId,
-                        se.firstName,
-                        se.lastName,
-                        se.gender,
-                        se.level
-    FROM staging_events as se
-    WHERE se.userId IS NOT NULL;
+user_table_insert = (""" DELETE FROM users
+    USING staging_events as se
+    WHERE users.user_id = se.userId;
+    INSERT INTO users (user_id, first_name, last_name, gender, level)
+    SELECT              userId,
+                        firstName,
+                        lastName,
+                        gender,
+                        level
+    FROM (
+        SELECT userId, firstName, lastName, gender, level,
+               ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) AS row_number
+        FROM staging_events
+        WHERE userId IS NOT NULL) AS latest_events
+    WHERE row_number = 1;
     
 """)
 song_table_insert = (""" INSERT INTO songs (song_id, title, artist_id, year, duration)
@@ -151,21 +228,31 @@ song_table_insert = (""" INSERT INTO songs (song_id, title, artist_id, year, dur
                         ss.year,
                         ss.duration
     FROM staging_songs as ss
-    WHERE ss.song_id IS NOT NULL;
+    LEFT JOIN songs as s
+    ON s.song_id = ss.song_id
+    WHERE ss.song_id IS NOT NULL
+    AND s.song_id IS NULL;
     
 """)
 artist_table_insert = (""" INSERT INTO artists (artist_id, name, location, latitude, longitude)
-    SELECT DISTINCT     ss.artist_id,
-                        ss.artist_name,
-                        ss.artist_location,
-                        ss.artist_latitude,
-                        ss.artist_longitude
-    FROM staging_songs as ss
-    WHERE ss.artist_id IS NOT NULL;
+    SELECT              artist_id,
+                        artist_name,
+                        artist_location,
+                        artist_latitude,
+                        artist_longitude
+    FROM (
+        SELECT ss.artist_id, ss.artist_name, ss.artist_location, ss.artist_latitude, ss.artist_longitude,
+               ROW_NUMBER() OVER (PARTITION BY ss.artist_id ORDER BY ss.artist_name) AS row_number
+        FROM staging_songs as ss
+        LEFT JOIN artists as a
+        ON a.artist_id = ss.artist_id
+        WHERE ss.artist_id IS NOT NULL
+        AND a.artist_id IS NULL) AS new_artists
+    WHERE row_number = 1;
                         
 """)
 time_table_insert = (""" INSERT INTO time (start_time, hour, day, week, month, year, weekday)
-    SELECT DISTINCT     ts as start_time,
+    SELECT              ts as start_time,
                         EXTRACT(hour from ts) as hour,
                         EXTRACT(day from ts) as day,
                         EXTRACT(week from ts) as week,
@@ -173,12 +260,28 @@ time_table_insert = (""" INSERT INTO time (start_time, hour, day, week, month, y
                         EXTRACT(year from ts) as year,
                         EXTRACT(weekday from ts) as weekday
     FROM ( 
-            SELECT DISTINCT  TIMESTAMP 'epoch' + ts/1000 *INTERVAL '1 second' as ts
-        FROM staging_events);
+            SELECT DISTINCT  ts
+        FROM staging_events
+        WHERE page = 'NextSong') as se
+    LEFT JOIN time as t
+    ON t.start_time = se.ts
+    WHERE t.start_time IS NULL;
     
 """)
 # QUERY LISTS
-create_table_queries = [staging_events_table_create, staging_songs_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, songplay_table_create]
-drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
-copy_table_queries = [staging_events_copy, staging_songs_copy]
-insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
\ No newline at end of file
+create_table_queries = [staging_events_table_create, staging_songs_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, songplay_table_create, loaded_files_table_create]
+drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, loaded_files_table_drop]
+copy_table_queries = [staging_events_truncate, staging_events_copy, staging_songs_truncate, staging_songs_copy]
+insert_table_queries = [user_table_insert, song_table_insert, artist_table_insert, time_table_insert, songplay_table_insert]
+# ETL STEPS
+# name, query and the steps that have to be committed before it runs, so independent statements can run at the same time.
+# The songplays are inserted after the dimension tables they reference.
+etl_steps = [
+    ("staging_events", staging_events_truncate + staging_events_copy, []),
+    ("staging_songs", staging_songs_truncate + staging_songs_copy, []),
+    ("users", user_table_insert, ["staging_events"]),
+    ("songs", song_table_insert, ["staging_songs"]),
+    ("artists", artist_table_insert, ["staging_songs"]),
+    ("time", time_table_insert, ["staging_events"]),
+    ("songplays", songplay_table_insert, ["staging_events", "staging_songs", "users", "songs", "artists", "time"]),
+]
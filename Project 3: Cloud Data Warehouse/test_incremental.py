@@ -0,0 +1,41 @@
+import pytest
+import psycopg2
+from db import dsn
+from sql_queries import loaded_files_table_create, loaded_files_select
+from postgres_dialect import to_postgres
+from incremental import new_objects
+
+# Tests of the loaded_files lookup of incremental.py, in its own schema of a local Postgres given by DWH_DSN or the DWH_*
+# variables, e.g. DWH_DSN="host=localhost dbname=studentdb user=student password=student". Skipped when none is reachable.
+
+SCHEMA = 'incremental_test'
+
+
+@pytest.fixture
+def cur():
+    try:
+        conn = psycopg2.connect(dsn(), connect_timeout=3)
+    except psycopg2.OperationalError as error:
+        pytest.skip('no Postgres reachable: {}'.format(error))
+    cur = conn.cursor()
+    cur.execute('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}; SET search_path TO {0};'.format(SCHEMA))
+    cur.execute(to_postgres(loaded_files_table_create))
+    conn.commit()
+    yield cur
+    conn.rollback()
+    cur.execute('DROP SCHEMA {} CASCADE;'.format(SCHEMA))
+    conn.commit()
+    conn.close()
+
+
+def test_loaded_files_under_a_prefix_with_wildcards(cur):
+    # _ and % are LIKE wildcards: log_data/ must not match logXdata/, nor log%data/ match log_data/
+    cur.execute("INSERT INTO loaded_files (s3_key, size, etag) VALUES ('s3://bucket/log_data/a.json', 1, 'a'), "
+                "('s3://bucket/logXdata/b.json', 1, 'b'), ('s3://bucket/log_data2/c.json', 1, 'c');")
+    cur.execute(loaded_files_select, {'prefix': 's3://bucket/log_data/'})
+    assert cur.fetchall() == [('s3://bucket/log_data/a.json',)]
+    cur.execute(loaded_files_select, {'prefix': 's3://bucket/log%data/'})
+    assert cur.fetchall() == []
+
+    objects = {'s3://bucket/log_data/a.json': (1, 'a'), 's3://bucket/log_data/b.json': (1, 'b')}
+    assert new_objects(cur, "'s3://bucket/log_data'", objects) == {'s3://bucket/log_data/b.json': (1, 'b')}
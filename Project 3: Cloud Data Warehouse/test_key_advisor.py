@@ -0,0 +1,38 @@
+from key_advisor import QUERIES, TABLE_SIZES, NODES, parse_query, cardinalities, recommend_distribution, recommend_sort_keys
+
+# Tests of the keys recommended by key_advisor.py for its built-in workload and table sizes.
+
+
+def workload_of(queries):
+    return [(weight,) + parse_query(query) for weight, query in queries]
+
+
+def test_recommendation_for_the_builtin_workload():
+    workload = workload_of(QUERIES)
+    styles = recommend_distribution(TABLE_SIZES, workload, NODES)
+    assert styles == {'artists': ('ALL', None), 'songplays': ('KEY', 'song_id'), 'songs': ('KEY', 'song_id'),
+                      'time': ('ALL', None), 'users': ('ALL', None)}
+    # the year and month filters of the time table skip no rows of a single month, so it is sorted on its join column
+    assert recommend_sort_keys(styles, workload, cardinalities(TABLE_SIZES, workload)) == {
+        'songplays': 'start_time', 'users': 'user_id', 'songs': 'year', 'artists': 'artist_id', 'time': 'start_time'}
+
+
+def test_sort_key_ties():
+    styles = {'songplays': ('KEY', 'song_id'), 'songs': ('KEY', 'song_id'), 'time': ('ALL', None),
+              'users': ('ALL', None), 'artists': ('ALL', None)}
+    # filters skipping no rows tie with the join column, which is preferred to them whatever their names
+    workload = workload_of([(10, "SELECT * FROM time as t WHERE t.year = 2018 AND t.month = 11;"),
+                            (1, "SELECT * FROM songplays as sp JOIN time as t ON sp.start_time = t.start_time;")])
+    assert recommend_sort_keys(styles, workload, cardinalities(TABLE_SIZES, workload))['time'] == 'start_time'
+
+    # filters skipping the same share of rows are broken toward the distribution key
+    workload = workload_of([(10, "SELECT * FROM songs as s WHERE s.song_id = 'a' AND s.artist_id = 'b';"),
+                            (10, "SELECT * FROM songplays as sp JOIN songs as s ON sp.song_id = s.song_id;")])
+    distinct = cardinalities(TABLE_SIZES, workload)
+    distinct[('songs', 'artist_id')] = TABLE_SIZES['songs'][0]
+    assert recommend_sort_keys(styles, workload, distinct)['songs'] == 'song_id'
+
+    # a filter skipping more rows outweighs a more frequent one skipping few of them
+    workload = workload_of([(10, "SELECT * FROM time as t WHERE t.year = 2018;"),
+                            (2, "SELECT * FROM time as t WHERE t.hour = 10;")])
+    assert recommend_sort_keys(styles, workload, cardinalities(TABLE_SIZES, workload))['time'] == 'hour'
@@ -0,0 +1,136 @@
+import random
+from datetime import datetime, timedelta
+import pytest
+import psycopg2
+from db import dsn
+from rollups import ROLLUPS, RollupQuery, refresh_rollups, route, run_query, table_name
+
+# Tests of rollups.py on a small star schema in its own schema of a local Postgres, given by DWH_DSN or the DWH_*
+# variables, e.g. DWH_DSN="host=localhost dbname=studentdb user=student password=student". Skipped when none is reachable.
+
+SCHEMA = 'rollups_test'
+
+fixture_tables = ["""CREATE TABLE songplays (songplay_id SERIAL PRIMARY KEY, start_time TIMESTAMP NOT NULL, user_id INT,
+                                           level VARCHAR, song_id VARCHAR, artist_id VARCHAR, session_id INT,
+                                           location VARCHAR, user_agent VARCHAR);""",
+                  """CREATE TABLE time (start_time TIMESTAMP PRIMARY KEY, hour INT, day INT, week INT, month INT,
+                                      year INT, weekday INT);""",
+                  """CREATE TABLE users (user_id INT PRIMARY KEY, first_name VARCHAR, last_name VARCHAR,
+                                       gender CHAR(1), level VARCHAR);""",
+                  """CREATE TABLE songs (song_id VARCHAR PRIMARY KEY, title VARCHAR, artist_id VARCHAR,
+                                       year INT, duration FLOAT);"""]
+
+LOCATIONS = ['Atlanta, GA', 'Chicago, IL', 'Portland, ME', None]
+
+QUERIES = [
+    RollupQuery(['level', 'location'], {}),
+    RollupQuery(['day', 'location'], {'level': 'paid'}),
+    RollupQuery(['month', 'level'], {}),
+    RollupQuery(['gender'], {'month': '2018-11-01'}),
+    RollupQuery(['hour'], {'day': ('2018-11-02', '2018-11-03')}),
+    RollupQuery(['month'], {}),
+    RollupQuery([], {}),
+    RollupQuery(['location', 'gender'], {}),
+]
+
+
+@pytest.fixture
+def cur():
+    try:
+        conn = psycopg2.connect(dsn(), connect_timeout=3)
+    except psycopg2.OperationalError as error:
+        pytest.skip('no Postgres reachable: {}'.format(error))
+    cur = conn.cursor()
+    cur.execute('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}; SET search_path TO {0};'.format(SCHEMA))
+    for query in fixture_tables:
+        cur.execute(query)
+    load_fixture(cur)
+    conn.commit()
+    yield cur
+    conn.rollback()
+    cur.execute('DROP SCHEMA {} CASCADE;'.format(SCHEMA))
+    conn.commit()
+    conn.close()
+
+
+def load_fixture(cur, seed=0):
+    rng = random.Random(seed)
+    for user_id in range(1, 11):
+        cur.execute("INSERT INTO users VALUES (%s, 'First', 'Last', %s, %s);",
+                    (user_id, 'F' if user_id % 2 else 'M', rng.choice(['free', 'paid'])))
+    for song in range(20):
+        cur.execute("INSERT INTO songs VALUES (%s, 'Title', 'AR', 2000, %s);", ('SO{}'.format(song), rng.uniform(100, 400)))
+
+    # five days over two months, each with plays at different hours
+    days = [datetime(2018, 11, 1), datetime(2018, 11, 2), datetime(2018, 11, 3), datetime(2018, 12, 1), datetime(2018, 12, 2)]
+    for day in days:
+        for i in range(40):
+            add_play(cur, day + timedelta(hours=rng.randrange(24), seconds=i), rng.randrange(1, 11), rng.choice(['free', 'paid']),
+                     rng.choice(['SO{}'.format(song) for song in range(20)] + [None]), rng.choice(LOCATIONS))
+
+
+def add_play(cur, start_time, user_id, level, song_id, location):
+    cur.execute("INSERT INTO time VALUES (%s, %s, %s, 0, %s, %s, 0) ON CONFLICT DO NOTHING;",
+                (start_time, start_time.hour, start_time.day, start_time.month, start_time.year))
+    cur.execute("INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent) "
+                "VALUES (%s, %s, %s, %s, 'AR', 1, %s, 'agent');", (start_time, user_id, level, song_id, location))
+
+
+def rounded(rows):
+    return [row[:-1] + (round(row[-1] or 0, 6),) for row in rows]
+
+
+def check_routed_results(cur):
+    sources = []
+    for query in QUERIES:
+        source, rows = run_query(cur, query)
+        _, sql, params = route(query, {})
+        cur.execute(sql, params)
+        assert rounded(rows) == rounded(cur.fetchall()), query
+        sources.append(source)
+    return sources
+
+
+def test_routed_results_equal_the_star_join(cur):
+    refreshed = refresh_rollups(cur, cur.connection)
+    assert refreshed == {'plays_by_day_level_location': 5, 'plays_by_month_level_gender': 2, 'plays_by_day_hour_level': 5}
+
+    sources = check_routed_results(cur)
+    # the queries with a grouping set in an aggregate are answered by one, the last one by the star join
+    assert sources[:-1] == [table_name(ROLLUPS[0]), table_name(ROLLUPS[0]), table_name(ROLLUPS[1]), table_name(ROLLUPS[1]),
+                            table_name(ROLLUPS[2]), table_name(ROLLUPS[1]), table_name(ROLLUPS[1])]
+    assert sources[-1] == 'songplays'
+
+
+def test_only_changed_partitions_are_refreshed(cur):
+    conn = cur.connection
+    refresh_rollups(cur, conn)
+    assert set(refresh_rollups(cur, conn).values()) == {0}
+
+    # a new play on 2018-11-02, and an update of the level of a play of 2018-12-01 keeping the count of the day
+    add_play(cur, datetime(2018, 11, 2, 10), 1, 'paid', 'SO1', 'Atlanta, GA')
+    cur.execute("UPDATE songplays SET level = CASE level WHEN 'free' THEN 'paid' ELSE 'free' END "
+                "WHERE songplay_id = (SELECT MIN(songplay_id) FROM songplays WHERE CAST(start_time AS DATE) = '2018-12-01');")
+    conn.commit()
+    assert refresh_rollups(cur, conn) == {'plays_by_day_level_location': 2, 'plays_by_month_level_gender': 2,
+                                          'plays_by_day_hour_level': 2}
+    check_routed_results(cur)
+
+    # a user changing gender only changes the days of their plays
+    cur.execute("SELECT COUNT(DISTINCT CAST(start_time AS DATE)), COUNT(DISTINCT DATE_TRUNC('month', start_time)) "
+                "FROM songplays WHERE user_id = 3;")
+    days, months = cur.fetchone()
+    cur.execute("UPDATE users SET gender = 'M' WHERE user_id = 3;")
+    conn.commit()
+    assert refresh_rollups(cur, conn) == {'plays_by_day_level_location': days, 'plays_by_month_level_gender': months,
+                                          'plays_by_day_hour_level': days}
+    check_routed_results(cur)
+
+    # the partitions of a day without plays any more are removed
+    cur.execute("DELETE FROM songplays WHERE CAST(start_time AS DATE) = '2018-12-02';")
+    conn.commit()
+    assert refresh_rollups(cur, conn) == {'plays_by_day_level_location': 1, 'plays_by_month_level_gender': 1,
+                                          'plays_by_day_hour_level': 1}
+    cur.execute("SELECT COUNT(*) FROM {} WHERE day = '2018-12-02';".format(table_name(ROLLUPS[0])))
+    assert cur.fetchone()[0] == 0
+    check_routed_results(cur)
@@ -0,0 +1,157 @@
+import os
+import json
+import pytest
+import psycopg2
+from db import dsn, create_pool, run_in_transaction
+from scheduler import Step, check_steps, run_steps
+from postgres_dialect import local_etl_steps, to_postgres, postgres_create_table_queries, postgres_drop_table_queries
+
+# Tests of the ETL steps of sql_queries.py run by scheduler.py on a local Postgres standing in for Redshift, in their
+# own schema, given by DWH_DSN or the DWH_* variables, e.g. DWH_DSN="host=localhost dbname=studentdb user=student password=student".
+# The tests needing Postgres are skipped when none is reachable.
+
+SCHEMA = 'etl_test'
+
+SONGS = [('SO1', 'AR1', 'Artist One', 'Song One'), ('SO2', 'AR1', 'Artist One', 'Song Two'),
+         ('SO3', 'AR2', 'Artist Two', 'Song Three'), ('SO4', 'AR3', 'Artist Three', 'Song Four'),
+         ('SO5', 'AR3', 'Artist Three', 'Song Five'), ('SO6', 'AR4', 'Artist Four', 'Song Six')]
+
+
+@pytest.fixture
+def schema_dsn():
+    try:
+        conn = psycopg2.connect(dsn(), connect_timeout=3)
+    except psycopg2.OperationalError as error:
+        pytest.skip('no Postgres reachable: {}'.format(error))
+    cur = conn.cursor()
+    cur.execute('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0};'.format(SCHEMA))
+    conn.commit()
+    # every connection of the pool uses the schema
+    yield "{} options='-csearch_path={}'".format(dsn(), SCHEMA)
+    conn.rollback()
+    cur.execute('DROP SCHEMA {} CASCADE;'.format(SCHEMA))
+    conn.commit()
+    conn.close()
+
+
+def write_song(directory, song_id, artist_id, artist_name, title):
+    path = os.path.join(directory, 'song_data', song_id[0], song_id[1], song_id + '.json')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'num_songs': 1, 'artist_id': artist_id, 'artist_latitude': None, 'artist_longitude': None,
+                   'artist_location': '', 'artist_name': artist_name, 'song_id': song_id, 'title': title,
+                   'duration': 200.5, 'year': 0}, f)
+
+
+def event(ts, user_id, level, page='NextSong', song=None, artist=None):
+    return {'artist': artist, 'auth': 'Logged In' if user_id else 'Logged Out', 'firstName': 'First', 'gender': 'F',
+            'itemInSession': 0, 'lastName': 'Last', 'length': 200.5 if song else None, 'level': level,
+            'location': 'Atlanta, GA', 'method': 'PUT', 'page': page, 'registration': 1540000000000.0,
+            'sessionId': 7, 'song': song, 'status': 200, 'ts': ts, 'userAgent': 'agent', 'userId': str(user_id or '')}
+
+
+def write_log(directory, day, events):
+    path = os.path.join(directory, 'log_data', '2018', '11', '2018-11-{:02d}-events.json'.format(day))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        for e in events:
+            f.write(json.dumps(e) + '\n')
+
+
+def write_data(directory):
+    for song in SONGS:
+        write_song(directory, *song)
+    day = 1541030400000
+    write_log(directory, 1, [event(day + 1000, 1, 'free', song='Song One', artist='Artist One'),
+                             event(day + 2000, 1, 'free', song='Song Two', artist='Artist One'),
+                             event(day + 3000, 1, 'free', page='Home'),
+                             event(day + 4000, None, 'free', page='Home'),
+                             event(day + 5000, 2, 'paid', song='Song Three', artist='Artist Two'),
+                             event(day + 6000, 2, 'paid', song='Unknown Song', artist='Unknown Artist')])
+    write_log(directory, 2, [event(day + 86400000, 1, 'paid', song='Song Four', artist='Artist Three'),
+                             event(day + 86401000, 3, 'free', song='Song Five', artist='Artist Three')])
+
+
+def table_counts(cur):
+    counts = {}
+    for table in ['staging_events', 'staging_songs', 'users', 'songs', 'artists', 'time', 'songplays']:
+        cur.execute('SELECT COUNT(*) FROM {};'.format(table))
+        counts[table] = cur.fetchone()[0]
+    cur.connection.commit()
+    return counts
+
+
+def check_order(steps, timings):
+    finished = {timing.name: timing.start + timing.elapsed for timing in timings}
+    started = {timing.name: timing.start for timing in timings}
+    assert set(started) == {step.name for step in steps}
+    for step in steps:
+        for depend in step.depends:
+            assert started[step.name] >= finished[depend], (step.name, depend)
+
+
+def test_etl_steps_on_postgres(schema_dsn, tmp_path):
+    write_data(str(tmp_path))
+    conn = psycopg2.connect(schema_dsn)
+    cur = conn.cursor()
+    run_in_transaction(cur, conn, postgres_drop_table_queries + postgres_create_table_queries)
+    pool = create_pool(schema_dsn, 4)
+    try:
+        steps = local_etl_steps(str(tmp_path))
+        timings = run_steps(pool, steps, workers=4)
+        check_order(steps, timings)
+        # the two staging steps run at the same time, before any insert
+        started = {timing.name: timing.start for timing in timings}
+        assert max(started['staging_events'], started['staging_songs']) < min(started[name] for name in
+                                                                                ['users', 'songs', 'artists', 'time'])
+        assert table_counts(cur) == {'staging_events': 8, 'staging_songs': 6, 'users': 3, 'songs': 6, 'artists': 4,
+                                     'time': 6, 'songplays': 5}
+        cur.execute('SELECT user_id, level FROM users ORDER BY user_id;')
+        assert cur.fetchall() == [(1, 'paid'), (2, 'paid'), (3, 'free')]
+        cur.execute('SELECT COUNT(*) FROM artists WHERE location IS NULL;')
+        assert cur.fetchone()[0] == 4
+        conn.commit()
+
+        # loading the files again with a new one adds its rows only, and updates the level of its user
+        write_log(str(tmp_path), 3, [event(1541030400000 + 2 * 86400000, 2, 'free', song='Song Six', artist='Artist Four')])
+        check_order(steps, run_steps(pool, steps, workers=4))
+        assert table_counts(cur) == {'staging_events': 9, 'staging_songs': 6, 'users': 3, 'songs': 6, 'artists': 4,
+                                     'time': 7, 'songplays': 6}
+        cur.execute('SELECT level FROM users WHERE user_id = 2;')
+        assert cur.fetchone()[0] == 'free'
+        cur.execute('SELECT MIN(songplay_id), COUNT(DISTINCT songplay_id) FROM songplays;')
+        assert cur.fetchone() == (0, 6)
+    finally:
+        conn.close()
+        pool.closeall()
+
+
+def test_failed_step_stops_its_dependents(schema_dsn):
+    pool = create_pool(schema_dsn, 2)
+    steps = [Step('first', 'CREATE TABLE first_ran (x INT);', []),
+             Step('failing', 'SELECT * FROM missing_table;', []),
+             Step('dependent', 'CREATE TABLE dependent_ran (x INT);', ['first', 'failing'])]
+    try:
+        with pytest.raises(psycopg2.errors.UndefinedTable):
+            run_steps(pool, steps, workers=2)
+        conn = pool.getconn()
+        with conn.cursor() as cur:
+            cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = %s ORDER BY 1;", (SCHEMA,))
+            assert cur.fetchall() == [('first_ran',)]
+        pool.putconn(conn)
+    finally:
+        pool.closeall()
+
+
+def test_check_steps():
+    with pytest.raises(ValueError, match='unknown'):
+        check_steps([Step('a', 'SELECT 1;', ['b'])])
+    with pytest.raises(ValueError, match='cycle'):
+        check_steps([Step('a', 'SELECT 1;', ['b']), Step('b', 'SELECT 1;', ['a'])])
+
+
+def test_postgres_translation():
+    for query in postgres_create_table_queries + [step.query for step in local_etl_steps('data') if isinstance(step.query, str)]:
+        for keyword in ['DISTKEY', 'SORTKEY', 'DISTSTYLE', 'IDENTITY(', 'GETDATE', 'REFERENCES', 'IAM_ROLE', 'weekday from']:
+            assert keyword.lower() not in query.lower(), (keyword, query)
+    assert to_postgres(") DISTSTYLE ALL;") == ");"
@@ -0,0 +1,229 @@
+import time
+import argparse
+from datetime import datetime
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import udf, col, lit, when, concat, monotonically_increasing_id
+from pyspark.sql.types import TimestampType
+from etl import with_start_time, build_time_table, build_songplays_table
+
+
+def create_local_spark_session(cores):
+
+    """
+    This function creates a local mode Spark Session for the benchmarks.
+    """
+    return SparkSession \
+        .builder \
+        .master("local[{}]".format(cores)) \
+        .appName("sparkify-benchmark") \
+        .config("spark.sql.shuffle.partitions", cores * 2) \
+        .getOrCreate()
+
+
+def synthetic_song_data(spark, songs):
+
+    """
+    This function generates a song lookup shaped like the one returned by process_song_data.
+
+    Parameters:
+            spark = Spark Session
+            songs = number of songs
+    """
+    return spark.range(songs) \
+                .select(concat(lit("Song "), col("id").cast("string")).alias("title"),
+                        concat(lit("AR"), (col("id") % 1000).cast("string")).alias("artist_id"),
+                        concat(lit("Artist "), (col("id") % 1000).cast("string")).alias("artist_name"),
+                        (lit(1990) + col("id") % 30).cast("int").alias("year"),
+                        (lit(120.0) + col("id") % 200).alias("duration"),
+                        col("id").alias("song_id"))
+
+
+def synthetic_log_data(spark, rows, songs=10000):
+
+    """
+    This function generates log events shaped like log_data, with one event every 37 ms from November 2018.
+    Every event plays one of the synthetic songs, and one event in seven plays a song that is not in the songs data.
+
+    Parameters:
+            spark = Spark Session
+            rows  = number of events
+            songs = number of synthetic songs played
+    """
+    song_number = (col("id") * 7919) % songs
+    known = col("id") % 7 != 0
+    return spark.range(rows) \
+                .select((lit(1541030400000) + col("id") * 37).alias("ts"),
+                        (col("id") % 97).cast("string").alias("userId"),
+                        lit("User").alias("firstName"),
+                        lit("Sparkify").alias("lastName"),
+                        lit("F").alias("gender"),
+                        when(col("id") % 3 == 0, lit("paid")).otherwise(lit("free")).alias("level"),
+                        (col("id") / 40).cast("long").alias("sessionId"),
+                        (col("id") % 40).alias("itemInSession"),
+                        lit("San Francisco-Oakland-Hayward, CA").alias("location"),
+                        lit("Mozilla/5.0").alias("userAgent"),
+                        when(known, concat(lit("Song "), song_number.cast("string")))
+                            .otherwise(lit("Unknown Song")).alias("song"),
+                        concat(lit("Artist "), (song_number % 1000).cast("string")).alias("artist"),
+                        (lit(120.0) + song_number % 200).alias("length"),
+                        when(col("id") % 5 == 0, lit("Home")).otherwise(lit("NextSong")).alias("page"))
+
+
+def udf_time_table(df, udf_time):
+
+    """
+    This function builds the time table the way etl.py did before, with a Python UDF for the timestamp.
+    The time spent inside the UDF is added to the udf_time accumulator.
+
+    Parameters:
+            df       = log events
+            udf_time = accumulator of the seconds spent in the UDF
+    """
+    def to_timestamp(x):
+        start = time.perf_counter()
+        value = datetime.fromtimestamp(x / 1000)
+        udf_time.add(time.perf_counter() - start)
+        return value
+
+    get_timestamp = udf(to_timestamp, TimestampType())
+    return build_time_table(df.withColumn("start_time", get_timestamp(col("ts"))))
+
+
+def python_eval_nodes(df):
+
+    """
+    This function counts the operators of the physical plan that send rows to Python workers.
+    """
+    plan = df._jdf.queryExecution().executedPlan().toString()
+    return plan.count("BatchEvalPython") + plan.count("ArrowEvalPython")
+
+
+def shuffle_exchanges(df):
+
+    """
+    This function counts the shuffle exchanges of the physical plan, each of which starts a new stage.
+    """
+    plan = df._jdf.queryExecution().executedPlan().toString()
+    return sum(1 for line in plan.splitlines()
+               if "Exchange" in line and "BroadcastExchange" not in line and "ReusedExchange" not in line)
+
+
+def join_songplays_table(df, song_df):
+
+    """
+    This function builds the songplays table the way etl.py did before: a shuffle join with the songs on title only,
+    a second join with the time table for the year and month, and one songplay kept per user.
+
+    Parameters:
+            df      = NextSong events with the start_time column
+            song_df = songs table
+    """
+    time_table = build_time_table(df)
+    songplays_table = df.join(song_df, df.song == song_df.title, how='inner') \
+                        .select(monotonically_increasing_id().alias("songplay_id"),
+                                col("start_time"),
+                                col("userId").alias("user_id"),
+                                "level", "song_id", "artist_id",
+                                col("sessionId").alias("session_id"),
+                                "location",
+                                col("userAgent").alias("user_agent"))
+
+    return songplays_table.join(time_table, songplays_table.start_time == time_table.start_time, how="inner") \
+                          .select("songplay_id", songplays_table.start_time, "user_id", "level", "song_id",
+                                  "artist_id", "session_id", "location", "user_agent", "year", "month") \
+                          .drop_duplicates(["user_id"])
+
+
+def timed_run(df):
+
+    """
+    This function runs a DataFrame to completion without writing it and returns the elapsed seconds.
+    """
+    start = time.perf_counter()
+    df.write.format("noop").mode("overwrite").save()
+    return time.perf_counter() - start
+
+
+def benchmark_timestamps(spark, rows):
+
+    """
+    This function compares the time table built with the Python UDF and with native expressions.
+
+    Parameters:
+            spark = Spark Session
+            rows  = number of synthetic log events
+    """
+    df = synthetic_log_data(spark, rows).filter(col("page") == "NextSong")
+    udf_time = spark.sparkContext.accumulator(0.0)
+
+    before = udf_time_table(df, udf_time)
+    after = build_time_table(with_start_time(df))
+
+    # warm up the session so the first run does not pay for it
+    timed_run(spark.range(1000))
+
+    before_elapsed = timed_run(before)
+    after_elapsed = timed_run(after)
+
+    print("time table from {} synthetic log events".format(rows))
+    print("{:<10}{:>12}{:>14}{:>18}{:>20}".format("", "seconds", "rows/sec", "python operators", "python UDF seconds"))
+    print("{:<10}{:>12.2f}{:>14.0f}{:>18}{:>20.2f}".format(
+        "udf", before_elapsed, rows / before_elapsed, python_eval_nodes(before), udf_time.value))
+    print("{:<10}{:>12.2f}{:>14.0f}{:>18}{:>20.2f}".format(
+        "native", after_elapsed, rows / after_elapsed, python_eval_nodes(after), 0.0))
+
+
+def benchmark_songplays(spark, rows, songs):
+
+    """
+    This function compares the songplays table built with the former shuffle joins and with the broadcast join.
+    Automatic broadcast joins and adaptive execution are turned off for this benchmark, so that only the explicit
+    broadcast is used, as on a song table too large for the automatic threshold, and the plans are final before running.
+
+    Parameters:
+            spark = Spark Session
+            rows  = number of synthetic log events
+            songs = number of synthetic songs
+    """
+    spark.conf.set("spark.sql.autoBroadcastJoinThreshold", -1)
+    spark.conf.set("spark.sql.adaptive.enabled", False)
+
+    df = with_start_time(synthetic_log_data(spark, rows, songs).filter(col("page") == "NextSong")).cache()
+    song_lookup = synthetic_song_data(spark, songs).cache()
+    df.count()
+    song_lookup.count()
+
+    before = join_songplays_table(df, song_lookup.drop("artist_name"))
+    after = build_songplays_table(df, song_lookup)
+
+    before_elapsed = timed_run(before)
+    after_elapsed = timed_run(after)
+
+    print("songplays table from {} synthetic log events and {} songs".format(rows, songs))
+    print("{:<10}{:>12}{:>14}{:>20}{:>12}".format("", "seconds", "rows/sec", "shuffle exchanges", "songplays"))
+    print("{:<10}{:>12.2f}{:>14.0f}{:>20}{:>12}".format(
+        "shuffle", before_elapsed, rows / before_elapsed, shuffle_exchanges(before), before.count()))
+    print("{:<10}{:>12.2f}{:>14.0f}{:>20}{:>12}".format(
+        "broadcast", after_elapsed, rows / after_elapsed, shuffle_exchanges(after), after.count()))
+
+    df.unpersist()
+    song_lookup.unpersist()
+    spark.conf.unset("spark.sql.autoBroadcastJoinThreshold")
+    spark.conf.unset("spark.sql.adaptive.enabled")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mode benchmarks of the Sparkify data lake ETL.")
+    parser.add_argument("--rows", type=int, default=2000000, help="number of synthetic log events")
+    parser.add_argument("--songs", type=int, default=100000, help="number of synthetic songs")
+    parser.add_argument("--cores", type=int, default=4, help="number of local cores")
+    args = parser.parse_args()
+
+    spark = create_local_spark_session(args.cores)
+    benchmark_timestamps(spark, args.rows)
+    benchmark_songplays(spark, args.rows, args.songs)
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
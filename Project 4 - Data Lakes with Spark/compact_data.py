@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import argparse
+import pandas as pd
+
+# Packs the small JSON files of song_data and log_data into a few large files, read by the ETLs of Project 1
+# (etl.py --input) and of this project (etl.py --input-format) instead of the source trees:
+#
+#   song_data/A/B/C/TRAAABD128F429CF47.json ...  ->  song_data/part-00000.json ...
+#   log_data/2018/11/2018-11-01-events.json ...  ->  log_data/2018/11/part-00001.json ...
+#
+# The parts are line delimited JSON, the source lines copied as they are, or Parquet with the column types below.
+# log_data keeps its year and month directories, so the ETLs can still select the months to load.
+# _manifest.jsonl lists the format of each part and its source files with their size and modification time: a rerun packs
+# the new files into new parts, and rebuilds the parts of the files changed or removed since, leaving the other parts as
+# they are. A rerun with another --format rebuilds every part, so a dataset never mixes JSON and Parquet parts.
+
+MANIFEST = '_manifest.jsonl'
+PART_SIZE = 128 * 1024 * 1024
+
+# datasets and whether their parts keep the directories of the source files
+DATASETS = {'song_data': False, 'log_data': True}
+
+# column types of the Parquet parts, the same in every part so they can be read together
+COLUMN_TYPES = {
+    'song_data': {'num_songs': 'Int64', 'artist_id': 'string', 'artist_latitude': 'float64', 'artist_longitude': 'float64',
+                  'artist_location': 'string', 'artist_name': 'string', 'song_id': 'string', 'title': 'string',
+                  'duration': 'float64', 'year': 'Int64'},
+    'log_data': {'artist': 'string', 'auth': 'string', 'firstName': 'string', 'gender': 'string', 'itemInSession': 'Int64',
+                 'lastName': 'string', 'length': 'float64', 'level': 'string', 'location': 'string', 'method': 'string',
+                 'page': 'string', 'registration': 'float64', 'sessionId': 'Int64', 'song': 'string', 'status': 'Int64',
+                 'ts': 'Int64', 'userAgent': 'string', 'userId': 'string'},
+}
+
+
+def source_files(source):
+
+    """
+    This function returns the JSON files under a directory, as paths relative to it, with their size and modification time.
+
+    Parameters:
+            source = directory of the dataset, e.g. data/song_data
+    """
+    files = {}
+    for root, dirs, names in os.walk(source):
+        dirs.sort()
+        for name in sorted(names):
+            if name.endswith('.json'):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                files[os.path.relpath(path, source).replace(os.sep, '/')] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+
+def read_manifest(output):
+
+    """
+    This function returns the parts listed in the manifest of a compacted dataset, as dicts of the part path, its format
+    and its [source path, size, modification time] files, or no parts when it has not been compacted yet.
+
+    Parameters:
+            output = directory of the compacted dataset
+    """
+    path = os.path.join(output, MANIFEST)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_manifest(output, parts):
+
+    """
+    This function replaces the manifest of a compacted dataset, through a temporary file so it is never left half written.
+
+    Parameters:
+            output = directory of the compacted dataset
+            parts  = parts returned by read_manifest and compact_dataset
+    """
+    path = os.path.join(output, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        for part in parts:
+            f.write(json.dumps(part) + '\n')
+    os.replace(path + '.tmp', path)
+
+
+def part_extension(part):
+
+    """
+    This function returns the extension of the path of a part, its format in the manifests written before the format was recorded.
+
+    Parameters:
+            part = part returned by read_manifest
+    """
+    return os.path.splitext(part['part'])[1].lstrip('.')
+
+
+def plan_parts(files, keep_directories, part_size=PART_SIZE):
+
+    """
+    This function groups source files into parts of about part_size bytes, by directory when keep_directories is set.
+
+    Parameters:
+            files            = dict of source path to [size, modification time]
+            keep_directories = whether each part only holds files of one directory
+            part_size        = bytes of source files in each part
+    """
+    groups = {}
+    for path in sorted(files):
+        directory = os.path.dirname(path) if keep_directories else ''
+        groups.setdefault(directory, []).append(path)
+
+    parts = []
+    for directory, paths in sorted(groups.items()):
+        current, size = [], 0
+        for path in paths:
+            if current and size + files[path][0] > part_size:
+                parts.append((directory, current))
+                current, size = [], 0
+            current.append(path)
+            size += files[path][0]
+        if current:
+            parts.append((directory, current))
+    return parts
+
+
+def write_json_part(source, paths, target):
+
+    """
+    This function writes a line delimited JSON part by copying the lines of its source files, without parsing them.
+
+    Parameters:
+            source = directory of the dataset
+            paths  = source paths of the part
+            target = path of the part
+    """
+    with open(target + '.tmp', 'wb') as out:
+        for path in paths:
+            with open(os.path.join(source, path), 'rb') as f:
+                for line in f:
+                    if line.strip():
+                        out.write(line if line.endswith(b'\n') else line + b'\n')
+    os.replace(target + '.tmp', target)
+
+
+def write_parquet_part(source, paths, target, column_types=None):
+
+    """
+    This function writes a Parquet part with the records of its source files.
+
+    Parameters:
+            source       = directory of the dataset
+            paths        = source paths of the part
+            target       = path of the part
+            column_types = dict of column to pandas type, the inferred types when None
+    """
+    records = []
+    for path in paths:
+        with open(os.path.join(source, path), 'rb') as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    df = pd.DataFrame.from_records(records)
+    for column, dtype in (column_types or {}).items():
+        df[column] = (df[column] if column in df else pd.Series(None, index=df.index, dtype=object)).astype(dtype)
+    df.to_parquet(target + '.tmp', index=False)
+    os.replace(target + '.tmp', target)
+
+
+def compact_dataset(source, output, keep_directories=False, part_format='json', part_size=PART_SIZE, column_types=None):
+
+    """
+    This function packs the new source files of a dataset into new parts, rebuilds the parts whose source files
+    changed or were removed, or which are in another format, and records them in the manifest.
+    Returns the number of parts written and of files packed.
+
+    Parameters:
+            source           = directory of the dataset, e.g. data/song_data
+            output           = directory of the compacted dataset, e.g. compacted/song_data
+            keep_directories = whether the parts keep the directories of the source files
+            part_format      = 'json' or 'parquet'
+            part_size        = bytes of source files in each part
+            column_types     = dict of column to pandas type of the Parquet parts
+    """
+    files = source_files(source)
+    parts = read_manifest(output)
+
+    # a part is kept when it is in the format asked for and all its files are unchanged, the files of the other parts
+    # are packed again
+    kept, stale, packed = [], [], set()
+    for part in parts:
+        if part_format == part.get('format', part_extension(part)) and \
+                all(files.get(path) == [size, mtime] for path, size, mtime in part['files']):
+            kept.append(part)
+            packed.update(path for path, _, _ in part['files'])
+        else:
+            stale.append(part)
+    new_files = {path: stat for path, stat in files.items() if path not in packed}
+
+    next_part = 1 + max([int(os.path.basename(part['part']).split('.')[0].split('-')[1]) for part in parts] or [-1])
+    written = []
+    for directory, paths in plan_parts(new_files, keep_directories, part_size):
+        name = '/'.join(filter(None, [directory, 'part-{:05d}.{}'.format(next_part, part_format)]))
+        target = os.path.join(output, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if part_format == 'parquet':
+            write_parquet_part(source, paths, target, column_types)
+        else:
+            write_json_part(source, paths, target)
+        written.append({'part': name, 'format': part_format, 'files': [[path] + files[path] for path in paths]})
+        next_part += 1
+
+    if written or stale:
+        write_manifest(output, kept + written)
+    for part in stale:
+        path = os.path.join(output, part['part'])
+        if os.path.exists(path):
+            os.remove(path)
+    return len(written), len(new_files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packs the small JSON files of song_data and log_data into a few large files.")
+    parser.add_argument("--input", default="data/", help="local directory holding song_data and log_data")
+    parser.add_argument("--output", default="compacted/", help="local directory the compacted song_data and log_data are written to")
+    parser.add_argument("--format", choices=["json", "parquet"], default="json", help="format of the parts")
+    parser.add_argument("--part-size", type=int, default=PART_SIZE // (1024 * 1024), help="megabytes of source files in each part")
+    args = parser.parse_args()
+
+    for dataset, keep_directories in DATASETS.items():
+        start = time.time()
+        parts, files = compact_dataset(os.path.join(args.input, dataset), os.path.join(args.output, dataset), keep_directories,
+                                       args.format, args.part_size * 1024 * 1024, COLUMN_TYPES[dataset])
+        print("{}: {} files packed into {} parts in {:.1f}s".format(dataset, files, parts, time.time() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,159 +1,502 @@
 import configparser
-from datetime import datetime
+import argparse
 import os
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import udf, col
+from pyspark import StorageLevel
+from pyspark.sql import SparkSession, Window
+from pyspark.sql.utils import AnalysisException
+from pyspark.sql.functions import col, lit, broadcast, pmod, xxhash64, row_number, struct, max as spark_max, min as spark_min
 from pyspark.sql.functions import year, month, dayofmonth, hour,\
-weekofyear, date_format
-from pyspark.sql.types import StringType, IntegerType, DateType, TimestampType
+weekofyear, dayofweek
+from pyspark.sql.types import StringType, IntegerType, LongType, TimestampType
 from pyspark.sql.types import StructType, StructField, DoubleType 
-from pyspark.sql.functions import monotonically_increasing_id
+from storage import DEFAULT_STORAGE, read_storage, is_s3, spark_options
 
-config = configparser.ConfigParser()
-config.read('dl.cfg')
+# schemas of the input data, so Spark does not scan the JSON files to infer them
+song_schema = StructType([
+    StructField("artist_id", StringType()),
+    StructField("artist_latitude", DoubleType()),
+    StructField("artist_location", StringType()),
+    StructField("artist_longitude", DoubleType()),
+    StructField("artist_name", StringType()),
+    StructField("duration", DoubleType()),
+    StructField("num_songs", IntegerType()),
+    StructField("title", StringType()),
+    StructField("year", IntegerType()),
+])
 
-os.environ['AWS_ACCESS_KEY_ID']=config['AWS']['AWS_ACCESS_KEY_ID']
-os.environ['AWS_SECRET_ACCESS_KEY']=config['AWS']['AWS_SECRET_ACCESS_KEY']
+log_schema = StructType([
+    StructField("artist", StringType()),
+    StructField("auth", StringType()),
+    StructField("firstName", StringType()),
+    StructField("gender", StringType()),
+    StructField("itemInSession", LongType()),
+    StructField("lastName", StringType()),
+    StructField("length", DoubleType()),
+    StructField("level", StringType()),
+    StructField("location", StringType()),
+    StructField("method", StringType()),
+    StructField("page", StringType()),
+    StructField("registration", DoubleType()),
+    StructField("sessionId", LongType()),
+    StructField("song", StringType()),
+    StructField("status", LongType()),
+    StructField("ts", LongType()),
+    StructField("userAgent", StringType()),
+    StructField("userId", StringType()),
+])
 
-def create_spark_session():
+# glob of the song_data files, and extension of the log_data files under their year and month directories,
+# of the source JSON files and of the parts written by compact_data.py
+INPUT_FORMATS = {
+    "json": ("song_data/*/*/*/*.json", "json"),
+    "compacted": ("song_data/*.json", "json"),
+    "parquet": ("song_data/*.parquet", "parquet"),
+}
+
+
+def set_aws_credentials(config_file='dl.cfg'):
     
     """
-    This function creates the Spark Session with the packages required.
+    This function exports the AWS keys from the config file, so that the ETL functions can be imported without it.
+    """
+    config = configparser.ConfigParser()
+    config.read(config_file)
+
+    os.environ['AWS_ACCESS_KEY_ID']=config['AWS']['AWS_ACCESS_KEY_ID']
+    os.environ['AWS_SECRET_ACCESS_KEY']=config['AWS']['AWS_SECRET_ACCESS_KEY']
+
+
+def create_spark_session(storage=DEFAULT_STORAGE):
+    
     """
-    spark = SparkSession \
+    This function creates the Spark Session with the packages required by the storage.
+    Overwriting a partitioned table only replaces the partitions present in the data written.
+    
+    Parameters:
+            storage = Storage returned by storage.read_storage
+    """
+    builder = SparkSession \
         .builder \
-        .config("spark.jars.packages", "org.apache.hadoop:hadoop-aws:2.7.0") \
-        .getOrCreate()
-    return spark
+        .config("spark.sql.sources.partitionOverwriteMode", "dynamic")
+    for key, value in spark_options(storage).items():
+        builder = builder.config(key, value)
+    return builder.getOrCreate()
 
 
-def process_song_data(spark, input_data, output_data):
+def read_table(spark, path):
     
     """
-        This function loads song_data from S3 and then processes the songs and the artist tables and then loads them back to S3
+    This function reads a table of the data lake, or returns None when it has not been written yet.
+    
+    Parameters:
+            spark = Spark Session
+            path  = location of the table
+    """
+    try:
+        return spark.read.parquet(path)
+    except AnalysisException:
+        return None
+
+
+def write_table(df, path, partition_by=None, mode="overwrite", files_per_partition=1):
+    
+    """
+    This function writes a table of the data lake with at most files_per_partition parquet files in each partition.
+    The rows are shuffled by the partition columns, plus a hash of the row spreading each partition over
+    files_per_partition tasks, so every task writes whole partitions instead of a small file in each of them.
+    The number of shuffle partitions is given explicitly, as adaptive query execution would otherwise coalesce
+    the small shuffle partitions and write a single file per partition.
+    With mode="overwrite" only the partitions present in df are replaced, the other partitions are kept.
+    
+    Parameters:
+            df                  = table to write
+            path                = location of the table
+            partition_by        = partition columns, or None for an unpartitioned table
+            mode                = "overwrite" or "append"
+            files_per_partition = number of parquet files written in each partition, or for the whole unpartitioned table
+    """
+    if partition_by:
+        keys = [col(c) for c in partition_by]
+        if files_per_partition > 1:
+            keys.append(pmod(xxhash64(*df.columns), lit(files_per_partition)))
+            df = df.repartition(int(df.sparkSession.conf.get("spark.sql.shuffle.partitions")), *keys)
+        else:
+            df = df.repartition(*keys)
+    else:
+        df = df.coalesce(files_per_partition)
+
+    df.write \
+      .option("partitionOverwriteMode", "dynamic") \
+      .parquet(path, mode=mode, partitionBy=partition_by)
+
+
+def delete_path(spark, path):
+    
+    """
+    This function deletes a directory of the data lake, local or on S3, through the Hadoop file system of Spark.
+    
+    Parameters:
+            spark = Spark Session
+            path  = location of the directory
+    """
+    jvm_path = spark._jvm.org.apache.hadoop.fs.Path(path)
+    jvm_path.getFileSystem(spark._jsc.hadoopConfiguration()).delete(jvm_path, True)
+
+
+def rewrite_table(spark, df, path, partition_by=None, files_per_partition=1):
+    
+    """
+    This function overwrites a table with rows read from the same table. Spark cannot overwrite the files it is reading,
+    so the rows are first written to a staging copy next to the table, and the table is overwritten from that copy.
+    Both copies are on the storage of the data lake, so losing an executor only reruns its tasks, and the staging copy
+    is only deleted once the table is written. A staging copy left by a failed run is deleted first.
+    Only the partitions present in df are replaced.
+    
+    Parameters:
+            spark               = Spark Session
+            df                  = rows of the table to write
+            path                = location of the table
+            partition_by        = partition columns, or None for an unpartitioned table
+            files_per_partition = number of parquet files written in each partition
+    """
+    staging = path.rstrip("/") + "_staging/"
+    delete_path(spark, staging)
+    write_table(df, staging, partition_by, "overwrite", files_per_partition)
+    write_table(spark.read.parquet(staging), path, partition_by, "overwrite", files_per_partition)
+    delete_path(spark, staging)
+
+
+def compact_table(spark, path, partition_by, files_per_partition=1, months=None):
+    
+    """
+    This function rewrites the partitions of a table with files_per_partition parquet files each,
+    merging the small files left by appending runs.
+    
+    Parameters:
+            spark               = Spark Session
+            path                = location of the table
+            partition_by        = partition columns of the table
+            files_per_partition = number of parquet files written in each partition
+            months              = (year, month) pairs of the partitions to compact, all of them when None
+    """
+    df = read_table(spark, path)
+    if df is None:
+        return
+    if months:
+        df = df.filter(month_filter(months))
+    rewrite_table(spark, df, path, partition_by, files_per_partition)
+
+
+def latest_users(df):
+    
+    """
+    This function returns a row per user, with the names, gender and level of the last NextSong event of the user,
+    and the start_time of that event.
+    
+    Parameters:
+            df = NextSong events
+    """
+    last_event = Window.partitionBy("userId").orderBy(col("ts").desc())
+    return df.withColumn("event_rank", row_number().over(last_event)) \
+             .filter(col("event_rank") == 1) \
+             .select("userId", "firstName", "lastName", "gender", "level", "start_time")
+
+
+def write_users(spark, users_table, path, incremental, files_per_partition=1, songplays_path=None):
+    
+    """
+    This function writes the users table. An incremental run upserts the users of its events: the users already written
+    get the names, gender and level of their last event of the run, and the new users are added.
+    A user already written with a songplay later than their last event of the run, e.g. when an older month is loaded
+    again, keeps their row, so the users always have the level of their latest event.
+    
+    Parameters:
+            spark               = Spark Session
+            users_table         = users of the events of the run, returned by latest_users
+            path                = location of the users table
+            incremental         = whether the run only loads some of the log_data
+            files_per_partition = number of parquet files written for the table
+            songplays_path      = location of the songplays table already written, for the latest event of each user
+    """
+    existing_users = read_table(spark, path) if incremental else None
+    if existing_users is None:
+        write_table(users_table.drop("start_time"), path, files_per_partition=files_per_partition)
+        return
+    songplays = read_table(spark, songplays_path) if songplays_path else None
+    if songplays is not None:
+        last_plays = songplays.groupBy(col("user_id").alias("userId")).agg(spark_max("start_time").alias("last_play"))
+        later_users = users_table.join(last_plays, "userId") \
+                                 .filter(col("last_play") > col("start_time")) \
+                                 .join(existing_users.select("userId"), "userId") \
+                                 .select("userId")
+        users_table = users_table.join(later_users, "userId", how="left_anti")
+    users_table = users_table.drop("start_time")
+    kept_users = existing_users.join(users_table.select("userId"), "userId", how="left_anti")
+    rewrite_table(spark, kept_users.unionByName(users_table), path, files_per_partition=files_per_partition)
+
+
+def month_filter(months):
+    
+    """
+    This function returns the condition selecting the rows of the given months from a table partitioned by year and month.
+    
+    Parameters:
+            months = (year, month) pairs
+    """
+    condition = lit(False)
+    for y, m in months:
+        condition = condition | ((col("year") == y) & (col("month") == m))
+    return condition
+
+
+def log_paths(input_data, months=None, input_format="json"):
+    
+    """
+    This function returns the log_data files to read, all of them or only those of the given months.
+    
+    Parameters:
+            input_data   = location of the log_data
+            months       = (year, month) pairs, all the months when None
+            input_format = "json", or "compacted" or "parquet" for the parts written by compact_data.py
+    """
+    extension = INPUT_FORMATS[input_format][1]
+    if not months:
+        return [os.path.join(input_data, 'log_data/*/*/*.{}'.format(extension))]
+    return [os.path.join(input_data, 'log_data/{}/{:02d}/*.{}'.format(y, m, extension)) for y, m in months]
+
+
+def read_input(spark, paths, schema, input_format="json"):
+    
+    """
+    This function reads song_data or log_data files with the given schema. The Parquet parts of compact_data.py
+    are cast to it, so the ETL gets the same columns whatever the input format.
+    
+    Parameters:
+            spark        = Spark Session
+            paths        = files to read
+            schema       = song_schema or log_schema
+            input_format = "json", "compacted" or "parquet"
+    """
+    if INPUT_FORMATS[input_format][1] == "parquet":
+        return spark.read.parquet(*paths).select([col(field.name).cast(field.dataType) for field in schema.fields])
+    return spark.read.json(paths, schema=schema)
+
+
+def parse_months(value):
+    
+    """
+    This function parses a comma separated list of months, e.g. 2018-11,2018-12, into (year, month) pairs.
+    """
+    months = []
+    for item in value.split(","):
+        y, m = item.strip().split("-")
+        months.append((int(y), int(m)))
+    return months
+
+
+def process_song_data(spark, input_data, output_data, storage_level=StorageLevel.MEMORY_AND_DISK, files_per_partition=1,
+                      input_format="json"):
+    
+    """
+        This function loads song_data from S3 and then processes the songs and the artist tables and then loads them back to S3.
+        The songs table, with the artist names, is kept persisted and returned, so process_log_data does not read it back from S3.
         
         Parameters:
-            spark       = Spark Session
-            input_data  = location of the song_data where the file is loaded to process
-            output_data = location of the results stored
+            spark               = Spark Session
+            input_data          = location of the song_data where the file is loaded to process
+            output_data         = location of the results stored
+            storage_level       = storage level used to persist the song data
+            files_per_partition = number of parquet files written in each partition of the tables
+            input_format        = "json", or "compacted" or "parquet" for the parts written by compact_data.py
     """
     
     # get filepath to song data file
-    song_data = input_data + 'song_data/*/*/*/*.json'
-    
-    song_schema = StructType([
-        StructField("artist_id", StringType()),
-        StructField("artist_latitude", DoubleType()),
-        StructField("artist_location", StringType()),
-        StructField("artist_longitude", DoubleType()),
-        StructField("artist_name", StringType()),
-        StructField("duration", DoubleType()),
-        StructField("num_songs", IntegerType()),
-        StructField("title", StringType()),
-        StructField("year", IntegerType()),
-    ])
+    song_data = os.path.join(input_data, INPUT_FORMATS[input_format][0])
         
-    # read song data file
-    songs_df = spark.read.json(song_data, schema=song_schema).dropDuplicates()
+    # read song data file once for both the songs and the artists tables
+    songs_df = read_input(spark, [song_data], song_schema, input_format).dropDuplicates().persist(storage_level)
 
-    # extract columns to create songs table
-    songs_table = songs_df.select("title", "artist_id", "year", "duration").dropDuplicates(["artist_id"]) \
-                  .withColumn("song_id", monotonically_increasing_id())
+    # extract columns to create songs table, with the artist names used to match the songplays.
+    # song_id is a hash of the song, so it stays the same across runs for the songplays already written
+    song_lookup = songs_df.select("title", "artist_id", "artist_name", "year", "duration") \
+                  .dropDuplicates(["title", "artist_id", "duration"]) \
+                  .withColumn("song_id", xxhash64("title", "artist_id", "duration")) \
+                  .persist(storage_level)
+    songs_table = song_lookup.select("title", "artist_id", "year", "duration", "song_id")
     
-    # write songs table to parquet files partitioned by year and artist
-    songs_table.write.parquet(output_data + "songs/", mode="overwrite", 
-                              partitionBy=["year","artist_id"])
+    # write songs table to parquet files partitioned by year, a partition per artist would write a file per artist
+    write_table(songs_table, os.path.join(output_data, "songs/"), ["year"], files_per_partition=files_per_partition)
 
     # extract columns to create artists table
     artists_table = songs_df.select("artist_id", "artist_name", "artist_location", 
                                     "artist_latitude", "artist_longitude").dropDuplicates(["artist_id"])
     
     # write artists table to parquet files
-    artists_table.write.parquet(output_data +  "artists/", mode="overwrite")
+    write_table(artists_table, os.path.join(output_data, "artists/"), files_per_partition=files_per_partition)
+
+    songs_df.unpersist()
+    return song_lookup
 
 
-def process_log_data(spark, input_data, output_data):
+def with_start_time(df):
     
     """
-    This function processes all log data JSON files from the location in the input folder 
-    and stores them in parquet format in the output folder
+    This function adds the start_time column, converted from the ts epoch milliseconds with a native
+    Spark expression so that no row is sent to a Python worker.
     
     Parameters:
-            spark       = Spark Session
-            input_data  = location of the song_data where the file is loaded to process
-            output_data = location of the results stored
-    
+            df = log events with the ts column
     """
-    # get filepath to log data file
-    log_data = input_data + 'log_data/*/*/*.json'
+    return df.withColumn("start_time", (col("ts") / 1000).cast(TimestampType()))
 
-    # read log data file
-    df = spark.read.json(log_data)
+
+def build_time_table(df):
+    
+    """
+    This function derives all the columns of the time table from start_time in a single projection.
     
-    # filter by actions for song plays
-    df = df.filter(df.page == 'NextSong')
+    Parameters:
+            df = log events with the start_time column
+    """
+    return df.select("ts", "start_time",
+                     hour("start_time").alias("hour"),
+                     dayofmonth("start_time").alias("day"),
+                     weekofyear("start_time").alias("week"),
+                     month("start_time").alias("month"),
+                     year("start_time").alias("year"),
+                     dayofweek("start_time").alias("weekday")) \
+             .drop_duplicates()
 
-    # extract columns for users table    
-    users_table = df.select("userId", "firstName", "lastName", "gender", 
-                            "level").dropDuplicates(["userId"])
+
+def build_songplays_table(df, song_lookup):
+    
+    """
+    This function matches every NextSong event with its song on title, artist name and duration.
+    The song lookup is small, so it is broadcast to the executors instead of shuffling the events,
+    and the year and month partition columns are derived from start_time without joining the time table.
+    Events without a matching song are kept with null song_id and artist_id.
+    Songs of different artist_ids can share a title, artist name and duration, so the lookup keeps the song
+    of the lowest artist_id for each of them, and every event gives exactly one songplay.
+    songplay_id is a hash of the event, so rewriting a month gives its songplays the same ids.
+    
+    Parameters:
+            df          = NextSong events with the start_time column
+            song_lookup = songs with their title, artist_name, duration, song_id and artist_id
+    """
+    songs = song_lookup.groupBy(col("title").alias("song"), 
+                                col("artist_name").alias("artist"), 
+                                col("duration").alias("length")) \
+                       .agg(spark_min(struct("artist_id", "song_id")).alias("match")) \
+                       .select("song", "artist", "length", "match.song_id", "match.artist_id")
     
-    # write users table to parquet files
-    users_table.write.parquet(os.path.join(output_data, "users/"), mode="overwrite")
+    return df.join(broadcast(songs), ["song", "artist", "length"], how="left") \
+             .select(xxhash64("ts", "userId", "sessionId", "itemInSession").alias("songplay_id"), 
+                     col("start_time"), 
+                     col("userId").alias("user_id"), 
+                     "level", "song_id", "artist_id", 
+                     col("sessionId").alias("session_id"), 
+                     "location", 
+                     col("userAgent").alias("user_agent"), 
+                     year("start_time").alias("year"), 
+                     month("start_time").alias("month"))
+
 
-    # create timestamp column from original timestamp column
-    get_timestamp = udf(lambda x: datetime.fromtimestamp(x / 1000), TimestampType())
-    df = df.withColumn("timestamp", get_timestamp(col("ts")))
+def process_log_data(spark, input_data, output_data, song_df=None, storage_level=StorageLevel.MEMORY_AND_DISK,
+                     months=None, mode="overwrite", files_per_partition=1, input_format="json"):
+    
+    """
+    This function processes all log data JSON files from the location in the input folder 
+    and stores them in parquet format in the output folder.
+    The time and songplays tables are written by year and month: with mode="overwrite" the months read replace
+    their partitions and the other months are kept, with mode="append" their rows are added to the partitions.
+    
+    Parameters:
+            spark               = Spark Session
+            input_data          = location of the song_data where the file is loaded to process
+            output_data         = location of the results stored
+            song_df             = song lookup returned by process_song_data, read back from output_data when not given
+            storage_level       = storage level used to persist the NextSong events
+            months              = (year, month) pairs of the log_data to load, all the months when None
+            mode                = "overwrite" or "append", for the time and songplays tables
+            files_per_partition = number of parquet files written in each partition of the tables
+            input_format        = "json", or "compacted" or "parquet" for the parts written by compact_data.py
     
-    # create datetime column from original timestamp column
-    get_datetime = udf(lambda x: to_date(x), TimestampType())
-    df = df.withColumn("start_time", get_timestamp(col("ts")))
+    """
+    # read log data file, only the months loaded by this run
+    df = read_input(spark, log_paths(input_data, months, input_format), log_schema, input_format)
+    
+    # filter by actions for song plays, add the start_time and persist the events for the users, time and songplays tables
+    df = with_start_time(df.filter(df.page == 'NextSong')).persist(storage_level)
+
+    # extract columns for users table, the last event of each user sets its level
+    users_table = latest_users(df)
     
+    # write users table to parquet files, an incremental run upserts the users of its events
+    write_users(spark, users_table, os.path.join(output_data, "users/"), bool(months) or mode == "append", files_per_partition,
+                os.path.join(output_data, "songplays/"))
+
     # extract columns to create time table
-    time_table = df.withColumn("hour", hour("start_time")) \
-                   .withColumn("day", dayofmonth("start_time")) \
-                   .withColumn("week", weekofyear("start_time")) \
-                   .withColumn("month", month("start_time")) \
-                   .withColumn("year", year("start_time")) \
-                   .withColumn("weekday", dayofweek("start_time")) \
-                   .select("ts", "start_time", "hour", "day", "week", "month", "year", "weekday") \
-                   .drop_duplicates()
+    time_table = build_time_table(df)
     
     # write time table to parquet files partitioned by year and month
-    time_table.write.parquet(os.path.join(output_data, "time_table/"), \
-                             mode='overwrite', partitionBy=["year","month"])
+    write_table(time_table, os.path.join(output_data, "time_table/"), ["year", "month"], mode, files_per_partition)
 
     # read in song data to use for songplays table
-    song_df = spark.read \
-                .format("parquet") \
-                .option("basePath", os.path.join(output_data, "songs/")) \
-                .load(os.path.join(output_data, "songs/*/*/"))
+    if song_df is None:
+        song_df = spark.read.parquet(os.path.join(output_data, "songs/"))
+        artists = spark.read.parquet(os.path.join(output_data, "artists/")).select("artist_id", "artist_name")
+        song_df = song_df.join(artists, "artist_id")
 
     # extract columns from joined song and log datasets to create songplays table 
-    songplays_table = df.join(song_df, df.song == song_df.title, how='inner') \
-                        .select(monotonically_increasing_id().alias("songplay_id"), 
-                                col("start_time"), 
-                                col("userId").alias("user_id"), 
-                                "level","song_id","artist_id", 
-                                col("sessionId").alias("session_id"), 
-                                "location", 
-                                col("userAgent").alias("user_agent"))
-    
-    songplays_table = songplays_table.join(time_table, songplays_table.start_time == time_table.start_time, how="inner") \
-                        .select("songplay_id", songplays_table.start_time, "user_id", "level", "song_id", 
-                        "artist_id", "session_id", "location", "user_agent", "year", "month").drop_duplicates(["user_id"])
+    songplays_table = build_songplays_table(df, song_df)
 
     # write songplays table to parquet files partitioned by year and month
-    songplays_table.write.parquet(os.path.join(output_data, "songplays/"),
-                                  mode="overwrite", partitionBy=["year", "month"])
+    write_table(songplays_table, os.path.join(output_data, "songplays/"), ["year", "month"], mode, files_per_partition)
+
+    df.unpersist()
 
 
 def main():
-    spark = create_spark_session()
-    input_data = "s3a://udacity-dend/"
-    output_data = "s3a://sparkify-udacity/"
+    parser = argparse.ArgumentParser(description="Loads the Sparkify song and log data into the data lake.")
+    parser.add_argument("--config", default="dl.cfg", help="config file with the AWS keys and the [STORAGE] locations")
+    parser.add_argument("--input", help="location of song_data and log_data, an S3 or local path, overriding the config")
+    parser.add_argument("--output", help="location of the data lake, an S3 or local path, overriding the config")
+    parser.add_argument("--input-format", choices=sorted(INPUT_FORMATS), default="json",
+                        help="format of the input, the source JSON files or the compacted or parquet parts of compact_data.py")
+    parser.add_argument("--storage-level", default="MEMORY_AND_DISK",
+                        help="storage level used to persist the song data and the NextSong events, e.g. MEMORY_ONLY")
+    parser.add_argument("--months", type=parse_months,
+                        help="months of log_data to load, e.g. 2018-11,2018-12, all of them by default")
+    parser.add_argument("--mode", choices=["overwrite", "append"], default="overwrite",
+                        help="overwrite the partitions of the months loaded, or append to them")
+    parser.add_argument("--files-per-partition", type=int, default=1,
+                        help="number of parquet files written in each partition")
+    parser.add_argument("--compact", action="store_true",
+                        help="after loading, rewrite the time and songplays partitions of the months loaded with --files-per-partition files")
+    parser.add_argument("--skip-songs", action="store_true",
+                        help="only load log_data, reading the songs and artists tables from the data lake")
+    args = parser.parse_args()
+    storage_level = getattr(StorageLevel, args.storage_level)
+
+    storage = read_storage(args.config, args.input, args.output)
+    if is_s3(storage):
+        set_aws_credentials(args.config)
+    spark = create_spark_session(storage)
+    input_data = storage.input_data
+    output_data = storage.output_data
     
-    process_song_data(spark, input_data, output_data)    
-    process_log_data(spark, input_data, output_data)
+    song_df = None
+    if not args.skip_songs:
+        song_df = process_song_data(spark, input_data, output_data, storage_level, args.files_per_partition,
+                                    args.input_format)
+    process_log_data(spark, input_data, output_data, song_df, storage_level,
+                     args.months, args.mode, args.files_per_partition, args.input_format)
+    if song_df is not None:
+        song_df.unpersist()
+
+    if args.compact:
+        for table in ["time_table/", "songplays/"]:
+            compact_table(spark, os.path.join(output_data, table), ["year", "month"], args.files_per_partition, args.months)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import random
+import string
+import argparse
+from datetime import datetime, timezone
+
+# Sizes of the Udacity datasets, generated at --scale 1: the songs of song_data,
+# the users and events of log_data, over the 30 days of November 2018.
+SONGS = 14896
+ARTISTS = 10025
+USERS = 96
+EVENTS = 8056
+DAYS = 30
+START = datetime(2018, 11, 1, tzinfo=timezone.utc)
+
+# share of the NextSong events playing a song missing from song_data, and share of the events that are not NextSong
+UNKNOWN_SONG_RATE = 0.1
+OTHER_PAGES = ['Home', 'Login', 'Logout', 'Settings', 'About', 'Help', 'Upgrade', 'Downgrade']
+OTHER_PAGE_RATE = 0.2
+
+FIRST_NAMES = ['Lily', 'Jacob', 'Kate', 'Chloe', 'Tegan', 'Ryan', 'Matthew', 'Jacqueline', 'Aleena', 'Layla']
+LAST_NAMES = ['Koch', 'Klein', 'Harrell', 'Cuevas', 'Levine', 'Smith', 'Jones', 'Lynch', 'Kirby', 'Griffin']
+LOCATIONS = ['San Francisco-Oakland-Hayward, CA', 'Chicago-Naperville-Elgin, IL-IN-WI', 'Lansing-East Lansing, MI',
+             'Atlanta-Sandy Springs-Roswell, GA', 'New York-Newark-Jersey City, NY-NJ-PA', 'Portland-South Portland, ME']
+USER_AGENTS = ['"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.143 Safari/537.36"',
+               '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/36.0.1985.125 Safari/537.36"',
+               'Mozilla/5.0 (X11; Linux x86_64; rv:31.0) Gecko/20100101 Firefox/31.0']
+
+# JSONPaths file of the Redshift COPY of log_data, in the column order of staging_events
+LOG_JSONPATHS = {"jsonpaths": ["$['artist']", "$['auth']", "$['firstName']", "$['gender']", "$['itemInSession']",
+                               "$['lastName']", "$['length']", "$['level']", "$['location']", "$['method']",
+                               "$['page']", "$['registration']", "$['sessionId']", "$['song']", "$['status']",
+                               "$['ts']", "$['userAgent']", "$['userId']"]}
+
+
+def random_id(rng, prefix):
+    return prefix + ''.join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(16))
+
+
+def generate_songs(rng, songs, artists):
+
+    """
+    This function generates the songs of song_data, as dicts shaped like the song files.
+
+    Parameters:
+            rng     = random.Random generator
+            songs   = number of songs
+            artists = number of artists
+    """
+    # the location and coordinates belong to the artist, so every song of an artist has the same ones
+    artist_rows = []
+    for i in range(artists):
+        artist_id, location = random_id(rng, 'AR'), rng.choice(LOCATIONS + [''])
+        has_coordinates = location and rng.random() < 0.5
+        artist_rows.append((artist_id, 'Artist {}'.format(i), location,
+                            round(rng.uniform(25, 48), 5) if has_coordinates else None,
+                            round(rng.uniform(-122, -71), 5) if has_coordinates else None))
+    for i in range(songs):
+        artist_id, artist_name, location, latitude, longitude = artist_rows[rng.randrange(artists)]
+        yield {"num_songs": 1,
+               "artist_id": artist_id,
+               "artist_latitude": latitude,
+               "artist_longitude": longitude,
+               "artist_location": location,
+               "artist_name": artist_name,
+               "song_id": random_id(rng, 'SO'),
+               "title": 'Song {}'.format(i),
+               "duration": round(rng.uniform(60, 600), 5),
+               "year": rng.choice([0] + list(range(1960, 2011)))}
+
+
+def write_song_data(rng, songs, output, songs_per_file=1):
+
+    """
+    This function writes the songs under output/song_data/X/Y/Z/, named after the track id of their first song
+    like the Udacity files, and returns the (title, artist_name, duration) of every song for the log events.
+
+    Parameters:
+            rng            = random.Random generator
+            songs          = songs yielded by generate_songs
+            output         = local directory of the dataset
+            songs_per_file = number of songs written as JSON lines in each file, the Udacity files have one
+    """
+    catalogue = []
+    batch = []
+
+    def flush():
+        track_id = random_id(rng, 'TR')
+        directory = os.path.join(output, 'song_data', track_id[2], track_id[3], track_id[4])
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, track_id + '.json'), 'w') as f:
+            f.write('\n'.join(json.dumps(song) for song in batch))
+        batch.clear()
+
+    for song in songs:
+        catalogue.append((song['title'], song['artist_name'], song['duration']))
+        batch.append(song)
+        if len(batch) == songs_per_file:
+            flush()
+    if batch:
+        flush()
+    return catalogue
+
+
+def generate_users(rng, users):
+    return [{"userId": str(i + 1),
+             "firstName": rng.choice(FIRST_NAMES),
+             "lastName": rng.choice(LAST_NAMES),
+             "gender": rng.choice(['F', 'M']),
+             "level": rng.choice(['free', 'paid']),
+             "location": rng.choice(LOCATIONS),
+             "userAgent": rng.choice(USER_AGENTS),
+             "registration": float(int(START.timestamp() * 1000) - rng.randrange(10 ** 10))} for i in range(users)]
+
+
+def generate_day(rng, day, events, users, catalogue, first_session):
+
+    """
+    This function generates the events of one day as sessions of consecutive events of a user,
+    playing the songs of the catalogue with a skewed popularity.
+
+    Parameters:
+            rng           = random.Random generator
+            day           = day of November 2018, from 0
+            events        = number of events of the day
+            users         = users returned by generate_users
+            catalogue     = (title, artist_name, duration) of the songs of song_data
+            first_session = id of the first session of the day
+    """
+    day_start = int(START.timestamp() * 1000) + day * 86400000
+    rows = []
+    session_id = first_session
+    while len(rows) < events:
+        user = rng.choice(users)
+        ts = day_start + rng.randrange(86400000 - 3600000)
+        for item in range(min(rng.randint(1, 40), events - len(rows))):
+            if rng.random() < OTHER_PAGE_RATE:
+                page, artist, song, length = rng.choice(OTHER_PAGES), None, None, None
+            elif rng.random() < UNKNOWN_SONG_RATE:
+                page, artist, song, length = 'NextSong', 'Unknown Artist', 'Unknown Song', round(rng.uniform(60, 600), 5)
+            else:
+                # squaring the uniform index plays the first songs of the catalogue more often than the last ones
+                page = 'NextSong'
+                song, artist, length = catalogue[int(len(catalogue) * rng.random() ** 2)]
+            rows.append({"artist": artist,
+                         "auth": "Logged In",
+                         "firstName": user["firstName"],
+                         "gender": user["gender"],
+                         "itemInSession": item,
+                         "lastName": user["lastName"],
+                         "length": length,
+                         "level": user["level"],
+                         "location": user["location"],
+                         "method": "PUT" if page == 'NextSong' else "GET",
+                         "page": page,
+                         "registration": user["registration"],
+                         "sessionId": session_id,
+                         "song": song,
+                         "status": 200,
+                         "ts": ts,
+                         "userAgent": user["userAgent"],
+                         "userId": user["userId"]})
+            ts += int(length * 1000) if length else rng.randrange(1000, 60000)
+        session_id += 1
+    rows.sort(key=lambda row: row["ts"])
+    return rows, session_id
+
+
+def write_log_data(rng, output, events, users, catalogue, days=DAYS):
+
+    """
+    This function writes the events under output/log_data/2018/11/, one file per day like the Udacity files,
+    and returns the number of events written.
+
+    Parameters:
+            rng       = random.Random generator
+            output    = local directory of the dataset
+            events    = number of events over all the days
+            users     = users returned by generate_users
+            catalogue = (title, artist_name, duration) of the songs of song_data
+            days      = number of days of November 2018
+    """
+    directory = os.path.join(output, 'log_data', '2018', '11')
+    os.makedirs(directory, exist_ok=True)
+    session_id = 1
+    count = 0
+    for day in range(days):
+        day_events = events // days + (1 if day < events % days else 0)
+        rows, session_id = generate_day(rng, day, day_events, users, catalogue, session_id)
+        with open(os.path.join(directory, '2018-11-{:02d}-events.json'.format(day + 1)), 'w') as f:
+            for row in rows:
+                f.write(json.dumps(row))
+                f.write('\n')
+        count += len(rows)
+    return count
+
+
+def generate_dataset(output, scale=1, seed=0, songs_per_file=1):
+
+    """
+    This function writes song_data, log_data and log_json_path.json under output, with scale times the rows
+    of the Udacity datasets. The same seed and scale always generate the same data.
+
+    Parameters:
+            output         = local directory of the dataset
+            scale          = multiple of the Udacity dataset sizes, e.g. 1, 10 or 100
+            seed           = seed of the random generator
+            songs_per_file = number of songs in each song_data file
+    """
+    rng = random.Random(seed)
+    songs = write_song_data(rng, generate_songs(rng, int(SONGS * scale), max(1, int(ARTISTS * scale))), output, songs_per_file)
+    events = write_log_data(rng, output, int(EVENTS * scale), generate_users(rng, max(1, int(USERS * scale))), songs)
+    with open(os.path.join(output, 'log_json_path.json'), 'w') as f:
+        json.dump(LOG_JSONPATHS, f, indent=4)
+    return len(songs), events
+
+
+def upload_dataset(output, url, endpoint=None):
+
+    """
+    This function copies the dataset to an S3 location, e.g. for the Redshift COPY of Project 3,
+    on AWS or on an S3 compatible server such as MinIO.
+
+    Parameters:
+            output   = local directory of the dataset
+            url      = destination, e.g. s3://my-bucket/sparkify-10x
+            endpoint = url of an S3 compatible server, AWS when None
+    """
+    # boto3 is only needed to upload
+    import boto3
+
+    bucket, _, prefix = url.replace('s3a://', 's3://').replace('s3://', '', 1).partition('/')
+    client = boto3.client('s3', endpoint_url=endpoint or None)
+    for root, dirs, files in os.walk(output):
+        for name in files:
+            path = os.path.join(root, name)
+            key = '/'.join(filter(None, [prefix.strip('/'), os.path.relpath(path, output).replace(os.sep, '/')]))
+            client.upload_file(path, bucket, key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a synthetic Sparkify dataset of song_data and log_data.")
+    parser.add_argument("--output", default="data/", help="local directory of the dataset")
+    parser.add_argument("--scale", type=float, default=1, help="multiple of the Udacity dataset sizes, e.g. 1, 10 or 100")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    parser.add_argument("--songs-per-file", type=int, default=1,
+                        help="number of songs in each song_data file, more keeps the number of files down at large scales")
+    parser.add_argument("--upload", metavar="URL", help="also copy the dataset to this S3 location, e.g. s3://bucket/sparkify-10x")
+    parser.add_argument("--endpoint", help="url of an S3 compatible server used by --upload instead of AWS")
+    args = parser.parse_args()
+
+    start = time.time()
+    songs, events = generate_dataset(args.output, args.scale, args.seed, args.songs_per_file)
+    print("{} songs and {} events written to {} in {:.1f}s".format(songs, events, args.output, time.time() - start))
+
+    if args.upload:
+        upload_dataset(args.output, args.upload, args.endpoint)
+        print("uploaded to {}".format(args.upload))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import configparser
+import os
+from collections import namedtuple
+
+# Where the ETL reads song_data and log_data and writes the data lake, selected by the [STORAGE] section of dl.cfg:
+#
+#   [STORAGE]
+#   INPUT_DATA = s3a://udacity-dend/        an s3a:// location, or a local path such as data/
+#   OUTPUT_DATA = s3a://sparkify-udacity/
+#   ENDPOINT = http://localhost:9000        optional, an S3 compatible server (e.g. MinIO) used instead of AWS
+#   HADOOP_AWS = org.apache.hadoop:hadoop-aws:2.7.0
+#
+# Without the section the ETL reads and writes the Udacity S3 buckets as before.
+Storage = namedtuple('Storage', ['input_data', 'output_data', 'endpoint', 'hadoop_aws'])
+
+DEFAULT_STORAGE = Storage(input_data='s3a://udacity-dend/',
+                          output_data='s3a://sparkify-udacity/',
+                          endpoint='',
+                          hadoop_aws='org.apache.hadoop:hadoop-aws:2.7.0')
+
+
+def read_storage(config_file='dl.cfg', input_data=None, output_data=None):
+
+    """
+    This function reads the storage locations from the config file, the given input_data and output_data taking precedence.
+
+    Parameters:
+            config_file = config file with the optional [STORAGE] section
+            input_data  = location of song_data and log_data overriding the config
+            output_data = location of the data lake overriding the config
+    """
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    section = config['STORAGE'] if config.has_section('STORAGE') else {}
+
+    return Storage(input_data=input_data or section.get('INPUT_DATA', DEFAULT_STORAGE.input_data),
+                   output_data=output_data or section.get('OUTPUT_DATA', DEFAULT_STORAGE.output_data),
+                   endpoint=section.get('ENDPOINT', DEFAULT_STORAGE.endpoint),
+                   hadoop_aws=section.get('HADOOP_AWS', DEFAULT_STORAGE.hadoop_aws))
+
+
+def is_s3(storage):
+
+    """
+    This function tells whether the storage reads or writes S3 locations, or only local paths.
+    """
+    return any(path.startswith(('s3://', 's3a://', 's3n://')) for path in (storage.input_data, storage.output_data))
+
+
+def spark_options(storage):
+
+    """
+    This function returns the Spark configuration needed to reach the storage.
+    Local paths need none. S3 locations need the hadoop-aws package, and an S3 compatible server its endpoint,
+    path style requests and the keys, which older hadoop-aws versions do not read from the environment.
+
+    Parameters:
+            storage = Storage returned by read_storage
+    """
+    if not is_s3(storage):
+        return {}
+
+    options = {"spark.jars.packages": storage.hadoop_aws}
+    if storage.endpoint:
+        options.update({
+            "spark.hadoop.fs.s3a.endpoint": storage.endpoint,
+            "spark.hadoop.fs.s3a.path.style.access": "true",
+            "spark.hadoop.fs.s3a.connection.ssl.enabled": str(storage.endpoint.startswith("https")).lower(),
+            "spark.hadoop.fs.s3a.access.key": os.environ.get('AWS_ACCESS_KEY_ID', ''),
+            "spark.hadoop.fs.s3a.secret.key": os.environ.get('AWS_SECRET_ACCESS_KEY', ''),
+        })
+    return options
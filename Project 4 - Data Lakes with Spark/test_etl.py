@@ -0,0 +1,180 @@
+import os
+import glob
+import json
+import shutil
+import pytest
+
+pytest.importorskip('pyspark')
+if not (os.environ.get('JAVA_HOME') or shutil.which('java')):
+    pytest.skip('no Java to run Spark', allow_module_level=True)
+
+from pyspark.sql import SparkSession
+from etl import process_song_data, process_log_data, compact_table, log_schema, with_start_time, build_time_table, \
+    build_songplays_table
+from benchmark import udf_time_table
+from generate_data import generate_dataset
+
+# Tests of etl.py in Spark local mode on a small dataset of generate_data.py, written to a temporary directory.
+# Skipped when pyspark or Java is missing.
+
+MONTH_DAYS = 30 * 86400000
+DECEMBER = 1543622400000
+
+
+@pytest.fixture(scope='module')
+def spark():
+    spark = SparkSession \
+        .builder \
+        .master("local[2]") \
+        .appName("sparkify-test") \
+        .config("spark.sql.shuffle.partitions", 8) \
+        .config("spark.sql.sources.partitionOverwriteMode", "dynamic") \
+        .config("spark.sql.session.timeZone", "UTC") \
+        .config("spark.executorEnv.TZ", "UTC") \
+        .config("spark.ui.enabled", "false") \
+        .getOrCreate()
+    yield spark
+    spark.stop()
+
+
+def add_december(input_data):
+    """
+    Copies the November log files to December, 30 days later and with the level of every event switched,
+    so the December events are the latest of each user.
+    """
+    for filepath in sorted(glob.glob(os.path.join(input_data, 'log_data', '2018', '11', '*.json'))):
+        target = os.path.join(input_data, 'log_data', '2018', '12', os.path.basename(filepath).replace('2018-11', '2018-12'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(filepath) as f, open(target, 'w') as out:
+            for line in f:
+                event = json.loads(line)
+                event['ts'] += MONTH_DAYS
+                event['level'] = 'free' if event['level'] == 'paid' else 'paid'
+                out.write(json.dumps(event) + '\n')
+
+
+def read_events(input_data):
+    events = []
+    for filepath in glob.glob(os.path.join(input_data, 'log_data', '*', '*', '*.json')):
+        with open(filepath) as f:
+            events.extend(json.loads(line) for line in f)
+    return [event for event in events if event['page'] == 'NextSong']
+
+
+def partition_files(table_path):
+    files = {}
+    for filepath in glob.glob(os.path.join(table_path, 'year=*', 'month=*', '*.parquet')):
+        partition = os.path.relpath(os.path.dirname(filepath), table_path)
+        files.setdefault(partition, {})[os.path.basename(filepath)] = os.path.getmtime(filepath)
+    return files
+
+
+@pytest.fixture(scope='module')
+def lake(spark, tmp_path_factory):
+    input_data = str(tmp_path_factory.mktemp('data'))
+    output_data = str(tmp_path_factory.mktemp('lake'))
+    generate_dataset(input_data, scale=0.05, songs_per_file=100)
+    add_december(input_data)
+    song_lookup = process_song_data(spark, input_data, output_data)
+    process_log_data(spark, input_data, output_data, song_lookup)
+    song_lookup.unpersist()
+    return input_data, output_data
+
+
+def event(ts, user_id, song, artist, length, page='NextSong'):
+    return {'artist': artist, 'auth': 'Logged In', 'firstName': 'First', 'gender': 'F', 'itemInSession': ts % 100,
+            'lastName': 'Last', 'length': length, 'level': 'free', 'location': 'Atlanta, GA', 'method': 'PUT',
+            'page': page, 'registration': 1540000000000.0, 'sessionId': 7, 'song': song, 'status': 200, 'ts': ts,
+            'userAgent': 'agent', 'userId': str(user_id)}
+
+
+def test_time_table_equals_the_udf_one(spark):
+    # the Python workers convert the UDF timestamps in UTC, the time zone of the session
+    events = [event(DECEMBER + offset, 1, 'Song One', 'Artist One', 200.5)
+              for offset in [-3600001, -500, 0, 0, 86400000 * 5 + 123, 1234567890]]
+    df = spark.createDataFrame(events, log_schema)
+    udf_time = spark.sparkContext.accumulator(0.0)
+
+    expected = udf_time_table(df, udf_time).orderBy('ts').collect()
+    assert build_time_table(with_start_time(df)).orderBy('ts').collect() == expected
+    assert len(expected) == 5
+    assert udf_time.value > 0
+
+
+def test_songplays_table(spark):
+    # two songs differing only by artist_id match the same events
+    song_lookup = spark.createDataFrame([('Song One', 'AR2', 'Artist One', 2000, 200.5, 2),
+                                         ('Song One', 'AR1', 'Artist One', 2000, 200.5, 1),
+                                         ('Song Two', 'AR3', 'Artist Two', 2001, 180.0, 3)],
+                                        'title string, artist_id string, artist_name string, year int, duration double, song_id long')
+    events = [event(DECEMBER - 500, 1, 'Song One', 'Artist One', 200.5),
+              event(DECEMBER, 1, 'Song Two', 'Artist Two', 180.0),
+              event(DECEMBER + 1000, 2, 'Song Two', 'Artist Two', 181.0),
+              event(DECEMBER + 2000, 2, 'Unknown Song', 'Unknown Artist', 100.0),
+              event(DECEMBER + 3000, 3, 'Song One', 'Artist One', 200.5)]
+    df = with_start_time(spark.createDataFrame(events, log_schema))
+
+    songplays = build_songplays_table(df, song_lookup).orderBy('start_time').collect()
+    assert len(songplays) == len(events)
+    assert len({row.songplay_id for row in songplays}) == len(events)
+    assert [(row.song_id, row.artist_id) for row in songplays] == [(1, 'AR1'), (3, 'AR3'), (None, None), (None, None),
+                                                                   (1, 'AR1')]
+    assert [(row.year, row.month) for row in songplays] == [(2018, 11)] + [(2018, 12)] * 4
+
+
+def test_songplays_of_the_lake(spark, lake):
+    # one songplay per NextSong event of the generated data, whose songs all have a distinct title, artist and duration
+    input_data, output_data = lake
+    events = read_events(input_data)
+    songplays = spark.read.parquet(os.path.join(output_data, 'songplays'))
+    assert songplays.count() == len(events)
+    assert 0 < songplays.filter('song_id IS NULL').count() < len(events) / 2
+    assert songplays.filter('(song_id IS NULL) != (artist_id IS NULL)').count() == 0
+    assert songplays.filter('year != year(start_time) OR month != month(start_time)').count() == 0
+
+
+def test_rerun_of_a_month(spark, lake):
+    input_data, output_data = lake
+    events = read_events(input_data)
+    before = {table: partition_files(os.path.join(output_data, table)) for table in ['time_table', 'songplays']}
+    assert set(before['songplays']) == {'year=2018/month=11', 'year=2018/month=12'}
+
+    # loading November again twice, with the songs read back from the data lake
+    for _ in range(2):
+        process_log_data(spark, input_data, output_data, months=[(2018, 11)])
+
+    for table in ['time_table', 'songplays']:
+        after = partition_files(os.path.join(output_data, table))
+        assert after['year=2018/month=12'] == before[table]['year=2018/month=12'], table
+        assert after['year=2018/month=11'] != before[table]['year=2018/month=11'], table
+
+    songplays = spark.read.parquet(os.path.join(output_data, 'songplays'))
+    counts = {(row.year, row.month): row['count'] for row in songplays.groupBy('year', 'month').count().collect()}
+    assert counts == {(2018, 11): len(events) // 2, (2018, 12): len(events) // 2}
+    assert songplays.select('songplay_id').distinct().count() == len(events)
+
+    # the users keep the level of their December events, the latest ones, after November is loaded again
+    latest = {}
+    for event in sorted(events, key=lambda event: event['ts']):
+        latest[event['userId']] = event['level']
+    users = spark.read.parquet(os.path.join(output_data, 'users'))
+    assert {row.userId: row.level for row in users.collect()} == latest
+
+
+def test_compact_after_append(spark, lake):
+    input_data, output_data = lake
+    songplays_path = os.path.join(output_data, 'songplays')
+    count = spark.read.parquet(songplays_path).count()
+
+    process_log_data(spark, input_data, output_data, months=[(2018, 11)], mode='append', files_per_partition=3)
+    assert len(partition_files(songplays_path)['year=2018/month=11']) > 2
+    appended = spark.read.parquet(songplays_path).count()
+    assert appended > count
+
+    for table in ['time_table', 'songplays']:
+        compact_table(spark, os.path.join(output_data, table), ['year', 'month'], 2, [(2018, 11)])
+        files = partition_files(os.path.join(output_data, table))
+        assert len(files['year=2018/month=11']) == 2, table
+    assert spark.read.parquet(songplays_path).count() == appended
+    assert not glob.glob(os.path.join(output_data, '*_staging*'))
+